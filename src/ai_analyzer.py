@@ -1,131 +1,261 @@
-import openai
+import hashlib
+import json
+import logging
 import os
 from dotenv import load_dotenv
-from rag_enhancer import RAGSystem
+from llm_client import chat_completion
+from analysis_schema import (
+    ANALYSIS_JSON_SCHEMA, PACKED_ANALYSIS_JSON_SCHEMA, SegmentAnalysis, parse_analysis, parse_packed_analysis,
+    response_format,
+)
+from criteria import CRITERIA, CRITERION_STANDARDS
+from token_planner import SECTION_MARKER, match_sections
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+ANALYSIS_MODEL = "gpt-4o"
+ANALYSIS_TEMPERATURE = 0.2
+# Completion budget for one section's analysis, and the cap for a packed request.
+ANALYSIS_MAX_TOKENS = 1000
+MAX_PACKED_ANALYSIS_TOKENS = 4000
+
 
+# What an adjudicator checks first for each criterion. Only the guide of the
+# criterion a section was routed to is sent with it.
+CRITERION_GUIDANCE = {
+    1: "Who granted the award, whether it is recognized nationally or internationally (not local, student or "
+       "employer awards), how many competed and whether it was given for excellence in the field.",
+    2: "Whether the association requires outstanding achievements of its members, judged by recognized experts, "
+       "rather than dues, a degree, employment or years in the field.",
+    3: "Whether the material is about the petitioner and their work (not a mere mention or a press release), "
+       "with title, date and author, in a professional, major trade or major media outlet (circulation, reach).",
+    4: "Proof that the petitioner actually judged (completed reviews, not invitations alone), in the same or an "
+       "allied field, confirmed by the journal, panel or organizer.",
+    5: "Whether the contributions are original and of major significance to the field as a whole: adoption by "
+       "others, licensing, citations well above the field's norm, specific independent expert letters.",
+    6: "Whether the petitioner authored the articles, and whether they appeared in professional or major trade "
+       "publications or major media for a learned audience (journal standing, citations).",
+    7: "Whether the petitioner's own work was displayed, and whether the venues are artistic exhibitions or "
+       "showcases of recognized standing rather than commercial or local displays.",
+    8: "The petitioner's actual role and its impact on the organization or division, and evidence that the "
+       "organization or establishment has a distinguished reputation.",
+    9: "Pay compared with others in the same field and area using objective wage data, backed by tax, payroll "
+       "or contract records.",
+    10: "Box-office receipts, sales or streaming figures in the performing arts, compared with others in the field.",
+}
 
-def get_eb1a_analysis_prompt():
+
+def get_analysis_system_prompt():
     """
-    This function contains the master prompt for the LLM.
-    It defines the role, context, instructions, and output format.
+    The part of the analysis prompt shared by every request: role,
+    instructions and output format. It is sent as the system message, first
+    and unchanged, so providers can reuse it from their prompt cache.
     """
-    
-    return """
+    criteria_list = "\n".join(f"    {number}. {name}" for number, name in CRITERIA.items())
+    return f"""
     **Role**: You are a meticulous and experienced USCIS Adjudicator reviewing an EB-1A, Alien of Extraordinary Ability, petition. You are fair but skeptical, and your goal is to identify any statement or claim that is not supported by strong, quantifiable evidence, as this could trigger a Request for Evidence (RFE).
 
-    **Context**: Your analysis must be based on the official standards for the EB-1A category. The petitioner must prove they meet the requirements through sustained national or international acclaim.
-
-     ---
-    **Official EB-1A Standards and Criteria (Your Guide for Evaluation):**
-
-    You must be able to demonstrate extraordinary ability in the sciences, arts, education, business, or athletics through sustained national or international acclaim.
-
-    To demonstrate this, you must meet at least 3 of the 10 criteria below, or provide evidence of a one-time achievement (i.e., Pulitzer, Oscar, Olympic Medal).
-
-    1.  Evidence of receipt of lesser nationally or internationally recognized prizes or awards for excellence
-    2.  Evidence of your membership in associations in the field which demand outstanding achievement of their members
-    3.  Evidence of published material about you in professional or major trade publications or other major media
-    4.  Evidence that you have been asked to judge the work of others, either individually or on a panel
-    5.  Evidence of your original scientific, scholarly, artistic, athletic, or business-related contributions of major significance to the field
-    6.  Evidence of your authorship of scholarly articles in professional or major trade publications or other major media
-    7.  Evidence that your work has been displayed at artistic exhibitions or showcases
-    8.  Evidence of your performance of a leading or critical role in distinguished organizations
-    9.  Evidence that you command a high salary or other significantly high remuneration in relation to others in the field
-    10. Evidence of your commercial successes in the performing arts
-    ---
+    **Context**: The petitioner must prove sustained national or international acclaim by meeting at least 3 of the 10 criteria below, or with a one-time achievement (i.e., Pulitzer, Oscar, Olympic Medal). The official standard of the criterion to check is given with each text.
+{criteria_list}
 
     **Instructions**:
-    1.  Read the following text excerpt from the petition carefully.
-    2.  First, identify which single EB-1A criterion the text is attempting to satisfy.
-    3.  Analyze the text for specific weaknesses. Look for:
+    1.  Identify which single EB-1A criterion the text is attempting to satisfy. The criterion given with the text is the likely one; name another if the text clearly addresses it instead.
+    2.  Analyze the text for specific weaknesses. Look for:
         - Vague or generalized claims (e.g., "significant contribution", "important work").
         - Lack of quantifiable data (e.g., numbers, percentages, rankings).
         - Insufficient evidence of impact beyond the applicant's immediate institution.
         - Use of weak, self-serving language or template-like phrases.
         - Claims that don't match the standard of the criterion (e.g., a local award for the 'Awards' criterion).
-    4.  If no significant weaknesses are found, state that the section is strong.
-    5.  For each weakness found, generate a detailed risk entry.
+    3.  If no significant weaknesses are found, state that the section is strong.
+    4.  For each weakness found, generate a detailed risk entry.
 
     **Output Format**:
-    Provide your entire response in a single, clean Markdown block. Do not include any text before or after the markdown block.
+    Respond with a single JSON object that follows the response schema. Do not include any text outside the JSON.
+    - "criterion_number": the number of the criterion the text addresses (1-10), or null if none applies.
+    - "criterion_name": the name of that criterion.
+    - "overall_assessment": a brief, one-sentence summary of the section's strength or weakness.
+    - "weaknesses": one entry per weakness (an empty list if the section is strong), each with
+      "severity" ("High", "Medium" or "Low"), "description", "excerpt" (the problematic text, quoted exactly)
+      and "suggestion" (a concrete improvement).
+    - "persona_notes": adopt the persona of a skeptical USCIS adjudicator and write 2-3 sentences of your internal thoughts.
 
-    ```markdown
-    **Criterion Identification**: Criterion [Number]: [Name of Criterion]
+    Example:
+    {{
+      "criterion_number": 5,
+      "criterion_name": "Original Contributions of Major Significance",
+      "overall_assessment": "The section asserts major significance but offers little independent evidence of field-wide impact.",
+      "weaknesses": [
+        {{"severity": "High", "description": "The claim of 'major significance' is conclusory and lacks independent, quantifiable evidence of field-wide adoption or impact.", "excerpt": "The applicant's development of the algorithm was a major contribution to the field.", "suggestion": "Provide specific evidence, e.g. 'This algorithm was licensed by 3 competing firms (see Exhibit D) and cited as foundational in 50+ academic papers.'"}}
+      ],
+      "persona_notes": "This looks like standard work for a senior professional, not extraordinary ability. I'm leaning towards an RFE on the 'Original Contributions' claim unless they provide more concrete proof of impact."
+    }}
+    """
 
-    **Overall Assessment**: [A brief, one-sentence summary of the section's strength or weakness.]
 
-    | Severity | Weakness Description | Problematic Excerpt | Suggested Improvement |
-    | :--- | :--- | :--- | :--- |
-    | **High** | The claim of 'major significance' is conclusory and lacks independent, quantifiable evidence of field-wide adoption or impact. | "The applicant's development of the algorithm was a major contribution to the field." | "Strengthen this claim by providing specific evidence. For instance: 'This algorithm was subsequently licensed by 3 competing firms (see Exhibit D) and cited as foundational in 50+ academic papers, demonstrating its field-wide impact.'" |
-    | **Medium** | The letter of support is from a direct supervisor, which may be perceived as biased by USCIS. | "As his manager, I can attest that his work was critical to our team." | "Supplement this letter with 2-3 letters from independent experts in the field who have not directly worked with you but are familiar with your contributions and can attest to their significance from an objective viewpoint." |
-    | **Low** | The language used is slightly generic and could be more impactful. | "The applicant did an excellent job on this project." | "Replace with more active and specific language. For example: 'The applicant single-handedly led the project, reducing production costs by 15% in the first quarter.'" |
-    
-    **Adjudicator's Persona Notes**: [Adopt the persona of a skeptical USCIS adjudicator. Write 2-3 sentences of your internal thoughts. e.g., 'This looks like standard work for a senior professional, not extraordinary ability. The letters all sound the same. I'm leaning towards an RFE on the 'Original Contributions' claim unless they provide more concrete proof of impact.']
-    ```
+def get_criterion_guide(criterion=None):
+    """
+    The criterion-specific start of the user message: the official standard
+    of the criterion the section was routed to and what to check for it, or
+    all ten standards when the section could not be routed.
+    """
+    if criterion in CRITERIA:
+        return f"""
+    **Likely criterion**: {criterion}. {CRITERIA[criterion]}
+    - Standard: {CRITERION_STANDARDS[criterion]}.
+    - Check especially: {CRITERION_GUIDANCE[criterion]}
+    """
+    standards = "\n".join(f"    {number}. {standard}" for number, standard in CRITERION_STANDARDS.items())
+    return f"""
+    **Criterion**: Not determined in advance. The official standards:
+{standards}
+    """
+
+
+def get_eb1a_analysis_prompt(criterion=None):
+    """
+    The full instructions sent ahead of a section routed to 'criterion'
+    (None when it could not be routed): the shared system prompt followed by
+    the criterion guide.
+    """
+    return get_analysis_system_prompt() + get_criterion_guide(criterion)
+
+def get_packed_instructions(section_headers):
+    """
+    Extra instructions for a request that packs several short sections, so
+    the answer can be split back into one analysis per section.
+    """
+    titles = "\n".join(f"    {SECTION_MARKER}{header}" for header in section_headers)
+    return f"""
+    **Note**: The text below contains {len(section_headers)} separate sections, each starting with a line
+    '{SECTION_MARKER}<title>'. Analyze each section on its own. Respond with {{"sections": [...]}}, one entry
+    per section with "section" (the title exactly as given after the marker) and "analysis" (the object described above):
+{titles}
+    """
+
+
+def _request_analysis(text_segment, section_headers=None, criterion=None):
+    """
+    Sends the analysis prompt and returns the raw JSON response. The shared
+    system prompt comes first, then the criterion guide and the text, so
+    the longest possible prefix is identical across requests.
+    """
+    prompt = get_criterion_guide(criterion)
+    max_tokens = ANALYSIS_MAX_TOKENS
+    schema = response_format("segment_analysis", ANALYSIS_JSON_SCHEMA)
+    if section_headers:
+        prompt += get_packed_instructions(section_headers)
+        max_tokens = min(ANALYSIS_MAX_TOKENS * len(section_headers), MAX_PACKED_ANALYSIS_TOKENS)
+        schema = response_format("packed_segment_analysis", PACKED_ANALYSIS_JSON_SCHEMA)
+    prompt += "\n    **Analyze the following text**:\n    " + text_segment
 
-    **Analyze the following text**:
+    return chat_completion(
+        model=ANALYSIS_MODEL,
+        messages=[
+            {"role": "system", "content": get_analysis_system_prompt()},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=ANALYSIS_TEMPERATURE,
+        max_tokens=max_tokens,
+        response_format=schema,
+    )
+
+
+def analysis_signature():
     """
+    Identifies everything besides the section text that shapes an analysis
+    (model, prompts, response schema). Stored analyses are only reused while
+    it is unchanged.
+    """
+    parts = [ANALYSIS_MODEL, str(ANALYSIS_TEMPERATURE), get_analysis_system_prompt(), get_criterion_guide(),
+             *(get_criterion_guide(number) for number in CRITERIA),
+             get_packed_instructions(["{header}"]), json.dumps(ANALYSIS_JSON_SCHEMA, sort_keys=True)]
+    return hashlib.sha256("\x00".join(parts).encode('utf-8')).hexdigest()[:16]
+
 
-def analyze_text_with_llm(text_segment):
+def analyze_text_with_llm(text_segment, criterion=None):
     """
-    Sends a text segment to the OpenAI API for analysis.
+    Sends a text segment to the OpenAI API for analysis and returns a
+    validated SegmentAnalysis (with 'error' set if the analysis failed).
+    'criterion' is the criterion the segment was routed to, if any.
     """
     if not OPENAI_API_KEY:
-        return "Error: OPENAI_API_KEY environment variable not set."
+        return SegmentAnalysis.failed("OPENAI_API_KEY environment variable not set.")
     
-    print(" > Sending segment to AI for analysis...")
-    prompt = get_eb1a_analysis_prompt() + text_segment
-
+    logger.info(" > Sending segment to AI for analysis...")
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.2,
-            max_tokens=1000
-        )
-        analysis = response.choices[0].message.content
-        print(" < Analysis received.")
+        analysis = parse_analysis(_request_analysis(text_segment, criterion=criterion))
+        logger.info(" < Analysis received.")
         return analysis
+    except ValueError as e:
+        logger.warning(f"The analysis could not be read: {e}")
+        return SegmentAnalysis.failed(f"Could not read the analysis. Details: {e}")
     except Exception as e:
-        print(f"An error occurred with the OpenAI API: {e}")
-        return f"Error: Could not get analysis. Details: {e}"
-    
-def  analyze_text_with_rag(text_segment, rag_system):
+        logger.error(f"An error occurred with the OpenAI API: {e}")
+        return SegmentAnalysis.failed(f"Could not get analysis. Details: {e}")
+
+
+def analyze_sections_with_llm(packed_text, section_headers, criterion=None):
+    """
+    Analyzes several short sections packed into one request. Returns
+    header -> SegmentAnalysis for the sections present in the answer.
+    """
+    if not OPENAI_API_KEY:
+        return {header: SegmentAnalysis.failed("OPENAI_API_KEY environment variable not set.")
+                for header in section_headers}
+
+    logger.info(f" > Sending {len(section_headers)} packed segments to AI for analysis...")
+    try:
+        sections = parse_packed_analysis(_request_analysis(packed_text, section_headers, criterion))
+    except ValueError as e:
+        logger.warning(f"The packed analysis could not be read: {e}")
+        return {}
+    except Exception as e:
+        logger.error(f"An error occurred with the OpenAI API: {e}")
+        return {}
+    logger.info(" < Analysis received.")
+    return match_sections(sections, section_headers)
+
+
+def enhance_with_rag(analyses, rag_system):
+    """
+    Replaces the suggestions of every weakness in the given analyses with
+    RAG-enhanced ones, using one batched RAG call for all of them. Weaknesses
+    whose RAG call failed keep the suggestion of the initial analysis.
+    """
+    weaknesses = [w for analysis in analyses for w in analysis.weaknesses]
+    if not weaknesses:
+        return
+    logger.info("\n=== Enhancing Suggestions with RAG ===")
+    suggestions = rag_system.get_enhanced_suggestions([w.description for w in weaknesses])
+    enhanced = 0
+    for weakness, suggestion in zip(weaknesses, suggestions):
+        if suggestion is not None:
+            weakness.suggestion = suggestion
+            enhanced += 1
+    if enhanced < len(weaknesses):
+        logger.info(f" < RAG: {enhanced} of {len(weaknesses)} weaknesses enhanced; "
+                    f"the others keep their original suggestion.")
+    else:
+        logger.info(f" < RAG: {len(weaknesses)} weaknesses enhanced.")
+
+
+def analyze_text_with_rag(text_segment, rag_system, criterion=None):
     """
     Analyzes a text segment by first getting a baseline analysis,
     then using RAG to enhance the suggestions in the table.
     """
-    print("=== Running Initial Analysis ===")
-    initial_analysis_md = analyze_text_with_llm(text_segment)
-    
-    if not initial_analysis_md or '|' not in initial_analysis_md:
-        return initial_analysis_md
-    
-    print("\n=== Enhancing Suggestions with RAG ===")
-    
-    lines = initial_analysis_md.strip().split('\n')
-    new_lines = []
-    
-    for line in lines:
-        # Check for a valid markdown table row
-        if line.startswith('|') and '===' not in line and 'Severity' not in line:
-            parts = [p.strip() for p in line.strip('|').split('|')]
-            if len(parts) == 4:
-                severity, weakness, exercpt, old_suggestion = parts
-                
-                enhanced_suggestion = rag_system.get_enhanced_suggestion(weakness)
-                clean_suggestion = enhanced_suggestion.replace('\n', '').replace('|', ' ')
-                
-                new_line = f"| {severity} | {weakness} | {exercpt} | {clean_suggestion} |"
-                new_lines.append(new_line)
-            else:
-                new_lines.append(line)
-        else:
-            new_lines.append(line)
-    return "\n".join(new_lines)
\ No newline at end of file
+    logger.info("=== Running Initial Analysis ===")
+    analysis = analyze_text_with_llm(text_segment, criterion)
+    enhance_with_rag([analysis], rag_system)
+    return analysis
+
+
+def analyze_sections_with_rag(packed_text, section_headers, rag_system, criterion=None):
+    """analyze_text_with_rag() for a packed request; returns header -> SegmentAnalysis."""
+    logger.info("=== Running Initial Analysis ===")
+    analyses = analyze_sections_with_llm(packed_text, section_headers, criterion)
+    enhance_with_rag(analyses.values(), rag_system)
+    return analyses
@@ -0,0 +1,194 @@
+import json
+from dataclasses import asdict, dataclass, field
+
+SEVERITIES = ("High", "Medium", "Low")
+SCHEMA_VERSION = 3
+# Version 1 files have no segment fingerprints and version 2 files no failed
+# parts; they still load.
+SUPPORTED_VERSIONS = (1, 2, 3)
+
+# JSON schema the analysis LLM must answer with (OpenAI structured outputs, strict mode).
+WEAKNESS_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "severity": {"type": "string", "enum": list(SEVERITIES)},
+        "description": {"type": "string"},
+        "excerpt": {"type": "string"},
+        "suggestion": {"type": "string"},
+    },
+    "required": ["severity", "description", "excerpt", "suggestion"],
+    "additionalProperties": False,
+}
+ANALYSIS_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "criterion_number": {"type": ["integer", "null"]},
+        "criterion_name": {"type": "string"},
+        "overall_assessment": {"type": "string"},
+        "weaknesses": {"type": "array", "items": WEAKNESS_JSON_SCHEMA},
+        "persona_notes": {"type": "string"},
+    },
+    "required": ["criterion_number", "criterion_name", "overall_assessment", "weaknesses", "persona_notes"],
+    "additionalProperties": False,
+}
+PACKED_ANALYSIS_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sections": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"section": {"type": "string"}, "analysis": ANALYSIS_JSON_SCHEMA},
+                "required": ["section", "analysis"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["sections"],
+    "additionalProperties": False,
+}
+
+
+def response_format(name, schema):
+    """The chat completions 'response_format' argument for a strict JSON schema."""
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+@dataclass(slots=True)
+class Weakness:
+    """One row of the risk table."""
+    severity: str
+    description: str
+    excerpt: str
+    suggestion: str
+
+    @classmethod
+    def from_dict(cls, data):
+        severity = str(data["severity"]).strip("* ").capitalize()
+        if severity not in SEVERITIES:
+            raise ValueError(f"Unknown severity '{data['severity']}'")
+        return cls(severity, str(data["description"]), str(data["excerpt"]), str(data["suggestion"]))
+
+
+@dataclass(slots=True)
+class SegmentAnalysis:
+    """
+    The analysis of one petition section, as produced by the LLM and
+    enhanced by RAG. 'error' is set instead when no analysis could be made.
+    'fingerprint' identifies the section text it was made from, and 'reused'
+    marks an analysis carried over unchanged from a previous run.
+    'failed_parts' numbers the parts of a split section that could not be
+    analyzed, so the findings only cover the others.
+    """
+    criterion_number: int | None = None
+    criterion_name: str = ""
+    overall_assessment: str = ""
+    weaknesses: list = field(default_factory=list)
+    persona_notes: str = ""
+    error: str | None = None
+    fingerprint: str | None = None
+    reused: bool = False
+    failed_parts: list = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Validates a decoded LLM response (or a serialized analysis) and builds the analysis."""
+        if not isinstance(data, dict):
+            raise ValueError("Analysis must be a JSON object")
+        number = data.get("criterion_number")
+        return cls(
+            criterion_number=int(number) if number is not None else None,
+            criterion_name=str(data.get("criterion_name", "")),
+            overall_assessment=str(data.get("overall_assessment", "")),
+            weaknesses=[Weakness.from_dict(w) for w in data.get("weaknesses", [])],
+            persona_notes=str(data.get("persona_notes", "")),
+            error=data.get("error"),
+            fingerprint=data.get("fingerprint"),
+            reused=bool(data.get("reused", False)),
+            failed_parts=[int(number) for number in data.get("failed_parts", [])],
+        )
+
+    @classmethod
+    def failed(cls, message):
+        return cls(error=message)
+
+    @property
+    def criterion_label(self):
+        if self.criterion_number is None:
+            return self.criterion_name or "Not identified"
+        return f"Criterion {self.criterion_number}: {self.criterion_name}"
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def merge(cls, parts):
+        """
+        Combines the analyses of the parts of a split segment, given in part
+        order. The criterion is taken from the first part that identified one.
+        Parts that failed are listed in 'failed_parts'; the others keep their
+        part numbers. If every part failed, the first failure is returned.
+        """
+        if len(parts) == 1:
+            return parts[0]
+        analyzed = [(i, p) for i, p in enumerate(parts, 1) if p.error is None]
+        if not analyzed:
+            return parts[0]
+        identified = next((p for _, p in analyzed if p.criterion_number is not None), analyzed[0][1])
+        numbered = lambda text_of: " ".join(
+            f"(Part {i}) {text_of(p)}" for i, p in analyzed if text_of(p)
+        )
+        return cls(
+            criterion_number=identified.criterion_number,
+            criterion_name=identified.criterion_name,
+            overall_assessment=numbered(lambda p: p.overall_assessment),
+            weaknesses=[w for _, p in analyzed for w in p.weaknesses],
+            persona_notes=numbered(lambda p: p.persona_notes),
+            failed_parts=[i for i, p in enumerate(parts, 1) if p.error is not None],
+        )
+
+
+def parse_analysis(raw):
+    """Decodes and validates one JSON analysis from the LLM. Raises ValueError if it is invalid."""
+    try:
+        return SegmentAnalysis.from_dict(json.loads(raw))
+    except (TypeError, KeyError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid analysis: {e}") from e
+
+
+def parse_packed_analysis(raw):
+    """Decodes a packed response into (section title, SegmentAnalysis) pairs. Raises ValueError if it is invalid."""
+    try:
+        sections = json.loads(raw)["sections"]
+        return [(str(s["section"]), SegmentAnalysis.from_dict(s["analysis"])) for s in sections]
+    except (TypeError, KeyError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid packed analysis: {e}") from e
+
+
+def dump_analyses(analyses, path, **metadata):
+    """
+    Writes header -> SegmentAnalysis as JSON so a run's results can be reused.
+    Keyword arguments are stored alongside (e.g. the analysis signature).
+    """
+    payload = {
+        "version": SCHEMA_VERSION,
+        **metadata,
+        "analyses": [{"header": header, **analysis.to_dict()} for header, analysis in analyses.items()],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=1, ensure_ascii=False)
+
+
+def load_analysis_file(path):
+    """Reads a file written by dump_analyses(). Returns (header -> SegmentAnalysis, metadata)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        payload = json.load(f)
+    if payload.get("version") not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported analysis file version {payload.get('version')}")
+    analyses = {item.pop("header"): SegmentAnalysis.from_dict(item) for item in payload.pop("analyses")}
+    return analyses, payload
+
+
+def load_analyses(path):
+    """Reads analyses written by dump_analyses(), in their original order."""
+    return load_analysis_file(path)[0]
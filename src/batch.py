@@ -0,0 +1,234 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from main import (DEFAULT_MAX_WORKERS, FAISS_INDEX_PATH, OUTPUT_DIR, REPORT_FORMATS, parse_report_formats,
+                  analyze_petition, load_rag_system)
+from llm_client import configure_rate_limits, usage_counter, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE
+from llm_cache import llm_cache
+from page_cache import file_sha256, page_cache
+from retrieval_cache import retrieval_cache
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# --- SETTINGS ---
+SUPPORTED_EXTENSIONS = ('.docx', '.pdf', '.txt')
+# Petitions analyzed at the same time. Each of them also analyzes up to
+# --workers segments concurrently, all within the shared rate limits.
+DEFAULT_PETITION_WORKERS = int(os.getenv("RFE_PETITION_WORKERS", "2"))
+CHECKPOINT_FILE = "batch_checkpoint.jsonl"
+SUMMARY_FILE = "batch_summary.json"
+
+
+def discover_petitions(source):
+    """
+    Returns the petition paths for a directory (every supported file in it,
+    recursively) or a JSON manifest: a list of paths, or {"petitions": [...]},
+    relative to the manifest's folder.
+    """
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            paths.extend(os.path.join(root, f) for f in files
+                         if f.lower().endswith(SUPPORTED_EXTENSIONS) and not f.startswith('~$'))
+        return sorted(os.path.abspath(p) for p in paths)
+
+    with open(source, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if isinstance(manifest, dict):
+        manifest = manifest.get("petitions", [])
+    base = os.path.dirname(os.path.abspath(source))
+    return [os.path.abspath(os.path.join(base, p)) for p in manifest]
+
+
+def report_path_for(petition_path, output_dir, root):
+    """One report per petition, named after its path relative to the batch root so names do not collide."""
+    relative = os.path.relpath(petition_path, root) if root else os.path.basename(petition_path)
+    stem = os.path.splitext(relative)[0].replace(os.sep, '__')
+    return os.path.join(output_dir, f"RFE_Risk_Report_{stem}.docx")
+
+
+class Checkpoint:
+    """
+    Append-only JSON-lines record of finished petitions. Every line is
+    flushed to disk as soon as a petition finishes, so a crashed batch
+    resumes where it stopped. A petition is only skipped when its content
+    hash still matches and its report exists.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by the crash.
+                    self.done[entry["path"]] = entry
+
+    def is_done(self, path, sha256):
+        entry = self.done.get(path)
+        return (entry is not None and entry["status"] == "ok" and entry["sha256"] == sha256
+                and os.path.exists(entry["report"]))
+
+    def record(self, entry):
+        with self._lock:
+            self.done[entry["path"]] = entry
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def run_batch(source, output_dir=OUTPUT_DIR, petition_workers=DEFAULT_PETITION_WORKERS,
+              segment_workers=DEFAULT_MAX_WORKERS, resume=True, report_formats=None, incremental=False):
+    """
+    Analyzes every petition of a directory or manifest with one shared RAG
+    system (embedder, index) and one OpenAI client. Petitions go through a
+    bounded queue to petition_workers threads. Writes a report per petition,
+    a checkpoint for resuming and a JSON summary. Returns the summary.
+    With incremental, a petition that changed since its last report only has
+    its new or changed sections analyzed.
+    """
+    batch_start = time.perf_counter()
+    petitions = discover_petitions(source)
+    if not petitions:
+        logger.warning(f"No petitions found in {source}.")
+        return None
+    rag_system = load_rag_system(FAISS_INDEX_PATH)
+    if rag_system is None:
+        return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if not resume and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+    root = os.path.abspath(source) if os.path.isdir(source) else None
+
+    results = {}
+    skipped = 0
+    work = queue.Queue(maxsize=max(1, petition_workers) * 2)
+
+    def worker():
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            path, sha256 = item
+            start = time.perf_counter()
+            entry = {"path": path, "sha256": sha256, "report": None, "status": "failed", "error": None}
+            try:
+                report_path = report_path_for(path, output_dir, root)
+                previous = os.path.splitext(report_path)[0] + '.json' if incremental else None
+                report = analyze_petition(path, rag_system, report_path, max_workers=segment_workers,
+                                          report_formats=report_formats, previous=previous)
+                if report:
+                    entry.update(report=report, status="ok")
+                else:
+                    entry["error"] = "No report was created."
+            except Exception as e:
+                logger.error(f"Error: analysis of {path} failed: {e}")
+                entry["error"] = str(e)
+            entry["seconds"] = round(time.perf_counter() - start, 2)
+            checkpoint.record(entry)
+            results[path] = entry
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, petition_workers))]
+    for thread in threads:
+        thread.start()
+    logger.info(f"Batch: {len(petitions)} petitions, {len(threads)} petition worker(s) x "
+                f"{segment_workers} segment worker(s).")
+    for path in petitions:
+        try:
+            sha256 = file_sha256(path)
+        except OSError as e:
+            logger.error(f"Error: cannot read {path}: {e}")
+            results[path] = {"path": path, "status": "failed", "error": str(e)}
+            continue
+        if resume and checkpoint.is_done(path, sha256):
+            results[path] = checkpoint.done[path]
+            skipped += 1
+            continue
+        work.put((path, sha256))  # Blocks while the queue is full.
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+
+    seconds = time.perf_counter() - batch_start
+    analyzed = len(results) - skipped
+    summary = {
+        "source": os.path.abspath(source),
+        "petitions": len(petitions),
+        "analyzed": analyzed,
+        "skipped_from_checkpoint": skipped,
+        "succeeded": sum(1 for r in results.values() if r["status"] == "ok"),
+        "failed": sum(1 for r in results.values() if r["status"] != "ok"),
+        "petition_workers": len(threads),
+        "segment_workers": segment_workers,
+        "seconds": round(seconds, 2),
+        "model_load_seconds": round(rag_system.load_seconds, 2),
+        "petitions_per_hour": round(analyzed * 3600 / seconds, 1) if seconds else 0.0,
+        "llm_requests": usage_counter.requests,
+        "prompt_tokens": usage_counter.prompt_tokens,
+        "cached_prompt_tokens": usage_counter.cached_prompt_tokens,
+        "completion_tokens": usage_counter.completion_tokens,
+        "page_cache": page_cache.stats(),
+        "retrieval_cache": retrieval_cache.stats(),
+        "results": [results[p] for p in petitions if p in results],
+    }
+    with open(os.path.join(output_dir, SUMMARY_FILE), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=1)
+
+    llm_cache.print_stats()
+    page_cache.print_stats()
+    retrieval_cache.print_stats()
+    usage_counter.print_stats()
+    logger.info(f"✅ Batch finished: {summary['succeeded']} succeeded, {summary['failed']} failed, "
+                 f"{skipped} skipped (already done) in {seconds:.1f}s - "
+                 f"{summary['petitions_per_hour']} petitions/hour. "
+                 f"Summary: {os.path.join(output_dir, SUMMARY_FILE)}")
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Analyze every petition in a directory or JSON manifest with one warm RAG system.",
+        epilog="Example (from root folder): python src/batch.py drafts/ --petition-workers 4",
+    )
+    parser.add_argument("source", help="Directory of petitions, or a JSON manifest listing them")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--petition-workers", type=int, default=DEFAULT_PETITION_WORKERS,
+                        help=f"Petitions analyzed concurrently (default: {DEFAULT_PETITION_WORKERS})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS,
+                        help=f"Segments analyzed concurrently per petition (default: {DEFAULT_MAX_WORKERS})")
+    parser.add_argument("--formats", type=parse_report_formats, default=REPORT_FORMATS,
+                        help="Comma-separated report formats: docx, html, json")
+    parser.add_argument("--incremental", action="store_true",
+                        help="For changed petitions, only analyze the sections that changed since their last report")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and analyze every petition again")
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE,
+                        help="Maximum OpenAI requests per minute, 0 for no limit")
+    parser.add_argument("--tpm", type=int, default=TOKENS_PER_MINUTE,
+                        help="Maximum OpenAI tokens per minute, 0 for no limit")
+    parser.add_argument("--trace", metavar="PATH", default=telemetry.TRACE_FILE,
+                        help="Write timing spans for every petition to this file")
+    parser.add_argument("--trace-format", choices=telemetry.TRACE_FORMATS, default=telemetry.TRACE_FORMAT)
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the on-disk LLM response cache and call the API for every request")
+    args = parser.parse_args()
+    telemetry.configure_logging()
+
+    configure_rate_limits(args.rpm, args.tpm)
+    telemetry.configure(args.trace, args.trace_format)
+    if args.no_cache:
+        llm_cache.bypass = True
+    run_batch(args.source, args.output_dir, args.petition_workers, args.workers, resume=not args.restart,
+              report_formats=args.formats, incremental=args.incremental)
@@ -0,0 +1,415 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLES_DIR = os.path.join(PROJECT_ROOT, 'samples')
+FAISS_INDEX_PATH = os.path.join(PROJECT_ROOT, 'faiss_index')
+
+# --- SETTINGS ---
+DEFAULT_REPEAT = 5
+# A stage counts as regressed when its p50 is this much slower than the baseline.
+DEFAULT_TOLERANCE = 0.25
+# ...and at least this much slower, so sub-millisecond noise is ignored.
+MIN_REGRESSION_MS = 1.0
+# Weakness rows per section of the synthetic report used by --report-rows.
+SYNTHETIC_ROWS_PER_SECTION = 5
+# Embedding worker counts compared by --embed-chunks.
+DEFAULT_EMBED_WORKER_COUNTS = "1,2,4"
+# Weakness descriptions used for the retrieval stages.
+BENCHMARK_QUERIES = [
+    "The claim of major significance lacks quantifiable evidence of field-wide impact.",
+    "Support letters come from direct supervisors and may be seen as biased.",
+    "The awards are institutional and not nationally recognized.",
+    "The membership does not require outstanding achievement of its members.",
+    "Published material is not about the applicant and appears in minor outlets.",
+    "Judging activity is limited to routine peer review.",
+    "The salary evidence lacks comparison with others in the field.",
+    "The leading role is not shown to be in a distinguished organization.",
+]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageRecorder:
+    """Collects the timings, item counts, API calls and memory of each benchmark stage."""
+    def __init__(self, mock_server, repeat, trace_memory=False, verbose=False):
+        self.mock_server = mock_server
+        self.repeat = repeat
+        self.trace_memory = trace_memory
+        self.verbose = verbose
+        self.results = {}
+
+    def _quiet(self):
+        return contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    def run(self, stage, fn, repeat=None, before_each=None):
+        """
+        Runs fn() 'repeat' times. fn returns the number of items it processed
+        (lines, segments, queries, rows or petitions) for the throughput.
+        A run that fails with an API error (e.g. one injected by the mock)
+        is timed and counted as failed instead of ending the benchmark.
+        """
+        from llm_client import API_ERRORS, usage_counter
+
+        seconds, items, failed_runs = [], 0, 0
+        self.mock_server.reset_counts()
+        usage_counter.reset()
+        for _ in range(repeat or self.repeat):
+            if before_each:
+                before_each()
+            with self._quiet():
+                start = time.perf_counter()
+                try:
+                    items = fn()
+                except API_ERRORS as e:
+                    failed_runs += 1
+                    if self.verbose:
+                        print(f"  ! {stage}: run failed: {e}")
+                seconds.append(time.perf_counter() - start)
+        calls = dict(self.mock_server.calls)
+        errors = dict(self.mock_server.errors)
+
+        python_peak_mb = None
+        if self.trace_memory:
+            if before_each:
+                before_each()
+            tracemalloc.start()
+            with self._quiet(), contextlib.suppress(*API_ERRORS):
+                fn()
+            python_peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+
+        mean = sum(seconds) / len(seconds)
+        self.results[stage] = {
+            "runs": len(seconds),
+            "p50_ms": float(np.percentile(seconds, 50) * 1000),
+            "p95_ms": float(np.percentile(seconds, 95) * 1000),
+            "items": items,
+            "items_per_second": items / mean if mean else 0.0,
+            "llm_calls": calls,
+            "injected_errors": errors,
+            "failed_runs": failed_runs,
+            "prompt_tokens": usage_counter.prompt_tokens,
+            "peak_rss_mb": _peak_rss_mb(),
+            "python_peak_mb": python_peak_mb,
+        }
+        r = self.results[stage]
+        print(f"  {stage:<36} p50 {r['p50_ms']:>9.1f} ms  p95 {r['p95_ms']:>9.1f} ms  "
+              f"{r['items_per_second']:>9.1f} items/s  calls {sum(calls.values()):>3}  "
+              f"errors {sum(errors.values()):>3}  failed runs {failed_runs}")
+        return r
+
+
+def run_benchmark(samples_dir=SAMPLES_DIR, index_path=FAISS_INDEX_PATH, repeat=DEFAULT_REPEAT, workers=4,
+                  latency_ms=50.0, jitter_ms=10.0, error_rate=0.0, error_status=429,
+                  embedder_backend=None, trace_memory=False, verbose=False):
+    """
+    Runs every pipeline stage on the sample petitions against a local mock
+    of the OpenAI API and returns the per-stage results.
+    """
+    from mock_openai_server import CANNED_ANALYSIS, start_mock_server
+
+    mock_server = start_mock_server(latency_ms=latency_ms, jitter_ms=jitter_ms,
+                                    error_rate=error_rate, error_status=error_status)
+    # The clients read these when they are first created, so nothing reaches the real API.
+    os.environ["OPENAI_BASE_URL"] = mock_server.url
+    os.environ["OPENAI_API_BASE"] = mock_server.url
+    os.environ["OPENAI_API_KEY"] = "mock-key"
+    if embedder_backend:
+        os.environ["RFE_EMBEDDER_BACKEND"] = embedder_backend
+
+    import ai_analyzer
+    import main
+    from analysis_schema import SegmentAnalysis, load_analyses
+    from document_parser import segment_petition, stream_document
+    from llm_cache import llm_cache
+    from page_cache import page_cache
+    from rag_enhancer import RAGSystem
+    from report_generator import create_rfe_risk_report
+    from retrieval_cache import RetrievalCache
+
+    ai_analyzer.OPENAI_API_KEY = "mock-key"
+    # Every run must reach the mock server and extract every page; cached results would hide the work.
+    llm_cache.bypass = True
+    page_cache.bypass = True
+
+    recorder = StageRecorder(mock_server, repeat, trace_memory, verbose)
+    samples = sorted(f for f in os.listdir(samples_dir) if f.lower().endswith(('.docx', '.pdf', '.txt')))
+    print(f"Benchmarking {len(samples)} samples, {repeat} runs per stage, mock latency {latency_ms:.0f}"
+          f"±{jitter_ms:.0f} ms, error rate {error_rate:.0%}:")
+
+    all_lines = {}
+    for name in samples:
+        path = os.path.join(samples_dir, name)
+        all_lines[name] = list(stream_document(path))
+        recorder.run(f"extract[{name}]", lambda: len(list(stream_document(path))))
+    for name in samples:
+        lines = all_lines[name]
+        recorder.run(f"segment[{name}]", lambda: len(segment_petition(lines)))
+
+    rag_system = RAGSystem(index_path, os.getenv("RFE_EMBEDDER_BACKEND", "torch"))
+    with recorder._quiet():
+        rag_system.warm_up()
+
+    def reset_retrieval_cache():
+        rag_system.retrieval_cache = RetrievalCache()
+
+    recorder.run("retrieval (cold)", lambda: len(rag_system.retrieve_batch(BENCHMARK_QUERIES)),
+                 before_each=reset_retrieval_cache)
+    recorder.run("retrieval (cached)", lambda: len(rag_system.retrieve_batch(BENCHMARK_QUERIES)))
+    recorder.run("rag suggestions", lambda: len(rag_system.get_enhanced_suggestions(BENCHMARK_QUERIES)),
+                 before_each=reset_retrieval_cache)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        analyses = {}
+        for name in samples:
+            path = os.path.join(samples_dir, name)
+            recorder.run(f"end to end[{name}]",
+                         lambda: main.main(path, max_workers=workers, output_dir=output_dir,
+                                           index_path=index_path) or 1,
+                         repeat=max(1, repeat // 2))
+            report_json = os.path.join(output_dir, 'RFE_Risk_Report_Real.json')
+            if os.path.exists(report_json):
+                analyses.update({f"{name}: {h}": a for h, a in load_analyses(report_json).items()})
+
+        if not analyses:
+            analyses = {f"Section {i}": SegmentAnalysis.from_dict(CANNED_ANALYSIS) for i in range(20)}
+        rows = sum(len(a.weaknesses) for a in analyses.values())
+        report_path = os.path.join(output_dir, 'benchmark_report.docx')
+        recorder.run("report", lambda: create_rfe_risk_report(analyses, report_path) or rows)
+
+    mock_server.shutdown()
+    mock_server.server_close()
+    return recorder.results
+
+
+def synthetic_analyses(rows, rows_per_section=SYNTHETIC_ROWS_PER_SECTION):
+    """A report's worth of analyses with 'rows' weakness rows in total, built from the canned analysis."""
+    from analysis_schema import SegmentAnalysis, Weakness
+    from mock_openai_server import CANNED_ANALYSIS
+
+    analyses = {}
+    for start in range(0, rows, rows_per_section):
+        analysis = SegmentAnalysis.from_dict(CANNED_ANALYSIS)
+        analysis.weaknesses = []
+        for row in range(start, min(rows, start + rows_per_section)):
+            weakness = Weakness.from_dict(CANNED_ANALYSIS["weaknesses"][row % len(CANNED_ANALYSIS["weaknesses"])])
+            weakness.description = f"{weakness.description} (row {row})"
+            analysis.weaknesses.append(weakness)
+        analyses[f"Section {start // rows_per_section + 1}: Synthetic Criterion Evidence"] = analysis
+    return analyses
+
+
+def _render_in_child(renderer, analyses, path, connection):
+    rss_before = _peak_rss_mb()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        renderer(analyses, path)
+        seconds = time.perf_counter() - start
+    connection.send((seconds, _peak_rss_mb() - rss_before, os.path.getsize(path)))
+    connection.close()
+
+
+def run_report_benchmark(rows, repeat=DEFAULT_REPEAT):
+    """
+    Renders a synthetic report with 'rows' weakness rows with every report
+    renderer, including the original python-docx one, and returns their
+    timings and peak memory. Each run happens in a forked child so its
+    peak RSS (which, unlike tracemalloc, includes lxml's C allocations)
+    is measured on its own.
+    """
+    from analysis_schema import dump_analyses
+    from report_generator import render_docx, render_docx_with_python_docx, render_html
+
+    renderers = [
+        ("python-docx (original)", render_docx_with_python_docx, ".docx"),
+        ("streamed docx", render_docx, ".docx"),
+        ("html", render_html, ".html"),
+        ("json", dump_analyses, ".json"),
+    ]
+    analyses = synthetic_analyses(rows)
+    context = multiprocessing.get_context("fork")
+    print(f"Rendering a synthetic report: {len(analyses)} sections, {rows} weakness rows, {repeat} runs per renderer:")
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, renderer, extension in renderers:
+            path = os.path.join(output_dir, f"report{extension}")
+            seconds, rss_growth, size = [], 0.0, 0
+            for _ in range(repeat):
+                receiver, sender = context.Pipe(duplex=False)
+                child = context.Process(target=_render_in_child, args=(renderer, analyses, path, sender))
+                child.start()
+                run_seconds, run_rss_growth, size = receiver.recv()
+                child.join()
+                seconds.append(run_seconds)
+                rss_growth = max(rss_growth, run_rss_growth)
+            mean = sum(seconds) / len(seconds)
+            results[f"report {rows} rows [{name}]"] = r = {
+                "runs": len(seconds),
+                "p50_ms": float(np.percentile(seconds, 50) * 1000),
+                "p95_ms": float(np.percentile(seconds, 95) * 1000),
+                "items": rows,
+                "items_per_second": rows / mean if mean else 0.0,
+                "peak_rss_growth_mb": rss_growth,
+                "output_mb": size / (1024 * 1024),
+            }
+            print(f"  {name:<24} p50 {r['p50_ms']:>9.1f} ms  p95 {r['p95_ms']:>9.1f} ms  "
+                  f"{r['items_per_second']:>9.0f} rows/s  peak RSS +{rss_growth:>6.1f} MB  "
+                  f"output {r['output_mb']:.1f} MB")
+    return results
+
+
+def run_embedding_benchmark(chunks, worker_counts, batch_size, backend=None, repeat=DEFAULT_REPEAT):
+    """
+    Splits copies of the policy manual into 'chunks' knowledge-base chunks,
+    comparing the splitter with LangChain's CharacterTextSplitter, then
+    embeds them with each number of embedding workers. Model loading is left
+    out of the embedding timings (the first run warms the workers up).
+    """
+    from langchain.text_splitter import CharacterTextSplitter
+    from build_knowledge_base import CHUNK_OVERLAP, CHUNK_SIZE, POLICY_MANUAL_PATH, ParallelEmbeddings
+    from chunking import split_text
+    from embedder import EMBEDDER_BACKEND
+
+    with open(POLICY_MANUAL_PATH, 'r', encoding='utf-8') as f:
+        manual = f.read()
+    copies = max(1, -(-chunks // max(1, len(split_text(manual, CHUNK_SIZE, CHUNK_OVERLAP)))))
+    corpus = "\n\n".join([manual] * copies)
+
+    results = {}
+    splitters = [
+        ("chunking", lambda: split_text(corpus, CHUNK_SIZE, CHUNK_OVERLAP)),
+        ("CharacterTextSplitter", lambda: CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+         .split_text(corpus)),
+    ]
+    print(f"Splitting {len(corpus) / (1024 * 1024):.1f} MB of text, {repeat} runs per splitter:")
+    for name, split in splitters:
+        seconds = []
+        for _ in range(repeat):
+            with contextlib.redirect_stderr(io.StringIO()):
+                start = time.perf_counter()
+                texts = split()
+                seconds.append(time.perf_counter() - start)
+        mean = sum(seconds) / len(seconds)
+        results[f"split [{name}]"] = r = {
+            "runs": len(seconds),
+            "p50_ms": float(np.percentile(seconds, 50) * 1000),
+            "p95_ms": float(np.percentile(seconds, 95) * 1000),
+            "items": len(texts),
+            "items_per_second": len(texts) / mean if mean else 0.0,
+            "max_chunk_chars": max(map(len, texts)),
+        }
+        print(f"  {name:<24} p50 {r['p50_ms']:>9.1f} ms  {r['items_per_second']:>9.0f} chunks/s  "
+              f"{len(texts)} chunks, longest {r['max_chunk_chars']} chars")
+
+    texts = split_text(corpus, CHUNK_SIZE, CHUNK_OVERLAP)[:chunks]
+    backend = backend or EMBEDDER_BACKEND
+    print(f"Embedding {len(texts)} chunks ({backend} backend, batch size {batch_size}) on {os.cpu_count()} CPU(s):")
+    single = None
+    for workers in worker_counts:
+        embeddings = ParallelEmbeddings(backend, batch_size, workers, min_parallel_chunks=0)
+        seconds = []
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                embeddings.embed_array(texts[:batch_size * workers * 2])
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    embeddings.embed_array(texts)
+                    seconds.append(time.perf_counter() - start)
+        finally:
+            embeddings.close()
+        mean = sum(seconds) / len(seconds)
+        rate = len(texts) / mean if mean else 0.0
+        single = single or rate
+        results[f"embed {len(texts)} chunks [{workers} workers]"] = r = {
+            "runs": len(seconds),
+            "p50_ms": float(np.percentile(seconds, 50) * 1000),
+            "p95_ms": float(np.percentile(seconds, 95) * 1000),
+            "items": len(texts),
+            "items_per_second": rate,
+            "speedup": rate / single if single else 0.0,
+        }
+        print(f"  {workers:>2} worker(s)  p50 {r['p50_ms']:>9.1f} ms  {rate:>9.0f} chunks/s  "
+              f"speedup {r['speedup']:.2f}x")
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Returns the stages whose p50 is more than 'tolerance' slower than in the baseline."""
+    regressions = []
+    for stage, r in results.items():
+        before = baseline.get(stage)
+        if (before and r["p50_ms"] > before["p50_ms"] * (1 + tolerance)
+                and r["p50_ms"] - before["p50_ms"] >= MIN_REGRESSION_MS):
+            regressions.append((stage, before["p50_ms"], r["p50_ms"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline stages on the sample petitions against a local mock OpenAI API.")
+    parser.add_argument("--samples-dir", default=SAMPLES_DIR)
+    parser.add_argument("--index-path", default=FAISS_INDEX_PATH)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Mock API latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock requests that fail (0-1)")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--embedder", choices=("torch", "onnx", "onnx-int8", "fake"),
+                        help="Embedder backend; 'fake' needs no model download but makes retrieval meaningless")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also measure each stage's peak Python allocations with tracemalloc (one extra run)")
+    parser.add_argument("--report-rows", type=int, metavar="N",
+                        help="Instead of the pipeline stages, compare the report renderers on a synthetic "
+                             "report with N weakness rows")
+    parser.add_argument("--embed-chunks", type=int, metavar="N",
+                        help="Instead of the pipeline stages, benchmark the knowledge-base splitter and embedding "
+                             "N chunks with each --embed-workers count")
+    parser.add_argument("--embed-workers", default=DEFAULT_EMBED_WORKER_COUNTS,
+                        help=f"Comma-separated embedding worker counts (default: {DEFAULT_EMBED_WORKER_COUNTS})")
+    parser.add_argument("--embed-batch-size", type=int, default=256)
+    parser.add_argument("--json", metavar="PATH", help="Write the results to this file")
+    parser.add_argument("--baseline", metavar="PATH", help="Results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    args = parser.parse_args()
+    import telemetry
+    telemetry.configure_logging()
+
+    if args.report_rows:
+        results = run_report_benchmark(args.report_rows, args.repeat)
+    elif args.embed_chunks:
+        worker_counts = [int(w) for w in args.embed_workers.split(",") if w.strip()]
+        results = run_embedding_benchmark(args.embed_chunks, worker_counts, args.embed_batch_size, args.embedder,
+                                          args.repeat)
+    else:
+        results = run_benchmark(args.samples_dir, args.index_path, args.repeat, args.workers, args.latency_ms,
+                                args.jitter_ms, args.error_rate, args.error_status, args.embedder,
+                                args.trace_memory, args.verbose)
+    print(f"Peak RSS: {_peak_rss_mb():.0f} MB")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        for stage, before, after in regressions:
+            print(f"REGRESSION {stage}: p50 {before:.1f} ms -> {after:.1f} ms")
+        if regressions:
+            sys.exit(1)
+        print(f"No stage regressed by more than {args.tolerance:.0%}.")
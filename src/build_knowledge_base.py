@@ -1,49 +1,394 @@
+import argparse
+import json
+import logging
+import multiprocessing
 import os
-from langchain_community.document_loaders import TextLoader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+import fitz  # PyMuPDF
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from chunking import split_text
+from embedder import EMBEDDER_BACKEND, EMBEDDER_BACKENDS, FAKE_BACKEND, create_embeddings
+from lexical_index import build_from_vectorstore
+from page_cache import file_sha256
+from vector_index import (DEFAULT_INDEX_PARAMS, INDEX_TYPES, VECTOR_DTYPES, convert_flat_index, flat_index,
+                          load_vectorstore, save_vectorstore)
+
+logger = logging.getLogger(__name__)
 
 # --- SETTINGS ---
 script_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(script_dir)
 POLICY_MANUAL_PATH = os.path.join(project_root, 'eb1a_policy_manual.txt')
 FAISS_INDEX_PATH = os.path.join(project_root, 'faiss_index')
-# Number of PDFs to process (starting with a small number for testing)
-#PDFS_TO_PROCESS = 20
-
-def main():
-    """Main function to build and save the knowledge base from the local policy manual file."""
-    print("=== Starting Knowledge Base Construction from USCIS Policy Manual ===")
-    
-    # Step 1: Load the source document
+# Directory of already-downloaded AAO decision PDFs (see Master_file.txt for the source URLs)
+DECISIONS_DIR = os.path.join(project_root, 'aao_decisions')
+# Records the hash and chunk ids of every ingested file so re-runs only embed what changed
+MANIFEST_PATH = os.path.join(FAISS_INDEX_PATH, 'manifest.json')
+# Files per shard. The index and manifest are saved after every shard, so an
+# interrupted build resumes from the last completed shard.
+SHARD_SIZE = 200
+# Sentence-transformers batch size used when embedding chunks
+EMBED_BATCH_SIZE = int(os.getenv("RFE_EMBED_BATCH_SIZE", "256"))
+# Processes embedding chunks, each with its own copy of the model and an equal
+# share of the CPU cores. One process per core scales far better than one
+# process using every core, as the small encoder parallelizes poorly inside.
+EMBED_WORKERS = int(os.getenv("RFE_EMBED_WORKERS", str(os.cpu_count() or 1)))
+# Fewer chunks than this are embedded in this process, without starting workers.
+MIN_PARALLEL_CHUNKS = 2048
+# Seconds between progress lines while embedding.
+PROGRESS_EVERY_SECONDS = 10
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+
+
+def _split_text(text):
+    return split_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
+
+
+def _load_and_split_pdf(path):
+    """Extracts and chunks one decision PDF. Runs in a worker process."""
+    try:
+        with fitz.open(path) as doc:
+            text = "\n".join(page.get_text() for page in doc)
+    except Exception as e:
+        logger.error(f"  - Error reading '{path}': {e}")
+        return path, []
+    return path, _split_text(text)
+
+
+_worker_embeddings = None
+
+
+def _init_embed_worker(backend, batch_size, threads):
+    """Loads the model once per embedding worker, limited to its share of the cores."""
+    global _worker_embeddings
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_embeddings = create_embeddings(backend, batch_size)
+
+
+def _embed_batch(texts):
+    return np.asarray(_worker_embeddings.embed_documents(texts), dtype=np.float32)
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class ParallelEmbeddings(Embeddings):
+    """
+    Embeds documents in encoder batches across a pool of worker processes,
+    printing progress and an ETA. Small calls and queries use a model in
+    this process, which is only loaded when first needed.
+    """
+    def __init__(self, backend=EMBEDDER_BACKEND, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS,
+                 min_parallel_chunks=MIN_PARALLEL_CHUNKS):
+        self.backend = backend
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.min_parallel_chunks = min_parallel_chunks
+        self._local = None
+        self._pool = None
+
+    @property
+    def local(self):
+        if self._local is None:
+            self._local = create_embeddings(self.backend, self.batch_size)
+        return self._local
+
+    def _get_pool(self):
+        if self._pool is None:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            logger.info(f"  - Starting {self.workers} embedding workers ({threads} thread(s) each)...")
+            # Spawned, not forked: torch's thread pools do not survive a fork.
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_embed_worker,
+                                             initargs=(self.backend, self.batch_size, threads))
+        return self._pool
+
+    def embed_query(self, text):
+        return self.local.embed_query(text)
+
+    def embed_documents(self, texts):
+        return self.embed_array(texts).tolist()
+
+    def embed_array(self, texts):
+        """Embeds texts into a float32 array, one row per text, in the order given."""
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if self.workers > 1 and len(texts) >= self.min_parallel_chunks:
+            results = self._get_pool().map(_embed_batch, batches)
+        else:
+            results = (np.asarray(self.local.embed_documents(batch), dtype=np.float32) for batch in batches)
+
+        arrays, done = [], 0
+        start = last_report = time.perf_counter()
+        for batch, result in zip(batches, results):
+            arrays.append(result)
+            done += len(batch)
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_EVERY_SECONDS and done < len(texts):
+                rate = done / (now - start)
+                logger.info(f"  - Embedded {done}/{len(texts)} chunks ({rate:.0f} chunks/s, "
+                            f"ETA {_format_seconds((len(texts) - done) / rate)})")
+                last_report = now
+        seconds = time.perf_counter() - start
+        if not arrays:
+            return np.zeros((0, 0), dtype=np.float32)
+        logger.info(f"  - Embedded {len(texts)} chunks in {_format_seconds(seconds)} "
+                    f"({len(texts) / seconds if seconds else 0.0:.0f} chunks/s).")
+        return np.vstack(arrays)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {"files": {}}
+    with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def _load_vectorstore(embeddings, manifest, vector_dtype):
+    """
+    Loads the existing index for incremental updates, in the requested
+    vector precision. Chunks that are not in the manifest (left behind by an
+    interrupted shard) are removed. Returns None when there is nothing to
+    build on.
+    """
+    if not os.path.exists(os.path.join(FAISS_INDEX_PATH, 'index.faiss')):
+        return None
+    if not os.path.exists(MANIFEST_PATH):
+        logger.info(f"Note: '{FAISS_INDEX_PATH}' has no manifest, so it will be rebuilt from scratch.")
+        return None
+
+    vectorstore = load_vectorstore(FAISS_INDEX_PATH, embeddings, for_update=True)
+    vectorstore.index = convert_flat_index(vectorstore.index, vector_dtype)
+    known_ids = {chunk_id for entry in manifest["files"].values() for chunk_id in entry["chunk_ids"]}
+    orphan_ids = [i for i in vectorstore.index_to_docstore_id.values() if i not in known_ids]
+    if orphan_ids:
+        logger.info(f"Removing {len(orphan_ids)} chunks left over from an interrupted build.")
+        vectorstore.delete(orphan_ids)
+    return vectorstore
+
+
+def _add_chunks(vectorstore, embeddings, texts, metadatas, vector_dtype):
+    """Embeds the chunks in large batches and appends them to the index without rebuilding it."""
+    ids = [str(uuid.uuid4()) for _ in texts]
+    vectors = embeddings.embed_array(texts)
+    if vectorstore is None:
+        vectorstore = FAISS(embeddings, flat_index(vectors.shape[1], vector_dtype), InMemoryDocstore(), {})
+    vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+    return vectorstore, ids
+
+
+def _remove_stale(vectorstore, manifest, stale_keys):
+    stale_ids = [i for key in stale_keys for i in manifest["files"][key]["chunk_ids"]]
+    if stale_ids and vectorstore is not None:
+        vectorstore.delete(stale_ids)
+    for key in stale_keys:
+        del manifest["files"][key]
+    if stale_keys:
+        logger.info(f"Removed {len(stale_ids)} chunks from {len(stale_keys)} changed or deleted files.")
+
+
+def ingest_policy_manual(vectorstore, embeddings, manifest, vector_dtype):
+    """Adds the USCIS policy manual to the index if it is new or has changed."""
+    key = os.path.basename(POLICY_MANUAL_PATH)
+    sha = file_sha256(POLICY_MANUAL_PATH)
+    entry = manifest["files"].get(key)
+    if entry and entry["sha256"] == sha:
+        logger.info("Policy manual unchanged, skipping.")
+        return vectorstore
+
+    if entry:
+        _remove_stale(vectorstore, manifest, [key])
+
+    with open(POLICY_MANUAL_PATH, 'r', encoding='utf-8') as f:
+        text = f.read()
+    logger.info(f"Succesfully loaded the policy manual.")
+
+    logger.info("Splitting documents into chunks...")
+    texts = _split_text(text)
+    logger.info(f"Created {len(texts)} text chunks.")
+
+    if texts:
+        metadatas = [{"source": POLICY_MANUAL_PATH} for _ in texts]
+        vectorstore, ids = _add_chunks(vectorstore, embeddings, texts, metadatas, vector_dtype)
+    else:
+        logger.warning("Warning: the policy manual has no text to index.")
+        ids = []
+    manifest["files"][key] = {"sha256": sha, "chunk_ids": ids}
+    if vectorstore is not None:
+        save_vectorstore(vectorstore, FAISS_INDEX_PATH)
+    save_manifest(manifest)
+    return vectorstore
+
+
+def ingest_decisions(vectorstore, embeddings, manifest, decisions_dir, vector_dtype, workers=None, limit=None):
+    """
+    Incrementally ingests a directory of AAO decision PDFs. Text is extracted
+    in a process pool, and only new or changed files are embedded. Progress is
+    saved after every shard.
+    """
+    pdf_paths = []
+    for root, _, files in os.walk(decisions_dir):
+        for name in sorted(files):
+            if name.lower().endswith('.pdf'):
+                pdf_paths.append(os.path.join(root, name))
+    pdf_paths.sort()
+    if limit:
+        pdf_paths = pdf_paths[:limit]
+    logger.info(f"Found {len(pdf_paths)} decision PDFs in '{decisions_dir}'.")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        hashes = dict(zip(pdf_paths, executor.map(file_sha256, pdf_paths, chunksize=32)))
+
+        # Manifest keys are relative to the decisions directory so it can be moved.
+        keys = {path: os.path.join('decisions', os.path.relpath(path, decisions_dir)) for path in pdf_paths}
+        present = set(keys.values())
+        # With --limit the remaining files are just not listed, not deleted.
+        deleted = [] if limit else [key for key in manifest["files"]
+                                    if key.startswith('decisions' + os.sep) and key not in present]
+        changed = [keys[path] for path in pdf_paths
+                   if keys[path] in manifest["files"] and manifest["files"][keys[path]]["sha256"] != hashes[path]]
+        _remove_stale(vectorstore, manifest, deleted + changed)
+
+        pending = [path for path in pdf_paths if keys[path] not in manifest["files"]]
+        logger.info(f"{len(pdf_paths) - len(pending)} decisions already indexed, {len(pending)} to embed.")
+
+        for start in range(0, len(pending), SHARD_SIZE):
+            shard = pending[start:start + SHARD_SIZE]
+            logger.info(f"Shard {start // SHARD_SIZE + 1}: extracting {len(shard)} PDFs...")
+            texts, metadatas, owners = [], [], []
+            for path, chunks in executor.map(_load_and_split_pdf, shard, chunksize=4):
+                for chunk in chunks:
+                    texts.append(chunk)
+                    metadatas.append({"source": path})
+                    owners.append(path)
+
+            if texts:
+                logger.info(f"  - Embedding {len(texts)} chunks...")
+                vectorstore, ids = _add_chunks(vectorstore, embeddings, texts, metadatas, vector_dtype)
+            else:
+                ids = []
+
+            chunk_ids = {path: [] for path in shard}
+            for path, chunk_id in zip(owners, ids):
+                chunk_ids[path].append(chunk_id)
+            for path in shard:
+                manifest["files"][keys[path]] = {
+                    "sha256": hashes[path], "chunk_ids": chunk_ids[path],
+                }
+
+            if vectorstore is not None:
+                save_vectorstore(vectorstore, FAISS_INDEX_PATH)
+            save_manifest(manifest)
+            logger.info(f"  - Saved progress: {start + len(shard)}/{len(pending)} decisions.")
+    return vectorstore
+
+
+def main(decisions_dir=None, workers=None, limit=None, rebuild=False, index_type="flat", index_params=None,
+         embed_workers=EMBED_WORKERS, embed_batch_size=EMBED_BATCH_SIZE, embedder_backend=EMBEDDER_BACKEND):
+    """Main function to build or incrementally update the knowledge base."""
+    logger.info("=== Starting Knowledge Base Construction ===")
+
+    # Step 1: Check the source documents
     if not os.path.exists(POLICY_MANUAL_PATH):
-        print(f"Error: Policy manual file not found at '{POLICY_MANUAL_PATH}'")
-        print("Please create the file and paste the USCIS EB-1A policy manual text into it.")
+        logger.error(f"Error: Policy manual file not found at '{POLICY_MANUAL_PATH}'")
+        logger.error("Please create the file and paste the USCIS EB-1A policy manual text into it.")
         return
-    
-    loader = TextLoader(POLICY_MANUAL_PATH, encoding="utf-8")
-    documents = loader.load()
-    print(f"Succesfully loaded the policy manual.")
-    
-    # Step 2: Split documents into chunks
-    print("Splitting documents into chunks...")
-    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    chunks = text_splitter.split_documents(documents)
-    print(f"Created {len(chunks)} text chunks.")
-    
-    # Step 3: Create embeddings and build FAISS vector store
-    print("Creating embeddings and building the FAISS vector store...")
-    print("(This may take some time and download a model on the first run)")
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    vectorstore = FAISS.from_documents(chunks, embeddings)
-    print("Vector store created successfully.")
-    
-    # Step 4: Save the vector store to disk
-    if os.path.exists(FAISS_INDEX_PATH):
-        print(f"Note: Overwriting exisiting index at '{FAISS_INDEX_PATH}'")
-    vectorstore.save_local(FAISS_INDEX_PATH)
-    print(f"✅ Knowledge base successfully built and saved to '{FAISS_INDEX_PATH}'")
+
+    os.makedirs(FAISS_INDEX_PATH, exist_ok=True)
+    manifest = {"files": {}} if rebuild else load_manifest()
+
+    # Step 2: Load the existing index so only new or changed documents are embedded
+    logger.info("(This may take some time and download a model on the first run)")
+    embeddings = ParallelEmbeddings(embedder_backend, embed_batch_size, embed_workers)
+    vector_dtype = {**DEFAULT_INDEX_PARAMS, **(index_params or {})}["vector_dtype"]
+    vectorstore = None if rebuild else _load_vectorstore(embeddings, manifest, vector_dtype)
+    if vectorstore is None:
+        manifest = {"files": {}}
+
+    # Step 3: Embed the policy manual and any AAO decisions
+    try:
+        vectorstore = ingest_policy_manual(vectorstore, embeddings, manifest, vector_dtype)
+        if decisions_dir:
+            if os.path.isdir(decisions_dir):
+                vectorstore = ingest_decisions(vectorstore, embeddings, manifest, decisions_dir, vector_dtype,
+                                               workers, limit)
+            else:
+                logger.warning(f"Warning: decisions directory '{decisions_dir}' not found, skipping AAO decisions.")
+    finally:
+        embeddings.close()
+
+    if vectorstore is None:
+        logger.error("Error: no text to index. Paste the policy manual into "
+                     f"'{POLICY_MANUAL_PATH}' or pass --decisions-dir.")
+        return
+
+    # Step 4: Save the serving index. Shards above only update the flat master index;
+    # the ANN index and the BM25 index are derived from it once at the end.
+    save_vectorstore(vectorstore, FAISS_INDEX_PATH, index_type, index_params)
+    build_from_vectorstore(vectorstore, FAISS_INDEX_PATH)
+
+    logger.info(f"✅ Knowledge base successfully built and saved to '{FAISS_INDEX_PATH}' "
+                f"({vectorstore.index.ntotal} chunks from {len(manifest['files'])} files)")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build or incrementally update the FAISS knowledge base.")
+    parser.add_argument("--decisions-dir", default=DECISIONS_DIR if os.path.isdir(DECISIONS_DIR) else None,
+                        help="Directory of downloaded AAO decision PDFs to ingest")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes used for PDF text extraction (default: CPU count)")
+    parser.add_argument("--embed-workers", type=int, default=EMBED_WORKERS,
+                        help=f"Processes used for embedding, each loading the model (default: {EMBED_WORKERS})")
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE,
+                        help=f"Chunks per encoder batch (default: {EMBED_BATCH_SIZE})")
+    parser.add_argument("--embedder", choices=EMBEDDER_BACKENDS + (FAKE_BACKEND,), default=EMBEDDER_BACKEND,
+                        help="Embedder backend; 'fake' builds a throwaway index for testing without the model")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Only ingest the first N decision PDFs (useful for testing)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Ignore the manifest and rebuild the index from scratch")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat",
+                        help="Index used for retrieval. IVF/PQ/HNSW scale to hundreds of thousands of chunks.")
+    parser.add_argument("--nlist", type=int, default=DEFAULT_INDEX_PARAMS["nlist"],
+                        help="IVF cells (default: 4 * sqrt(number of chunks))")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_INDEX_PARAMS["nprobe"],
+                        help="IVF cells searched per query")
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_INDEX_PARAMS["pq_m"],
+                        help="Product-quantizer sub-vectors for ivf_pq")
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_INDEX_PARAMS["hnsw_m"],
+                        help="Graph neighbours per node for hnsw")
+    parser.add_argument("--ef-search", type=int, default=DEFAULT_INDEX_PARAMS["ef_search"],
+                        help="HNSW search breadth")
+    parser.add_argument("--vector-dtype", choices=VECTOR_DTYPES, default=DEFAULT_INDEX_PARAMS["vector_dtype"],
+                        help="Precision the vectors are stored in; float16 halves the index size")
+    args = parser.parse_args()
+    import telemetry
+    telemetry.configure_logging()
+    index_params = {"nlist": args.nlist, "nprobe": args.nprobe, "pq_m": args.pq_m,
+                    "hnsw_m": args.hnsw_m, "ef_search": args.ef_search, "vector_dtype": args.vector_dtype}
+    main(args.decisions_dir, args.workers, args.limit, args.rebuild, args.index_type, index_params,
+         args.embed_workers, args.embed_batch_size, args.embedder)
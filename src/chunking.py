@@ -0,0 +1,126 @@
+import bisect
+import re
+
+# --- SETTINGS ---
+# Words after which a period does not end a sentence (compared lowercased,
+# without the final period). Single letters, e.g. initials, never end one either.
+ABBREVIATIONS = frozenset("""
+al app art cf cir cl co corp ct dec dept dr e.g etc ex fed fig govt i.e id inc ina jr ltd mr mrs ms no nos
+p pp para pl pub reg rev sec secs ser st supp u.s u.s.c c.f.r v vs vol
+""".split())
+
+_PARAGRAPH = re.compile(r'\n[ \t]*\n\s*')
+# End of a sentence: closing punctuation (and quotes, brackets or footnote
+# markers such as "[12]"), whitespace, then something that can start a sentence.
+_SENTENCE_END = re.compile(r'[.!?]["\'”’)\]]*(?:\[\d+\])*\s+(?=["\'“‘(\[]?[A-Z0-9§])')
+_LAST_WORD = re.compile(r'([A-Za-z][A-Za-z.&]*)\.$')
+# Citations AAO decisions use: 8 C.F.R. § 204.5(h)(3)(viii), section 203(b)(1)(A)
+# of the Act, 8 U.S.C. § 1153(b)(1)(A), Matter of Chawathe, 25 I&N Dec. 369,
+# 376 (AAO 2010), Kazarian v. USCIS, 596 F.3d 1115, 1122 (9th Cir. 2010) and
+# 6 USCIS-PM F.2(B)(1). A chunk never ends inside one.
+_CITATION = re.compile(
+    r"\d+\s+(?:C\.\s?F\.\s?R\.|U\.\s?S\.\s?C\.)\s+(?:§+\s*)?\d+[a-z]?(?:\.\d+)*(?:\([A-Za-z0-9]+\))*"
+    r"|§+\s*\d+[a-z]?(?:\.\d+)*(?:\([A-Za-z0-9]+\))*"
+    r"|\d+\s+(?:I&N\s+Dec\.|F\.\s?(?:Supp\.\s?)?(?:[234]d|4th)?|U\.S\.|S\.\s?Ct\.|F\.\s?App'x)\s+\d+"
+    r"(?:,\s*\d+(?:-\d+)?)*(?:\s+\([^()]{0,40}?\d{4}\))?"
+    r"|\d+\s+USCIS-PM\s+[A-Z]\.\d+(?:\([A-Za-z0-9]+\))*"
+)
+
+
+def _citation_spans(text):
+    spans = [m.span() for m in _CITATION.finditer(text)]
+    return [start for start, _ in spans], [end for _, end in spans]
+
+
+def _inside(position, starts, ends):
+    i = bisect.bisect_right(starts, position) - 1
+    return i >= 0 and position < ends[i]
+
+
+def split_sentences(text):
+    """
+    Splits a paragraph into sentences. A period after an abbreviation
+    ("Dec.", "v.", "C.F.R.") or an initial, or inside a legal citation,
+    does not end a sentence. Line breaks inside a sentence are kept.
+    """
+    starts, ends = _citation_spans(text)
+    sentences, start = [], 0
+    for match in _SENTENCE_END.finditer(text):
+        end = match.start()
+        if _inside(end, starts, ends):
+            continue
+        if text[end] == '.':
+            word = _LAST_WORD.search(text, max(start, end - 24), end + 1)
+            if word and (len(word.group(1)) == 1 or word.group(1).lower() in ABBREVIATIONS):
+                continue
+        sentences.append(text[start:match.end()].strip())
+        start = match.end()
+    if start < len(text) and text[start:].strip():
+        sentences.append(text[start:].strip())
+    return sentences
+
+
+def _split_long(sentence, chunk_size):
+    """Cuts a sentence longer than chunk_size at whitespace, outside citations where possible."""
+    if len(sentence) <= chunk_size:
+        return [sentence]
+    starts, ends = _citation_spans(sentence)
+    pieces = []
+    while len(sentence) > chunk_size:
+        cut = sentence.rfind(' ', 1, chunk_size)
+        while cut > 0 and _inside(cut, starts, ends):
+            cut = sentence.rfind(' ', 1, cut)
+        if cut <= 0:
+            cut = chunk_size
+        pieces.append(sentence[:cut].strip())
+        sentence = sentence[cut:].lstrip()
+        starts, ends = _citation_spans(sentence)
+    if sentence:
+        pieces.append(sentence)
+    return pieces
+
+
+def split_text(text, chunk_size, chunk_overlap):
+    """
+    Splits text into chunks of at most chunk_size characters at paragraph
+    and sentence boundaries, never inside a legal citation. A chunk starts
+    with the last sentences of the previous one, up to chunk_overlap
+    characters, so a passage cut between chunks is still found whole.
+    """
+    units = []  # (text, separator before it)
+    for paragraph in _PARAGRAPH.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        sentences = [paragraph] if len(paragraph) <= chunk_size else split_sentences(paragraph)
+        separator = "\n\n"
+        for sentence in sentences:
+            for piece in _split_long(sentence, chunk_size):
+                units.append((piece, separator))
+                separator = " "
+
+    chunks, current, size = [], [], 0
+    for unit, separator in units:
+        added = len(unit) + (len(separator) if current else 0)
+        if current and size + added > chunk_size:
+            chunks.append(_join(current))
+            overlap, overlap_size = [], 0
+            for previous in reversed(current):
+                if overlap_size + len(previous[0]) + 1 > chunk_overlap:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += len(previous[0]) + 1
+            current = overlap
+            size = sum(len(t) for t, _ in current) + sum(len(s) for _, s in current[1:])
+            added = len(unit) + (len(separator) if current else 0)
+            if current and size + added > chunk_size:
+                current, size, added = [], 0, len(unit)
+        current.append((unit, separator))
+        size += added
+    if current:
+        chunks.append(_join(current))
+    return chunks
+
+
+def _join(units):
+    return units[0][0] + "".join(separator + text for text, separator in units[1:])
@@ -0,0 +1,99 @@
+import re
+
+# The ten EB-1A criteria, as numbered in 8 CFR 204.5(h)(3).
+CRITERIA = {
+    1: "Awards",
+    2: "Membership",
+    3: "Published Material",
+    4: "Judging",
+    5: "Original Contributions",
+    6: "Scholarly Articles",
+    7: "Artistic Exhibitions",
+    8: "Leading or Critical Role",
+    9: "High Salary",
+    10: "Commercial Success",
+}
+
+# The evidence each criterion asks for, as worded by USCIS.
+CRITERION_STANDARDS = {
+    1: "Evidence of receipt of lesser nationally or internationally recognized prizes or awards for excellence",
+    2: "Evidence of your membership in associations in the field which demand outstanding achievement of their members",
+    3: "Evidence of published material about you in professional or major trade publications or other major media",
+    4: "Evidence that you have been asked to judge the work of others, either individually or on a panel",
+    5: "Evidence of your original scientific, scholarly, artistic, athletic, or business-related contributions of "
+       "major significance to the field",
+    6: "Evidence of your authorship of scholarly articles in professional or major trade publications or other "
+       "major media",
+    7: "Evidence that your work has been displayed at artistic exhibitions or showcases",
+    8: "Evidence of your performance of a leading or critical role in distinguished organizations",
+    9: "Evidence that you command a high salary or other significantly high remuneration in relation to others in "
+       "the field",
+    10: "Evidence of your commercial successes in the performing arts",
+}
+
+# The criteria as petitions usually name them in headers.
+CRITERION_NAMES = {
+    1: ("prizes", "awards"),
+    2: ("membership", "memberships", "associations"),
+    3: ("published material",),
+    4: ("judging", "judge of the work", "judge the work"),
+    5: ("original contribution", "original contributions", "original scientific", "original discover",
+        "major significance"),
+    6: ("scholarly articles", "authorship"),
+    7: ("artistic exhibitions", "exhibitions or showcases", "display of"),
+    8: ("leading or critical role", "critical role", "leading role"),
+    9: ("high salary", "remuneration"),
+    10: ("commercial success", "commercial successes"),
+}
+
+# Words that point to a criterion in the body of a section.
+CRITERION_KEYWORDS = {
+    1: ("award", "awarded", "prize", "medal", "honor", "recipient", "winner", "fellowship"),
+    2: ("member", "membership", "association", "society", "fellow of", "elected"),
+    3: ("article about", "featured", "interview", "news", "coverage", "media", "magazine", "newspaper"),
+    4: ("judge", "judging", "reviewer", "peer review", "reviewed", "panel", "editorial board", "committee"),
+    5: ("contribution", "original", "impact", "adopted", "cited", "patent", "innovation", "breakthrough"),
+    6: ("author", "authored", "publication", "journal", "paper", "conference proceedings", "scholarly"),
+    7: ("exhibition", "exhibited", "gallery", "showcase", "displayed", "museum"),
+    8: ("leading role", "critical role", "led", "director", "head of", "founder", "distinguished organization"),
+    9: ("salary", "remuneration", "compensation", "wage", "earn", "percentile"),
+    10: ("box office", "sales", "commercial success", "streams", "revenue", "ticket"),
+}
+
+# Minimum keyword hits for a body-text classification to count.
+MIN_KEYWORD_HITS = 3
+# Only the start of a section is scanned for keywords.
+CLASSIFY_SAMPLE_CHARS = 4000
+
+_CRITERION_NUMBER = re.compile(r'\bcriterion\s+(\d{1,2})\b', re.IGNORECASE)
+_NAME_PATTERNS = {
+    number: re.compile("|".join(re.escape(name) for name in names), re.IGNORECASE)
+    for number, names in CRITERION_NAMES.items()
+}
+_KEYWORD_PATTERNS = {
+    number: re.compile(r"\b(?:" + "|".join(re.escape(word) for word in words) + r")", re.IGNORECASE)
+    for number, words in CRITERION_KEYWORDS.items()
+}
+
+
+def classify_criterion(header, text=""):
+    """
+    Guesses which EB-1A criterion a section addresses without calling the LLM.
+    An explicit 'Criterion N' or a criterion name in the header wins; otherwise
+    the criterion whose keywords appear most often in the text is returned.
+    Returns the criterion number (1-10), or None when there is no clear match.
+    """
+    match = _CRITERION_NUMBER.search(header)
+    if match and int(match.group(1)) in CRITERIA:
+        return int(match.group(1))
+    for number, pattern in _NAME_PATTERNS.items():
+        if pattern.search(header):
+            return number
+
+    sample = text[:CLASSIFY_SAMPLE_CHARS]
+    hits = sorted(((len(pattern.findall(sample)), number) for number, pattern in _KEYWORD_PATTERNS.items()),
+                  reverse=True)
+    (best_hits, best), (runner_up_hits, _) = hits[0], hits[1]
+    if best_hits >= MIN_KEYWORD_HITS and best_hits > runner_up_hits:
+        return best
+    return None
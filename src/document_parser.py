@@ -1,27 +1,351 @@
 import docx
 import fitz  # PyMuPDF
+import hashlib
+import logging
+import os
 import re
-import openai
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from header_detector import CONFIDENCE_THRESHOLD, HeaderDetector, LayoutLine
+from incremental import segment_fingerprint
+from llm_client import chat_completion
+from page_cache import file_sha256, page_cache
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# --- SETTINGS ---
+# PDFs with at least this many pages are extracted by a pool of processes.
+PARALLEL_PAGE_THRESHOLD = 200
+# Pages handed to a worker process at a time.
+PAGES_PER_TASK = 50
+PDF_EXTRACT_WORKERS = int(os.getenv("RFE_PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+# Characters of the document sent to the LLM to detect its structure.
+HEADER_SAMPLE_CHARS = 8000
+# The lines kept for the LLM fallback of segment_petition() move from memory
+# to a temporary file beyond this many bytes.
+SPOOL_MAX_BYTES = 1 << 20
+# Page classification. A page with at most BLANK_PAGE_MAX_CHARS non-whitespace
+# characters is blank; one with fewer than IMAGE_PAGE_MAX_CHARS whose images
+# cover at least IMAGE_COVERAGE_THRESHOLD of it is a scan without a text layer
+# (a stamp or an exhibit label may still be text). A page with at least
+# DUPLICATE_MIN_CHARS repeating an earlier page's text, page numbers aside, is
+# a duplicate.
+BLANK_PAGE_MAX_CHARS = 10
+IMAGE_PAGE_MAX_CHARS = 200
+IMAGE_COVERAGE_THRESHOLD = 0.5
+DUPLICATE_MIN_CHARS = 200
+PAGE_TEXT, PAGE_BLANK, PAGE_IMAGE_ONLY, PAGE_DUPLICATE = "text", "blank", "image-only", "duplicate"
+# Page kinds left out of the text; the others are only reported.
+SKIP_PAGE_KINDS = frozenset(kind.strip() for kind in os.getenv("RFE_SKIP_PAGES", "blank,image-only,duplicate").split(",")
+                            if kind.strip())
+
+_PAGE_NUMBER_LINE = re.compile(r'^[^\w\n]*(?:page\s+)?\d+(?:\s+of\s+\d+)?[^\w\n]*$', re.IGNORECASE | re.MULTILINE)
+
+
+class DocumentReadError(Exception):
+    """A document could not be read to the end."""
+
+
+def extractor_version():
+    """
+    Identifies what a cached page depends on: the PyMuPDF build, the page
+    classification thresholds and the LayoutLine format. Cached pages made
+    with another version are extracted again.
+    """
+    settings = (fitz.VersionBind, BLANK_PAGE_MAX_CHARS, IMAGE_PAGE_MAX_CHARS, IMAGE_COVERAGE_THRESHOLD,
+                LayoutLine._fields)
+    return hashlib.sha256(repr(settings).encode('utf-8')).hexdigest()[:16]
+
+
+def iter_docx_paragraphs(file_path):
+    """
+    Yields (paragraph_number, offset, text) for each paragraph of a DOCX file.
+    'offset' is the position of the paragraph in the text returned by
+    extract_text_from_docx().
+    """
+    doc = docx.Document(file_path)
+    offset = 0
+    for number, para in enumerate(doc.paragraphs):
+        text = para.text if number == 0 else "\n" + para.text
+        yield number, offset, text
+        offset += len(text)
+
+
+def _is_bold_span(span):
+    return bool(span["flags"] & 16) or "bold" in span["font"].lower()
+
+
+def _page_layout_lines(page):
+    """Returns the page's lines as LayoutLines with their bold flag and font size."""
+    lines = []
+    # TEXTFLAGS_TEXT leaves out image blocks, which are slow to extract and not needed here.
+    for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+        for line in block.get("lines", []):
+            spans = [span for span in line["spans"] if span["text"].strip()]
+            text = "".join(span["text"] for span in line["spans"])
+            if not spans:
+                lines.append(LayoutLine(text + "\n", False, None, False))
+                continue
+            bold = all(_is_bold_span(span) for span in spans)
+            size = max(span["size"] for span in spans)
+            lines.append(LayoutLine(text + "\n", bold, size, False))
+    return lines
+
+
+def _image_coverage(page):
+    """Share of the page's area covered by images (overlaps counted twice, so at most 1.0)."""
+    rect = page.rect
+    area = abs(rect)
+    if not area:
+        return 0.0
+    # The bbox log lists what the page draws without extracting any text.
+    covered = sum(abs(fitz.Rect(bbox) & rect) for kind, bbox in page.get_bboxlog() if "image" in kind)
+    return min(1.0, covered / area)
+
+
+def _visible_chars(text):
+    return len("".join(text.split()))
+
+
+def classify_page(page, text):
+    """
+    Returns PAGE_TEXT, PAGE_BLANK or PAGE_IMAGE_ONLY for a page from its
+    extracted text. Images are only looked at for pages with little text.
+    """
+    chars = _visible_chars(text)
+    if chars >= IMAGE_PAGE_MAX_CHARS:
+        return PAGE_TEXT
+    if _image_coverage(page) >= IMAGE_COVERAGE_THRESHOLD:
+        return PAGE_IMAGE_ONLY
+    return PAGE_BLANK if chars <= BLANK_PAGE_MAX_CHARS else PAGE_TEXT
+
+
+def _classified_page_lines(page):
+    lines = _page_layout_lines(page)
+    return classify_page(page, "".join(line.text for line in lines)), lines
+
+
+def _extract_pdf_pages(file_path, numbers, page_fn):
+    """Applies page_fn to the given pages. Runs in a worker process."""
+    with fitz.open(file_path) as doc:
+        return [page_fn(doc[i]) for i in numbers]
+
+
+def _iter_pdf(file_path, workers, page_fn, numbers=None):
+    """
+    Yields page_fn(page) for the given page numbers (default: every page),
+    in order, using a process pool when there are many of them.
+    """
+    with fitz.open(file_path) as doc:
+        numbers = list(range(doc.page_count) if numbers is None else numbers)
+        if workers <= 1 or len(numbers) < PARALLEL_PAGE_THRESHOLD:
+            for i in numbers:
+                yield page_fn(doc[i])
+            return
+
+    tasks = [numbers[start:start + PAGES_PER_TASK] for start in range(0, len(numbers), PAGES_PER_TASK)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_extract_pdf_pages, file_path, task, page_fn) for task in tasks]
+        for future in futures:
+            yield from future.result()
+
+
+def _duplicate_key(lines):
+    """Fingerprint of a page's text without page-number lines, or None for pages too short to compare."""
+    text = _PAGE_NUMBER_LINE.sub("", "".join(line.text for line in lines))
+    if _visible_chars(text) < DUPLICATE_MIN_CHARS:
+        return None
+    return segment_fingerprint(text)
+
+
+def iter_pdf_page_layouts(file_path, workers=PDF_EXTRACT_WORKERS):
+    """
+    Yields (page_number, kind, LayoutLines) for every page of a PDF, in
+    order. Pages of a PDF extracted before (by content, whatever its name)
+    come from the page cache; the others are extracted, by a process pool
+    for large PDFs, classified and cached. A text page repeating an earlier
+    page is yielded as PAGE_DUPLICATE.
+    """
+    sha256 = None if page_cache.bypass else file_sha256(file_path)
+    version = extractor_version()
+    page_count = page_cache.page_count(sha256, version) if sha256 else None
+    if page_count is None:
+        with fitz.open(file_path) as doc:
+            page_count = doc.page_count
+    cached = page_cache.cached_pages(sha256, version, page_count) if sha256 else set()
+    missing = [number for number in range(page_count) if number not in cached]
+    extracted = _iter_pdf(file_path, workers, _classified_page_lines, missing) if missing else iter(())
+
+    seen, pending = set(), []
+    for number in range(page_count):
+        page = page_cache.get_page(sha256, number) if number in cached else None
+        if page is None:
+            if number in cached:
+                # Removed since, e.g. evicted by another process: extract it on its own.
+                page = _extract_pdf_pages(file_path, [number], _classified_page_lines)[0]
+            else:
+                page = next(extracted)
+            if sha256:
+                pending.append((number, *page))
+                if len(pending) >= PAGES_PER_TASK:
+                    page_cache.put_pages(sha256, pending)
+                    pending = []
+        kind, lines = page
+        if kind == PAGE_TEXT:
+            key = _duplicate_key(lines)
+            if key in seen:
+                kind = PAGE_DUPLICATE
+            elif key is not None:
+                seen.add(key)
+        yield number, kind, lines
+    if sha256:
+        page_cache.put_pages(sha256, pending)
+
+
+def _page_ranges(numbers):
+    """'3-5, 9' for the 0-based page numbers [2, 3, 4, 8]."""
+    ranges = []
+    for number in numbers:
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ", ".join(f"{a + 1}-{b + 1}" if a != b else f"{a + 1}" for a, b in ranges)
+
+
+def _iter_kept_pages(file_path, workers):
+    """
+    Yields (page_number, LayoutLines) for the pages of a PDF whose kind is
+    not in SKIP_PAGE_KINDS, then reports the blank, image-only and
+    duplicate pages found.
+    """
+    flagged = {PAGE_BLANK: [], PAGE_IMAGE_ONLY: [], PAGE_DUPLICATE: []}
+    page_count = 0
+    for number, kind, lines in iter_pdf_page_layouts(file_path, workers):
+        page_count += 1
+        if kind in flagged:
+            flagged[kind].append(number)
+        if kind not in SKIP_PAGE_KINDS:
+            yield number, lines
+
+    telemetry.current_span().set(pdf_pages=page_count, **{
+        f"{kind.replace('-', '_')}_pages": len(numbers) for kind, numbers in flagged.items()})
+    found = [(kind, numbers) for kind, numbers in flagged.items() if numbers]
+    if not found:
+        return
+    skipped = sum(len(numbers) for kind, numbers in found if kind in SKIP_PAGE_KINDS)
+    details = "; ".join(f"{len(numbers)} {kind} ({'skipped' if kind in SKIP_PAGE_KINDS else 'kept'}): "
+                        f"pages {_page_ranges(numbers)}" for kind, numbers in found)
+    logger.info(f"  - {skipped} of {page_count} PDF pages skipped. {details}.")
+    if flagged[PAGE_IMAGE_ONLY]:
+        logger.warning("  - Image-only pages are scans without a text layer; run OCR on the PDF if their content "
+                       "should be analyzed.")
+
+
+def iter_pdf_pages(file_path, workers=PDF_EXTRACT_WORKERS):
+    """
+    Yields (page_number, offset, text) for each page of a PDF without holding
+    the whole document text in memory. Large PDFs are split into page ranges
+    that are extracted by a process pool; pages are still yielded in order.
+    Blank, image-only and duplicate pages are left out (see SKIP_PAGE_KINDS).
+    """
+    offset = 0
+    for number, lines in _iter_kept_pages(file_path, workers):
+        text = "".join(line.text for line in lines)
+        yield number, offset, text
+        offset += len(text)
+
+
+def iter_pdf_layout_lines(file_path, workers=PDF_EXTRACT_WORKERS):
+    """
+    Yields a LayoutLine for every text line of a PDF, in reading order,
+    leaving out blank, image-only and duplicate pages (see SKIP_PAGE_KINDS).
+    """
+    for _, lines in _iter_kept_pages(file_path, workers):
+        yield from lines
+
+
+def iter_docx_layout_lines(file_path):
+    """Yields a LayoutLine for every paragraph of a DOCX file, flagging bold runs and heading styles."""
+    doc = docx.Document(file_path)
+    for para in doc.paragraphs:
+        runs = [run for run in para.runs if run.text.strip()]
+        style_font = para.style.font
+        bold = bool(runs) and all(run.bold or (run.bold is None and style_font.bold) for run in runs)
+        sizes = [run.font.size.pt for run in runs if run.font.size]
+        if not sizes and style_font.size:
+            sizes = [style_font.size.pt]
+        heading = para.style.name.startswith(("Heading", "Title"))
+        yield LayoutLine(para.text + "\n", bold, max(sizes) if sizes else None, heading)
+
+
+def iter_txt_lines(file_path):
+    """Yields (line_number, offset, text) for each line of a TXT file."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        offset = 0
+        for number, line in enumerate(f):
+            yield number, offset, line
+            offset += len(line)
+
+
+def stream_document(file_path, workers=PDF_EXTRACT_WORKERS):
+    """
+    Returns a generator of LayoutLines (text plus bold/size/heading hints)
+    for a supported file, or None for an unsupported format. A read error,
+    even after the first lines, raises DocumentReadError, so a truncated
+    document is never analyzed as if it were complete.
+    """
+    lower = file_path.lower()
+    if lower.endswith('.docx'):
+        lines, kind = iter_docx_layout_lines(file_path), "DOCX"
+    elif lower.endswith('.pdf'):
+        lines, kind = iter_pdf_layout_lines(file_path, workers), "PDF"
+    elif lower.endswith('.txt'):
+        lines, kind = (LayoutLine(text, False, None, False) for _, _, text in iter_txt_lines(file_path)), "TXT"
+    else:
+        return None
+
+    def guarded():
+        try:
+            yield from lines
+        except Exception as e:
+            raise DocumentReadError(f"Error reading {kind} file: {e}") from e
+
+    def timed():
+        # Extraction is interleaved with segmentation, so only the time spent
+        # inside the extractor is counted.
+        seconds, count = 0.0, 0
+        stream = guarded()
+        try:
+            while True:
+                start = time.perf_counter()
+                line = next(stream, None)
+                seconds += time.perf_counter() - start
+                if line is None:
+                    break
+                count += 1
+                yield line
+        finally:
+            telemetry.record_span("extract", seconds, file=os.path.basename(file_path), format=kind, lines=count)
+    return timed() if telemetry.enabled() else guarded()
+
 
 def extract_text_from_docx(file_path):
     """Extracts text from a DOCX file."""
     try:
-        doc = docx.Document(file_path)
-        return "\n".join([para.text for para in doc.paragraphs])
+        return "".join(text for _, _, text in iter_docx_paragraphs(file_path))
     except Exception as e:
-        print(f"Error reading DOCX file: {e}")
+        logger.error(f"Error reading DOCX file: {e}")
         return None
 
 def extract_text_from_pdf(file_path):
     """Extracts text from a PDF file"""
     try:
-        doc = fitz.open(file_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        return text
+        return "".join(text for _, _, text in iter_pdf_pages(file_path))
     except Exception as e:
-        print(f"Error reading PDF file: {e}")
+        logger.error(f"Error reading PDF file: {e}")
         return None
     
 def extract_text_from_txt(file_path):
@@ -30,7 +354,7 @@ def extract_text_from_txt(file_path):
         with open(file_path, 'r', encoding='utf-8') as f:
             return f.read()
     except Exception as e:
-        print(f"Error reading TXT file: {e}")
+        logger.error(f"Error reading TXT file: {e}")
         return None
 
 def _get_dynamic_headers_with_llm(text_sample):
@@ -38,7 +362,7 @@ def _get_dynamic_headers_with_llm(text_sample):
     Uses an LLM to read the beginning of a petition and extract the main
     section headers that introduce evidence for the EB-1A criteria.
     """
-    print("  - Using LLM to identify document structure...")
+    logger.info("  - Using LLM to identify document structure...")
     prompt = f"""
     The following is the beginning of an EB-1A petition document.
     Your task is to identify the primary section headers that introduce distinct arguments or criteria.
@@ -56,16 +380,15 @@ def _get_dynamic_headers_with_llm(text_sample):
     ---
     """
     try:
-        response = openai.chat.completions.create(
+        headers_string = chat_completion(
             model="gpt-4o",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.0,
-        )
-        headers_string = response.choices[0].message.content.strip()
-        print(f"  - LLM identified headers: {headers_string}")
+        ).strip()
+        logger.info(f"  - LLM identified headers: {headers_string}")
         return headers_string.split('|')
     except Exception as e:
-        print(f"  - Error during LLM header extraction: {e}")
+        logger.error(f"  - Error during LLM header extraction: {e}")
         return []
 
 def _extract_section_numbers(headers):
@@ -81,30 +404,117 @@ def _extract_section_numbers(headers):
     return section_patterns
 
 
-def segment_petition(full_text):
+def _iter_layout_lines(document):
+    """
+    Turns the full text, a stream of text pieces or a stream of LayoutLines
+    into LayoutLines of complete lines (keeping the newlines).
+    """
+    pieces = [document] if isinstance(document, str) else document
+    partial = ""
+    for piece in pieces:
+        if isinstance(piece, LayoutLine):
+            yield piece
+            continue
+        lines = (partial + piece).split('\n')
+        partial = lines.pop()
+        for line in lines:
+            yield LayoutLine(line + '\n', False, None, False)
+    if partial:
+        yield LayoutLine(partial, False, None, False)
+
+
+@telemetry.traced("segment")
+def segment_petition(document):
     """
-    Segments the petition by finding section numbers identified by an LLM.
+    Segments the petition into sections. A local header detector scans the
+    whole document once, using numbering, criterion names and formatting;
+    the LLM is only asked for the structure when the detector is unsure.
+    'document' is the full text, a stream of text pieces, or the LayoutLine
+    stream returned by stream_document().
     """
-    if not full_text:
+    logger.info("Segmenting document...")
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+        return _segment_petition(document, spool)
+
+
+def _spooled_lines(spool):
+    spool.seek(0)
+    for line in spool:
+        yield line.decode('utf-8')
+
+
+def _segment_petition(document, spool):
+    # Every line is also written to 'spool' for the LLM fallback, so large
+    # documents are not held in memory twice.
+    start = time.perf_counter()
+    detector = HeaderDetector()
+    line_count, has_text = 0, False
+    segments = {}
+    initial_parts = []
+    section = None  # [header_match, content parts] of the segment being read
+    for line in _iter_layout_lines(document):
+        spool.write(line.text.encode('utf-8'))
+        line_count += 1
+        has_text = has_text or bool(line.text)
+        if detector.is_header(line):
+            if section is None:
+                _add_introduction(segments, initial_parts)
+            else:
+                _add_segment(segments, section)
+            section = ["", [line.text]]
+        else:
+            (section[1] if section else initial_parts).append(line.text)
+
+    if not has_text:
         return {}
-        
-    print("Segmenting document using intelligent two-pass method...")
-    
-    text_sample = full_text[:8000]
+    if section is not None:
+        _add_segment(segments, section)
+
+    confidence = detector.confidence()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    telemetry.current_span().set(lines=line_count, headers=len(detector.headers), confidence=round(confidence, 3))
+    if confidence >= CONFIDENCE_THRESHOLD and segments:
+        telemetry.current_span().set(segments=len(segments), llm_fallback=False)
+        logger.info(f"  - Local detector found {len(detector.headers)} headers "
+                    f"(confidence {confidence:.2f}) in {elapsed_ms:.1f} ms, including extraction.")
+        for header in segments:
+            logger.info(f"  - Found segment: '{header}'")
+        return segments
+
+    logger.info(f"  - Local detector confidence {confidence:.2f} is too low, asking the LLM for the structure...")
+    segments = _segment_with_llm(spool)
+    telemetry.current_span().set(segments=len(segments), llm_fallback=True)
+    return segments
+
+
+def _segment_with_llm(spool):
+    """
+    Segments the document by finding section numbers identified by an LLM
+    in its first HEADER_SAMPLE_CHARS characters. 'spool' is a binary file of
+    the document's lines, which are read back one at a time.
+    """
+    head = []
+    head_length = 0
+    for line in _spooled_lines(spool):
+        head.append(line)
+        head_length += len(line)
+        if head_length >= HEADER_SAMPLE_CHARS:
+            break
+    text_sample = "".join(head)[:HEADER_SAMPLE_CHARS]
     llm_headers = _get_dynamic_headers_with_llm(text_sample)
     
     if not llm_headers:
-        print("  - LLM could not identify headers. Analyzing as a whole document.")
-        return {"Full Petition": full_text}
+        logger.warning("  - LLM could not identify headers. Analyzing as a whole document.")
+        return {"Full Petition": "".join(_spooled_lines(spool))}
 
     # Instead of matching text, we extract and match the section numbers.
     section_numbers = _extract_section_numbers(llm_headers)
     
     if not section_numbers:
-        print("  - Could not extract section numbers from LLM headers. Analyzing as a whole.")
-        return {"Full Petition": full_text}
+        logger.warning("  - Could not extract section numbers from LLM headers. Analyzing as a whole.")
+        return {"Full Petition": "".join(_spooled_lines(spool))}
 
-    print(f"  - Extracted section numbers for splitting: {section_numbers}")
+    logger.info(f"  - Extracted section numbers for splitting: {section_numbers}")
 
     # Create a regex that looks for the start of a line (^) followed by the section number.
     escaped_patterns = [re.escape(sn) for sn in section_numbers]
@@ -115,35 +525,47 @@ def segment_petition(full_text):
     
     # Use MULTILINE flag to make '^' work on each line
     pattern = re.compile(f"({pattern_string})", re.MULTILINE)
-    
-    parts = pattern.split(full_text)
-    
+
+    # None of the patterns can span a line break, so splitting line by line
+    # finds exactly the same matches as splitting the full text.
     segments = {}
-    if len(parts) < 3:
-        print("  - Regex split failed to find any matching section numbers. Analyzing as a whole document.")
-        return {"Full Petition": full_text}
+    initial_parts = []
+    section = None
+    for line in _spooled_lines(spool):
+        parts = pattern.split(line)
+        (section[1] if section else initial_parts).append(parts[0])
+        for header_match, content in zip(parts[1::2], parts[2::2]):
+            if section is None:
+                _add_introduction(segments, initial_parts)
+            else:
+                _add_segment(segments, section)
+                logger.info(f"  - Found segment: '{next(reversed(segments))}'")
+            section = [header_match, [content]]
 
-    initial_content = parts[0].strip()
+    if section is None:
+        logger.warning("  - Regex split failed to find any matching section numbers. Analyzing as a whole document.")
+        return {"Full Petition": "".join(initial_parts)}
+    _add_segment(segments, section)
+    logger.info(f"  - Found segment: '{next(reversed(segments))}'")
+            
+    return segments
+
+
+def _add_introduction(segments, initial_parts):
+    initial_content = "".join(initial_parts).strip()
     if initial_content:
         segments["Cover Letter / Introduction"] = initial_content
 
-    headers_found = parts[1::2]
-    contents_found = parts[2::2]
 
-    for header_match, content in zip(headers_found, contents_found):
-        full_content = (header_match + content).strip()
-        first_line_break = full_content.find('\n')
-        if first_line_break == -1:
-            full_header = full_content[:100] # Limit header length
-        else:
-            full_header = full_content[:first_line_break].strip()
+def _add_segment(segments, section):
+    """Adds a completed segment, keyed by its first line."""
+    header_match, content_parts = section
+    full_content = (header_match + "".join(content_parts)).strip()
+    first_line_break = full_content.find('\n')
+    if first_line_break == -1:
+        full_header = full_content[:100] # Limit header length
+    else:
+        full_header = full_content[:first_line_break].strip()
 
-        if full_content and full_header:
-            segments[full_header] = full_content
-            print(f"  - Found segment: '{full_header}'")
-            
-    if not segments:
-        print("  - No content found for any identified segments. Analyzing as a whole.")
-        return {"Full Petition": full_text}
-            
-    return segments
\ No newline at end of file
+    if full_content and full_header:
+        segments[full_header] = full_content
\ No newline at end of file
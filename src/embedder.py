@@ -0,0 +1,97 @@
+import argparse
+import os
+import time
+import numpy as np
+
+# --- SETTINGS ---
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# "torch" is the original sentence-transformers backend. "onnx" and
+# "onnx-int8" run the same model through ONNX Runtime on the CPU and need
+# `pip install optimum[onnxruntime]`. Check parity before switching an index.
+EMBEDDER_BACKEND = os.getenv("RFE_EMBEDDER_BACKEND", "torch")
+EMBEDDER_BACKENDS = ("torch", "onnx", "onnx-int8")
+# Hash-based vectors for offline benchmarks; retrieval results are meaningless.
+FAKE_BACKEND = "fake"
+EMBEDDING_DIMENSION = 384
+# Pre-exported int8 weights shipped in the model's hub repository
+ONNX_INT8_FILE = "onnx/model_quint8_avx2.onnx"
+# Minimum mean cosine similarity to the stored vectors for a backend to pass the parity check
+PARITY_THRESHOLD = 0.99
+
+
+def create_embeddings(backend=EMBEDDER_BACKEND, batch_size=None):
+    """
+    Creates the LangChain embedder for the knowledge base. Importing and
+    constructing it loads the model, so callers should do it only when needed.
+    """
+    if backend == FAKE_BACKEND:
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        return DeterministicFakeEmbedding(size=EMBEDDING_DIMENSION)
+
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    if backend not in EMBEDDER_BACKENDS:
+        raise ValueError(f"Unknown embedder backend '{backend}'. Choose one of {', '.join(EMBEDDER_BACKENDS)}.")
+    model_kwargs = {}
+    if backend == "onnx":
+        model_kwargs = {"backend": "onnx"}
+    elif backend == "onnx-int8":
+        model_kwargs = {"backend": "onnx", "model_kwargs": {"file_name": ONNX_INT8_FILE}}
+    encode_kwargs = {"batch_size": batch_size} if batch_size else {}
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs)
+
+
+def check_parity(index_path, backend, sample_size=64, seed=0):
+    """
+    Re-embeds a sample of indexed chunks with the given backend and compares
+    the result with the vectors stored in the index. Returns the mean and
+    minimum cosine similarity and whether the backend passes.
+    """
+    from vector_index import load_vectorstore
+
+    start = time.perf_counter()
+    embeddings = create_embeddings(backend)
+    load_seconds = time.perf_counter() - start
+
+    vectorstore = load_vectorstore(index_path, embeddings, for_update=True)
+    positions = sorted(vectorstore.index_to_docstore_id)
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(positions, size=min(sample_size, len(positions)), replace=False)
+    texts = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(p)]).page_content for p in sample]
+    stored = np.vstack([vectorstore.index.reconstruct(int(p)) for p in sample])
+
+    start = time.perf_counter()
+    fresh = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    embed_seconds = time.perf_counter() - start
+
+    stored /= np.linalg.norm(stored, axis=1, keepdims=True)
+    fresh /= np.linalg.norm(fresh, axis=1, keepdims=True)
+    similarities = (stored * fresh).sum(axis=1)
+    return {
+        "backend": backend,
+        "mean_cosine": float(similarities.mean()),
+        "min_cosine": float(similarities.min()),
+        "passed": bool(similarities.mean() >= PARITY_THRESHOLD),
+        "model_load_seconds": load_seconds,
+        "chunks_per_second": len(texts) / embed_seconds if embed_seconds else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Check an embedder backend against the vectors stored in the index.")
+    parser.add_argument("--index-path", default=os.path.join(os.path.dirname(script_dir), 'faiss_index'))
+    parser.add_argument("--backend", choices=EMBEDDER_BACKENDS, action="append",
+                        help="Backend(s) to check (default: all)")
+    parser.add_argument("--sample", type=int, default=64)
+    args = parser.parse_args()
+
+    for backend in args.backend or EMBEDDER_BACKENDS:
+        try:
+            r = check_parity(args.index_path, backend, args.sample)
+        except Exception as e:
+            print(f"{backend:<10} could not be checked: {e}")
+            continue
+        status = "OK" if r["passed"] else "FAILED"
+        print(f"{backend:<10} mean cosine {r['mean_cosine']:.4f}, min {r['min_cosine']:.4f} [{status}] - "
+              f"model load {r['model_load_seconds']:.2f}s, {r['chunks_per_second']:.0f} chunks/s")
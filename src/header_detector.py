@@ -0,0 +1,186 @@
+import argparse
+import collections
+import json
+import os
+import re
+import time
+from criteria import CRITERION_NAMES
+
+# --- SETTINGS ---
+# Minimum score for a line to be treated as a section header.
+HEADER_SCORE_THRESHOLD = 2
+# Below this confidence segment_petition() asks the LLM for the structure instead.
+CONFIDENCE_THRESHOLD = 0.6
+# Lines longer than this are body text, whatever their formatting.
+MAX_HEADER_LENGTH = 160
+# A line this many points larger than the body font counts as emphasized.
+LARGER_FONT_POINTS = 1.5
+# Body font size is only trusted after this many characters have been seen.
+MIN_BODY_CHARS = 500
+
+LayoutLine = collections.namedtuple("LayoutLine", "text bold size heading")
+LayoutLine.__doc__ = """A line of the document with the formatting the detector uses.
+'bold' and 'heading' are booleans, 'size' is the font size in points or None."""
+
+_SECTION_NUMBER = re.compile(r'^\s*(?:section\s+\d+(?:\.\d+)*\b|\d+(?:\.\d+)+\.?(?=[\s\u200b]|$))', re.IGNORECASE)
+_CRITERION = re.compile(r'^\W*criterion\s+\d+\b', re.IGNORECASE)
+_EXHIBIT = re.compile(r'^\s*exhibit\s+(?:\d+|[A-Z]{1,2})\b', re.IGNORECASE)
+_MARKED = re.compile(r'^\s*(?:={2,}|#{1,6}\s).*\S')
+_CRITERION_NAME = re.compile(
+    "|".join(re.escape(name) for names in CRITERION_NAMES.values() for name in names), re.IGNORECASE
+)
+
+
+class HeaderDetector:
+    """
+    Scores lines as section headers from numbering patterns ('Section 1',
+    '1.2', 'Criterion 4'), exhibit labels, explicit markup, the EB-1A
+    criterion names and, when available, bold/heading styles and font size.
+    Works in a single pass; call score() for each line in document order.
+    """
+    def __init__(self):
+        self._size_chars = collections.Counter()
+        self._body_chars = 0
+        self.headers = []  # (line_number, text, score, structural)
+        self._line_number = 0
+
+    def _body_size(self):
+        if self._body_chars < MIN_BODY_CHARS or not self._size_chars:
+            return None
+        return self._size_chars.most_common(1)[0][0]
+
+    def score(self, line):
+        """
+        Returns the header score for a LayoutLine (or plain string) and
+        records it when it passes HEADER_SCORE_THRESHOLD.
+        """
+        if isinstance(line, str):
+            line = LayoutLine(line, False, None, False)
+        line_number = self._line_number
+        self._line_number += 1
+
+        text = line.text.strip().replace('\u200b', '')
+        if line.size:
+            self._size_chars[round(line.size, 1)] += len(text)
+            self._body_chars += len(text)
+        if not text or len(text) > MAX_HEADER_LENGTH:
+            return 0
+
+        score = 0
+        structural = False
+        if _SECTION_NUMBER.match(text) or _CRITERION.match(text):
+            score += 2
+            structural = True
+        elif _MARKED.match(text):
+            score += 2
+            structural = True
+        elif _EXHIBIT.match(text):
+            score += 1
+        if line.heading:
+            score += 2
+        elif line.bold:
+            score += 1
+        body_size = self._body_size()
+        if line.size and body_size and line.size >= body_size + LARGER_FONT_POINTS:
+            score += 1
+        letters = [c for c in text if c.isalpha()]
+        if len(letters) >= 4 and all(c.isupper() for c in letters) and len(text) <= 80:
+            score += 1
+        if score and _CRITERION_NAME.search(text):
+            score += 1
+        # A wrapped cross-reference such as "Section 2.)" closes a parenthesis it never opened.
+        if text.count(')') > text.count('('):
+            score -= 2
+
+        if score >= HEADER_SCORE_THRESHOLD:
+            self.headers.append((line_number, text, score, structural))
+        return score
+
+    def is_header(self, line):
+        return self.score(line) >= HEADER_SCORE_THRESHOLD
+
+    def confidence(self):
+        """
+        0.0-1.0 estimate of how well the document's structure was recognized:
+        no headers is 0, a single header 0.5, and several headers score higher
+        the more of them carry numbering or explicit structure.
+        """
+        if not self.headers:
+            return 0.0
+        if len(self.headers) == 1:
+            return 0.5
+        structural = sum(1 for h in self.headers if h[3] or h[2] >= 3)
+        return 0.6 + 0.4 * structural / len(self.headers)
+
+
+def detect_headers(lines):
+    """Runs the detector over an iterable of lines and returns (headers, confidence)."""
+    detector = HeaderDetector()
+    for line in lines:
+        detector.score(line)
+    return [h[1] for h in detector.headers], detector.confidence()
+
+
+def _normalize(header):
+    return re.sub(r'\s+', ' ', header.replace('\u200b', '')).strip().lower()
+
+
+def score_headers(found, expected):
+    """Precision and recall of the found headers against the labeled ones, ignoring case and spacing."""
+    expected_set = {_normalize(h) for h in expected}
+    found_set = {_normalize(h) for h in found}
+    matched = len(expected_set & found_set)
+    precision = matched / len(found_set) if found_set else 1.0
+    recall = matched / len(expected_set) if expected_set else 1.0
+    return precision, recall
+
+
+def evaluate(labels_path, samples_dir, use_llm=False):
+    """
+    Compares the detector with a labeled set of headers (and optionally with
+    the LLM headers) on the sample petitions. Prints precision, recall,
+    confidence and detection time per file.
+    """
+    from document_parser import HEADER_SAMPLE_CHARS, _get_dynamic_headers_with_llm, stream_document
+
+    with open(labels_path, 'r', encoding='utf-8') as f:
+        labels = json.load(f)
+
+    for file_name, expected in labels.items():
+        lines = list(stream_document(os.path.join(samples_dir, file_name)))
+        start = time.perf_counter()
+        found, confidence = detect_headers(lines)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        precision, recall = score_headers(found, expected)
+        expected_set = {_normalize(h) for h in expected}
+        found_set = {_normalize(h) for h in found}
+        print(f"{file_name}: {len(found)} headers, precision {precision:.2f}, recall {recall:.2f}, "
+              f"confidence {confidence:.2f}, {elapsed_ms:.1f} ms")
+        for header in sorted(expected_set - found_set):
+            print(f"    missed: {header}")
+        for header in sorted(found_set - expected_set):
+            print(f"    extra:  {header}")
+
+        if use_llm:
+            sample = "".join(line.text for line in lines)[:HEADER_SAMPLE_CHARS]
+            start = time.perf_counter()
+            llm_headers = {_normalize(h) for h in _get_dynamic_headers_with_llm(sample) if h.strip()}
+            llm_seconds = time.perf_counter() - start
+            in_sample = {h for h in found_set if h in _normalize(sample)}
+            agreement = len(in_sample & llm_headers) / len(in_sample | llm_headers) if in_sample | llm_headers else 1.0
+            print(f"    LLM agreement on the first {HEADER_SAMPLE_CHARS} chars: {agreement:.2f} "
+                  f"(LLM call took {llm_seconds:.2f}s)")
+
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    samples_dir = os.path.join(os.path.dirname(script_dir), 'samples')
+    parser = argparse.ArgumentParser(description="Evaluate the local header detector on the labeled sample petitions.")
+    parser.add_argument("--labels", default=os.path.join(samples_dir, 'header_labels.json'))
+    parser.add_argument("--samples-dir", default=samples_dir)
+    parser.add_argument("--llm", action="store_true", help="Also measure agreement with the LLM header detection")
+    args = parser.parse_args()
+    import telemetry
+    telemetry.configure_logging()
+    evaluate(args.labels, args.samples_dir, args.llm)
@@ -0,0 +1,68 @@
+import hashlib
+import logging
+import os
+import re
+import unicodedata
+from analysis_schema import load_analysis_file
+
+logger = logging.getLogger(__name__)
+
+_INVISIBLE = re.compile('[\u00ad\u200b\u200c\u200d\u2060\ufeff]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_segment(text):
+    """
+    The text of a segment as compared between revisions: Unicode-normalized,
+    without invisible characters, with runs of whitespace (including line
+    breaks moved by re-flowing the document) collapsed.
+    """
+    text = unicodedata.normalize('NFKC', text)
+    text = _INVISIBLE.sub('', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def segment_fingerprint(text):
+    return hashlib.sha256(normalize_segment(text).encode('utf-8')).hexdigest()[:32]
+
+
+def reuse_unchanged(segments, previous_path, signature, source=None):
+    """
+    Diffs the segments of a petition against the analyses of its previous
+    run (the JSON written next to the report). A segment whose normalized
+    text matches a previously analyzed one, under any header, reuses that
+    analysis. Returns (header -> reused SegmentAnalysis, header -> text of
+    the new or changed segments to analyze). Failed analyses, including
+    those with failed parts, are never reused, and nothing is when the
+    prompts or model changed since. With 'source' (the petition's path),
+    the previous run must have analyzed that same file.
+    """
+    if not previous_path or not os.path.exists(previous_path):
+        logger.info(f"No previous analysis found at {previous_path}; analyzing every section.")
+        return {}, dict(segments)
+    try:
+        previous, metadata = load_analysis_file(previous_path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"The previous analysis could not be read ({e}); analyzing every section.")
+        return {}, dict(segments)
+    if source is not None and metadata.get("source") != os.path.abspath(source):
+        logger.info(f"{previous_path} holds the analysis of another petition ({metadata.get('source')}); "
+                    f"analyzing every section.")
+        return {}, dict(segments)
+    if metadata.get("analysis_signature") != signature:
+        logger.info("The analysis prompts or model changed since the previous run; analyzing every section.")
+        return {}, dict(segments)
+
+    by_fingerprint = {a.fingerprint: a for a in previous.values()
+                      if a.fingerprint and a.error is None and not a.failed_parts}
+    reused, changed = {}, {}
+    for header, text in segments.items():
+        analysis = by_fingerprint.get(segment_fingerprint(text))
+        if analysis is None:
+            changed[header] = text
+        else:
+            analysis.reused = True
+            reused[header] = analysis
+    logger.info(f"Incremental analysis: {len(reused)} unchanged section(s) reused, {len(changed)} new or changed "
+                f"section(s) to analyze (previous run: {len(previous)} sections).")
+    return reused, changed
@@ -0,0 +1,234 @@
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- SETTINGS ---
+# Sub-directory of the index folder holding the BM25 arrays.
+LEXICAL_DIR = "bm25"
+META_FILE = "meta.json"
+ARRAY_FILES = ("terms", "offsets", "doc_ids", "tfs", "doc_lengths")
+# Standard BM25 parameters: term-frequency saturation and length normalization.
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Chunks tokenized before their postings are converted to arrays while building.
+BUILD_BATCH = 10000
+# Reciprocal rank fusion constant; larger values flatten the weight of top ranks.
+RRF_K = 60
+STOPWORDS = frozenset("""
+a an and are as at be been but by for from had has have he her his if in into is it its of on or our
+she so such than that the their them then there these they this those to was were which who will with
+""".split())
+
+_WORD = re.compile(r"[a-z0-9]+(?:[.\-'][a-z0-9]+)*")
+# Regulation citations such as 204.5(h)(3)(viii), kept whole as well as split into words.
+_CITATION = re.compile(r"\d+(?:\.\d+)+(?:\([a-z0-9]+\))+")
+
+
+def tokenize(text):
+    """
+    Lowercased words without stopwords. Hyphenated words ("one-time") are
+    indexed whole and by their parts, abbreviations also without their dots
+    ("c.f.r" and "cfr"), and regulation citations as a single term too, so
+    exact legal terms match exactly.
+    """
+    text = text.lower().replace("’", "'")
+    tokens = []
+    for word in _WORD.findall(text):
+        if word in STOPWORDS:
+            continue
+        tokens.append(word)
+        if '-' in word:
+            tokens.extend(p for p in word.split('-') if p not in STOPWORDS)
+        if '.' in word and not word[0].isdigit():
+            tokens.append(word.replace('.', ''))
+    tokens.extend(_CITATION.findall(text))
+    return tokens
+
+
+def term_hash(term):
+    """Terms are stored as 63-bit hashes so the vocabulary needs no in-memory dictionary."""
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little') >> 1
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the knowledge-base chunks, stored as a compact inverted
+    index of flat numpy arrays: sorted term hashes, posting offsets, and the
+    posting lists (chunk position, term frequency). Documents are identified
+    by their position in the FAISS index. The arrays are memory-mapped, so
+    processes share one copy and a query only touches its terms' postings.
+    """
+    def __init__(self, arrays, meta):
+        self.terms = arrays["terms"]
+        self.offsets = arrays["offsets"]
+        self.doc_ids = arrays["doc_ids"]
+        self.tfs = arrays["tfs"]
+        self.doc_lengths = arrays["doc_lengths"]
+        self.doc_count = meta["doc_count"]
+        self.average_length = meta["average_length"] or 1.0
+        self.k1 = meta.get("k1", BM25_K1)
+        self.b = meta.get("b", BM25_B)
+
+    @classmethod
+    def load(cls, index_path):
+        """Memory-maps the arrays saved by build_lexical_index(), or returns None if there are none."""
+        directory = os.path.join(index_path, LEXICAL_DIR)
+        meta_path = os.path.join(directory, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r') for name in ARRAY_FILES}
+        return cls(arrays, meta)
+
+    def _postings(self, term):
+        h = np.uint64(term_hash(term))
+        i = int(np.searchsorted(self.terms, h))
+        if i >= len(self.terms) or self.terms[i] != h:
+            return None
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def search(self, query, k):
+        """Returns up to k (position, score) pairs, best first. Chunks sharing no term with the query are left out."""
+        all_ids, all_scores = [], []
+        for term, query_tf in collections.Counter(tokenize(query)).items():
+            postings = self._postings(term)
+            if postings is None:
+                continue
+            doc_ids = np.asarray(self.doc_ids[postings])
+            tfs = np.asarray(self.tfs[postings], dtype=np.float32)
+            idf = np.log(1.0 + (self.doc_count - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[doc_ids] / self.average_length)
+            all_ids.append(doc_ids)
+            all_scores.append(query_tf * idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+        if not all_ids:
+            return []
+
+        doc_ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        best = np.argsort(-scores)[:k] if len(scores) <= k else np.argpartition(-scores, k)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(int(doc_ids[i]), float(scores[i])) for i in best]
+
+
+def remove_lexical_index(index_path):
+    """Invalidates the BM25 index, e.g. when the FAISS positions it refers to change."""
+    meta_path = os.path.join(index_path, LEXICAL_DIR, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+
+def build_lexical_index(texts, index_path, k1=BM25_K1, b=BM25_B):
+    """
+    Builds the BM25 arrays from (FAISS position, chunk text) pairs and saves
+    them under index_path. Postings are collected in batches as arrays and
+    sorted once, so memory stays proportional to the postings themselves.
+    """
+    start = time.perf_counter()
+    batches, lengths = [], {}
+    rows = []
+
+    def flush():
+        if rows:
+            batches.append(np.array(rows, dtype=np.int64))
+            rows.clear()
+
+    for position, text in texts:
+        counts = collections.Counter(tokenize(text))
+        lengths[int(position)] = sum(counts.values())
+        rows.extend((term_hash(term), int(position), tf) for term, tf in counts.items())
+        if len(lengths) % BUILD_BATCH == 0:
+            flush()
+    flush()
+
+    postings = np.concatenate(batches) if batches else np.zeros((0, 3), dtype=np.int64)
+    postings = postings[np.lexsort((postings[:, 1], postings[:, 0]))]
+    terms, first = np.unique(postings[:, 0].astype(np.uint64), return_index=True)
+    doc_lengths = np.zeros(max(lengths, default=-1) + 1, dtype=np.int32)
+    for position, length in lengths.items():
+        doc_lengths[position] = length
+    arrays = {
+        "terms": terms,
+        "offsets": np.append(first, len(postings)).astype(np.int64),
+        "doc_ids": postings[:, 1].astype(np.int32),
+        "tfs": np.minimum(postings[:, 2], np.iinfo(np.uint16).max).astype(np.uint16),
+        "doc_lengths": doc_lengths,
+    }
+    meta = {
+        "doc_count": len(lengths),
+        "average_length": float(np.mean(list(lengths.values()))) if lengths else 0.0,
+        "terms": len(terms),
+        "postings": len(postings),
+        "k1": k1,
+        "b": b,
+    }
+
+    directory = os.path.join(index_path, LEXICAL_DIR)
+    os.makedirs(directory, exist_ok=True)
+    remove_lexical_index(index_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), array)
+    # Written last: readers only use the arrays once the metadata exists.
+    with open(os.path.join(directory, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=1)
+    logger.info(f"Built BM25 index: {meta['doc_count']} chunks, {meta['terms']} terms, "
+                f"{meta['postings']} postings in {time.perf_counter() - start:.2f}s.")
+    return meta
+
+
+def build_from_vectorstore(vectorstore, index_path):
+    """Builds the BM25 index for every chunk of a loaded FAISS store, by FAISS position."""
+    positions = vectorstore.index_to_docstore_id
+    return build_lexical_index(
+        ((position, vectorstore.docstore.search(positions[position]).page_content) for position in positions),
+        index_path,
+    )
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Merges ranked lists of ids into one: each id scores the sum of
+    1 / (k + rank) over the lists it appears in. Returns ids, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda item: -scores[item])
+
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(
+        description="Build the BM25 index for an existing knowledge base, or query it.")
+    parser.add_argument("--index-path", default=os.path.join(os.path.dirname(script_dir), 'faiss_index'))
+    parser.add_argument("--query", action="append", help="Print the best BM25 matches for this query")
+    parser.add_argument("-k", type=int, default=4)
+    args = parser.parse_args()
+    import telemetry
+    telemetry.configure_logging()
+
+    if not args.query:
+        from embedder import FAKE_BACKEND, create_embeddings
+        from vector_index import load_vectorstore
+        # Only the chunk texts are needed, not real embeddings.
+        build_from_vectorstore(load_vectorstore(args.index_path, create_embeddings(FAKE_BACKEND), for_update=True),
+                               args.index_path)
+    else:
+        index = BM25Index.load(args.index_path)
+        if index is None:
+            parser.error(f"No BM25 index in {args.index_path}; run without --query to build it.")
+        for query in args.query:
+            start = time.perf_counter()
+            results = index.search(query, args.k)
+            print(f"{query!r}: {(time.perf_counter() - start) * 1000:.2f} ms")
+            for position, score in results:
+                print(f"  {position:>7} {score:7.3f}")
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- SETTINGS ---
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+CACHE_PATH = os.getenv("RFE_LLM_CACHE_PATH", os.path.join(project_root, '.cache', 'llm_cache.sqlite'))
+# Least-recently-used entries beyond this count are evicted.
+MAX_ENTRIES = int(os.getenv("RFE_LLM_CACHE_MAX_ENTRIES", "20000"))
+# Entries not used for this many days are evicted. 0 keeps them forever.
+MAX_AGE_DAYS = float(os.getenv("RFE_LLM_CACHE_MAX_AGE_DAYS", "30"))
+# Set RFE_LLM_CACHE_BYPASS=1 (or pass --no-cache to main.py) to always call the API.
+BYPASS = os.getenv("RFE_LLM_CACHE_BYPASS", "") == "1"
+# Eviction runs once every this many writes.
+EVICT_EVERY = 100
+
+
+def make_key(model, temperature, max_tokens, prompt, context_ids=(), **extra):
+    """
+    Content-addressed cache key: a SHA-256 over everything that determines
+    the response. 'prompt' may be a string or a list of chat messages.
+    """
+    payload = {
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "prompt": prompt,
+        "context_ids": list(context_ids),
+        "extra": extra,
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    On-disk LLM response cache backed by SQLite, with LRU eviction by entry
+    count and age. Safe to share between threads.
+    """
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, max_age_days=MAX_AGE_DAYS, bypass=BYPASS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 86400
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Opened lazily so a bypassed cache never touches the disk.
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        return self._conn
+
+    def get(self, key):
+        if self.bypass:
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        if self.bypass:
+            return
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now):
+        if self.max_age_seconds:
+            conn.execute("DELETE FROM responses WHERE last_used < ?", (now - self.max_age_seconds,))
+        if self.max_entries:
+            conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def cached(self, key, compute):
+        """Returns the cached value for key, or calls compute() and stores its result."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = compute()
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": hit_rate}
+
+    def print_stats(self):
+        if self.bypass:
+            logger.info("LLM cache: bypassed.")
+            return
+        stats = self.stats()
+        logger.info(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate).")
+
+
+llm_cache = LLMCache()
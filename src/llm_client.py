@@ -0,0 +1,204 @@
+import collections
+import logging
+import os
+import random
+import threading
+import time
+import openai
+from dotenv import load_dotenv
+from llm_cache import llm_cache, make_key
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# --- SETTINGS ---
+# Budgets shared by every thread in the process. 0 means "no limit".
+REQUESTS_PER_MINUTE = int(os.getenv("RFE_REQUESTS_PER_MINUTE", "0"))
+TOKENS_PER_MINUTE = int(os.getenv("RFE_TOKENS_PER_MINUTE", "0"))
+# How many times a request is retried after a 429 before giving up.
+MAX_RETRIES = int(os.getenv("RFE_MAX_RETRIES", "6"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+# Rough chars-per-token ratio used to estimate a request's size up front.
+CHARS_PER_TOKEN = 4
+# Failures left once call_with_backoff() gives up: HTTP errors such as 5xx,
+# timeouts and dropped connections.
+API_ERRORS = (openai.APIError, openai.APITimeoutError, openai.APIConnectionError)
+
+
+class RateLimiter:
+    """
+    Thread-safe sliding-window budget for requests and tokens per minute.
+    acquire() blocks until the next request fits into the last 60 seconds.
+    """
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._window = collections.deque()  # (timestamp, tokens)
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=0):
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return
+        # A single request bigger than the whole budget would otherwise wait forever.
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._window and now - self._window[0][0] >= 60:
+                    _, expired_tokens = self._window.popleft()
+                    self._tokens_in_window -= expired_tokens
+
+                fits_requests = not self.requests_per_minute or len(self._window) < self.requests_per_minute
+                fits_tokens = not self.tokens_per_minute or self._tokens_in_window + tokens <= self.tokens_per_minute
+                if fits_requests and fits_tokens:
+                    self._window.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+                wait = 60 - (now - self._window[0][0])
+            time.sleep(max(wait, 0.05))
+
+
+rate_limiter = RateLimiter(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)
+
+
+def cached_tokens(usage):
+    """Prompt tokens the provider served from its prompt cache (a repeated prefix), 0 if not reported."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+
+
+class UsageCounter:
+    """Thread-safe totals of the chat completion requests sent and the tokens they used."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.prompt_tokens = 0
+            self.cached_prompt_tokens = 0
+            self.completion_tokens = 0
+
+    def record(self, usage):
+        with self._lock:
+            self.requests += 1
+            if usage is not None:
+                self.prompt_tokens += usage.prompt_tokens or 0
+                self.cached_prompt_tokens += cached_tokens(usage)
+                self.completion_tokens += usage.completion_tokens or 0
+
+    def print_stats(self):
+        logger.info(f"LLM usage: {self.requests} request(s), {self.prompt_tokens} prompt tokens "
+                    f"({self.cached_prompt_tokens} from the provider's prompt cache), "
+                    f"{self.completion_tokens} completion tokens.")
+
+
+usage_counter = UsageCounter()
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def configure_rate_limits(requests_per_minute=0, tokens_per_minute=0):
+    """Sets the process-wide request/token budget used by every LLM call."""
+    rate_limiter.requests_per_minute = requests_per_minute
+    rate_limiter.tokens_per_minute = tokens_per_minute
+
+
+def get_client():
+    """
+    Returns the shared OpenAI client. Its own retries are disabled because
+    call_with_backoff() handles 429s with jitter and the shared budget.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = openai.OpenAI(max_retries=0)
+        return _client
+
+
+def estimate_tokens(text):
+    """Cheap token estimate used for the tokens-per-minute budget."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _backoff_delay(attempt, error):
+    """Full-jitter exponential backoff, honouring a Retry-After header when present."""
+    retry_after = None
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            retry_after = None
+    ceiling = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+    delay = random.uniform(0, ceiling)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def call_with_backoff(fn, *args, estimated_tokens=0, **kwargs):
+    """
+    Calls fn within the shared rate-limit budget, retrying on HTTP 429
+    (openai.RateLimitError) with jittered exponential backoff.
+    """
+    span = telemetry.current_span()
+    for attempt in range(MAX_RETRIES + 1):
+        start = time.perf_counter()
+        rate_limiter.acquire(estimated_tokens)
+        waited = time.perf_counter() - start
+        if waited > 0.001:
+            span.add("rate_limit_wait_ms", round(waited * 1000, 1))
+        try:
+            return fn(*args, **kwargs)
+        except openai.RateLimitError as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = _backoff_delay(attempt, e)
+            span.add("retries")
+            span.add("backoff_ms", round(delay * 1000, 1))
+            logger.warning(f"  ! Rate limited (429). Retrying in {delay:.1f}s (attempt {attempt + 1}/{MAX_RETRIES})...")
+            time.sleep(delay)
+
+
+def chat_completion(messages, model="gpt-4o", temperature=0.2, max_tokens=None, context_ids=(),
+                    span_name="llm.chat_completion", **kwargs):
+    """
+    Sends a chat completion request through the shared client and budget
+    and returns the text of the first choice. Responses are served from the
+    on-disk LLM cache when the same request was made before. 'context_ids'
+    (e.g. retrieved passages) only go into the cache key.
+    """
+    with telemetry.span(span_name, model=model, max_tokens=max_tokens or 0) as span:
+        key = make_key(model, temperature, max_tokens, messages, context_ids, **kwargs)
+        cached = llm_cache.get(key)
+        span.set(cache_hit=cached is not None)
+        if cached is not None:
+            return cached
+
+        prompt_chars = "".join(m["content"] for m in messages)
+        estimated = estimate_tokens(prompt_chars) + (max_tokens or 0)
+
+        request = {"model": model, "messages": messages, "temperature": temperature}
+        if max_tokens is not None:
+            request["max_tokens"] = max_tokens
+        request.update(kwargs)
+
+        response = call_with_backoff(get_client().chat.completions.create, estimated_tokens=estimated, **request)
+        usage = getattr(response, "usage", None)
+        usage_counter.record(usage)
+        if usage is not None:
+            span.set(prompt_tokens=usage.prompt_tokens or 0, cached_prompt_tokens=cached_tokens(usage),
+                     completion_tokens=usage.completion_tokens or 0)
+        content = response.choices[0].message.content
+        if content is not None:
+            llm_cache.put(key, content)
+        return content
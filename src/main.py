@@ -1,75 +1,289 @@
-import sys
+import time
+PROCESS_START = time.perf_counter()
+
+import argparse
+import functools
+import logging
 import os
-from document_parser import extract_text_from_docx, extract_text_from_pdf, extract_text_from_txt, segment_petition
-from ai_analyzer import analyze_text_with_rag
-from report_generator import create_rfe_risk_report
+from concurrent.futures import ThreadPoolExecutor
+from document_parser import DocumentReadError, stream_document, segment_petition
+from ai_analyzer import analysis_signature, analyze_sections_with_rag, analyze_text_with_rag, get_eb1a_analysis_prompt
+from analysis_schema import SegmentAnalysis, dump_analyses
+from report_generator import SUPPORTED_FORMATS, create_rfe_risk_report
 from rag_enhancer import RAGSystem
+from llm_client import configure_rate_limits, usage_counter, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE
+from llm_cache import llm_cache
+from page_cache import page_cache
+from retrieval_cache import retrieval_cache
+from server import DEFAULT_SERVER_URL, submit_job
+from incremental import reuse_unchanged, segment_fingerprint
+from token_planner import count_tokens, plan_requests, summarize_plan
+import telemetry
 
-# The main function takes the file path directly 
-def main(input_file_path):
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAISS_INDEX_PATH = os.path.join(PROJECT_ROOT, 'faiss_index')
+OUTPUT_DIR = os.path.join(PROJECT_ROOT, 'output')
+
+# Number of segments analyzed at the same time. Almost all of the time per
+# segment is spent waiting on the OpenAI API, so threads scale well here.
+DEFAULT_MAX_WORKERS = int(os.getenv("RFE_MAX_WORKERS", "4"))
+# Report formats written for each petition (docx, html, json). The analyses
+# JSON next to the reports is always written.
+REPORT_FORMATS = [f.strip() for f in os.getenv("RFE_REPORT_FORMATS", "docx").split(",") if f.strip()]
+
+
+@telemetry.traced("analyze_segments")
+def analyze_segments(segments, rag_system, max_workers=DEFAULT_MAX_WORKERS):
     """
-    Main function to orchestrate the RFE analysis process.
+    Analyzes the segments concurrently with a pool of worker threads.
+    The token planner first splits oversized segments and packs small
+    segments of the same criterion into one request; the findings are mapped
+    back to the original headers. Results are returned in the original
+    segment order, so the report is the same as with a sequential run. A
+    request that fails is reported as a failed analysis of its sections;
+    the others are kept.
     """
-    
-    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    faiss_index_path = os.path.join(project_root, 'faiss_index')
-    output_dir = os.path.join(project_root, 'output')
+    requests, skipped = plan_requests(segments)
+    for header in skipped:
+        logger.info(f"\n--- Skipping Segment: {header} (too short) ---")
+
+    instruction_tokens = functools.cache(lambda criterion: count_tokens(get_eb1a_analysis_prompt(criterion)))
+    plan = summarize_plan(requests, segments, skipped, instruction_tokens)
+    telemetry.current_span().set(**{f"plan.{k}": v for k, v in plan.items()})
+    logger.info(f"\nAnalyzing {plan['segments']} segments in {plan['requests']} requests with {max_workers} worker(s) "
+                f"({plan['split_parts']} split parts, {plan['packed_segments']} segments packed, "
+                f"{plan['routed_requests']} routed to a criterion). "
+                f"Estimated prompt tokens: {plan['prompt_tokens']} (unplanned: {plan['unplanned_prompt_tokens']}).")
+
+    @telemetry.propagate
+    def run(request):
+        with telemetry.span("analysis_request", headers=" / ".join(request.headers), part=request.part,
+                            part_count=request.part_count, planned_tokens=request.tokens,
+                            criterion=request.criterion or 0):
+            return analyze_request(request)
+
+    def analyze_request(request):
+        if len(request.headers) > 1:
+            logger.info(f"\n--- Analyzing Segments: {' / '.join(request.headers)}  ---")
+            found = analyze_sections_with_rag(request.text, request.headers, rag_system, request.criterion)
+            # Sections missing from the packed answer are analyzed on their own.
+            for header in request.headers:
+                if header not in found:
+                    logger.warning(f"  ! Packed answer had no analysis for '{header}'. Analyzing it separately.")
+                    found[header] = analyze_text_with_rag(segments[header], rag_system, request.criterion)
+            return found
+
+        header = request.headers[0]
+        if request.part_count > 1:
+            logger.info(f"\n--- Analyzing Segment: {header} (part {request.part} of {request.part_count})  ---")
+        else:
+            logger.info(f"\n--- Analyzing Segment: {header}  ---")
+        return {header: analyze_text_with_rag(request.text, rag_system, request.criterion)}
 
-    # --- Initialize the RAG system by loading the pre-built index ---
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(run, request) for request in requests]
+
+    results = []
+    for request, future in zip(requests, futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logger.error(f"  ! Analysis of '{' / '.join(request.headers)}' failed: {e}")
+            results.append({header: SegmentAnalysis.failed(f"Could not get analysis. Details: {e}")
+                            for header in request.headers})
+
+    parts = {}
+    for result in results:
+        for header, analysis in result.items():
+            parts.setdefault(header, []).append(analysis)
+    return {header: SegmentAnalysis.merge(parts[header]) for header in segments if header in parts}
+
+
+def load_rag_system(faiss_index_path):
+    """Creates the RAG system, or returns None when the knowledge base has not been built."""
     try:
-        rag_system = RAGSystem(faiss_index_path)
+        return RAGSystem(faiss_index_path)
     except FileNotFoundError as e:
-        print(f"\nFATAL ERROR: {e}")
-        print("Please run 'python src/build_knowledge_base.py' to create the knowledge base first.")
-        return
-    
-    print(f"Starting analysis for: {input_file_path}")
-
-    # Ingest Document
-    if input_file_path.lower().endswith('.docx'):
-        full_text = extract_text_from_docx(input_file_path)
-    elif input_file_path.lower().endswith('.pdf'):
-        full_text = extract_text_from_pdf(input_file_path)
-    elif input_file_path.lower().endswith('.txt'):
-        full_text = extract_text_from_txt(input_file_path)
-    else:
-        print("Error: Unsupported file format. Please use .docx, .pdf, or .txt")
-        return
-    
-    if not full_text:
-        print("Error: Could not extract text from the document.")
-        return
+        logger.error(f"\nFATAL ERROR: {e}")
+        logger.error("Please run 'python src/build_knowledge_base.py' to create the knowledge base first.")
+        return None
+
+
+def analyze_petition(input_file_path, rag_system, output_filename, max_workers=DEFAULT_MAX_WORKERS,
+                     report_formats=None, previous=None, check_source=True):
+    """
+    Runs the full analysis for one petition with an existing RAG system.
+    The report is written in each of report_formats (default REPORT_FORMATS)
+    next to output_filename, with the matching extension. With 'previous'
+    (the analyses JSON of an earlier run of the petition), only new or
+    changed sections are analyzed and the rest are reused. Unless
+    check_source is False (an earlier run chosen explicitly, e.g. of a
+    renamed draft), 'previous' is only used if it analyzed this same file.
+    Returns the path of the first report, or None if no report was created.
+    """
+    with telemetry.span("petition", file=os.path.basename(input_file_path)) as span:
+        report = _analyze_petition(input_file_path, rag_system, output_filename, max_workers,
+                                   report_formats or REPORT_FORMATS, previous, check_source)
+        span.set(report_created=report is not None)
+        return report
+
+
+def _analyze_petition(input_file_path, rag_system, output_filename, max_workers, report_formats, previous,
+                      check_source):
+    logger.info(f"Starting analysis for: {input_file_path}")
+
+    # Ingest and Segment Document. The text is streamed page by page (or
+    # paragraph by paragraph) straight into the segmenter.
+    document_stream = stream_document(input_file_path)
+    if document_stream is None:
+        logger.error("Error: Unsupported file format. Please use .docx, .pdf, or .txt")
+        return None
     
-    # Segment Document
-    segments = segment_petition(full_text)
+    try:
+        segments = segment_petition(document_stream)
+    except DocumentReadError as e:
+        logger.error(f"Error: {e}. The document was not analyzed.")
+        return None
     if not segments:
-        print("Error: Could not segment the document. Analyzing as a whole.")
-        segments = {"Full Petition": full_text}
-    
-    # Analyze Each Segment with the RAG Powered System
-    all_analyses = {}
-    for header, text_chunk in segments.items():
-        print(f"\n--- Analyzing Segment: {header}  ---")
-        if len(text_chunk) > 100:
-            analysis = analyze_text_with_rag(text_chunk, rag_system)
-            if analysis:
-                all_analyses[header] = analysis
-        else:
-            print(" - Segment too short, skipping analysis.")
+        logger.error("Error: Could not extract text from the document.")
+        return None
     
+    # Analyze Each Segment with the RAG Powered System. In incremental mode
+    # only the sections that changed since the previous run are sent.
+    signature = analysis_signature()
+    reused, to_analyze = {}, segments
+    if previous:
+        reused, to_analyze = reuse_unchanged(segments, previous, signature,
+                                             source=input_file_path if check_source else None)
+        telemetry.current_span().set(reused_sections=len(reused), changed_sections=len(to_analyze))
+    analyzed = analyze_segments(to_analyze, rag_system, max_workers=max_workers) if to_analyze else {}
+    for header, analysis in analyzed.items():
+        analysis.fingerprint = segment_fingerprint(segments[header])
+    all_analyses = {h: reused.get(h) or analyzed[h] for h in segments if h in reused or h in analyzed}
+
     # Generate Final Report
-    if all_analyses:
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        output_filename = os.path.join(output_dir, 'RFE_Risk_Report_Real.docx')
-        create_rfe_risk_report(all_analyses, output_filename=output_filename)
-    else:
-        print("No analysis was generated. The report will not be created.")
+    if not all_analyses:
+        logger.warning("No analysis was generated. The report will not be created.")
+        return None
+    output_dir = os.path.dirname(output_filename)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    base_filename = os.path.splitext(output_filename)[0]
+    reports = [f"{base_filename}.{report_format}" for report_format in report_formats]
+    with telemetry.span("report", sections=len(all_analyses), formats=",".join(report_formats),
+                        rows=sum(len(a.weaknesses) for a in all_analyses.values())):
+        for report in reports:
+            if not report.endswith('.json'):
+                create_rfe_risk_report(all_analyses, output_filename=report)
+    # The analyses themselves, for reuse without calling the API again.
+    dump_analyses(all_analyses, base_filename + '.json', analysis_signature=signature,
+                  source=os.path.abspath(input_file_path))
+    return reports[0]
+
+
+# The main function takes the file path directly 
+def main(input_file_path, max_workers=DEFAULT_MAX_WORKERS, output_dir=OUTPUT_DIR, index_path=FAISS_INDEX_PATH,
+         report_formats=None, incremental=False, previous=None):
+    """
+    Main function to orchestrate the RFE analysis process. With incremental,
+    sections unchanged since the previous run (whose analyses are stored next
+    to the report, or in 'previous') are not analyzed again.
+    """
+    job_start = time.perf_counter()
+    rag_system = load_rag_system(index_path)
+    if rag_system is None:
+        return
+
+    output_filename = os.path.join(output_dir, 'RFE_Risk_Report_Real.docx')
+    # The default analyses file is shared by every petition, so it is only used if it is of this one.
+    check_source = not previous
+    if incremental and not previous:
+        previous = os.path.splitext(output_filename)[0] + '.json'
+    analyze_petition(input_file_path, rag_system, output_filename, max_workers=max_workers,
+                     report_formats=report_formats, previous=previous, check_source=check_source)
+    llm_cache.print_stats()
+    page_cache.print_stats()
+    retrieval_cache.print_stats()
+    usage_counter.print_stats()
+
+    job_seconds = time.perf_counter() - job_start
+    logger.info(f"Timing: startup (imports) {job_start - PROCESS_START:.2f}s, "
+                f"model/index loading {rag_system.load_seconds:.2f}s, job {job_seconds:.2f}s.")
+
+
+def parse_report_formats(value):
+    """argparse type for --formats."""
+    formats = [f.strip().lower() for f in value.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in SUPPORTED_FORMATS]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(f"unknown report format(s) {', '.join(unknown) or value!r}")
+    return formats
+
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("Usage: python src/main.py <path/to/your/file>")
-        print("Example (from root folder): python src/main.py samples/sample_petition.docx")
+    parser = argparse.ArgumentParser(
+        description="Analyze a draft EB-1A petition for RFE risks.",
+        epilog="Example (from root folder): python src/main.py samples/sample_petition.docx",
+    )
+    parser.add_argument("input_path", help="Path to the petition (.docx, .pdf or .txt), or a directory or "
+                                           "JSON manifest of petitions to analyze as a batch (see src/batch.py)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS,
+                        help=f"Number of segments analyzed concurrently (default: {DEFAULT_MAX_WORKERS})")
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE,
+                        help="Maximum OpenAI requests per minute, 0 for no limit")
+    parser.add_argument("--tpm", type=int, default=TOKENS_PER_MINUTE,
+                        help="Maximum OpenAI tokens per minute, 0 for no limit")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the on-disk LLM response cache and call the API for every request")
+    parser.add_argument("--formats", type=parse_report_formats, default=REPORT_FORMATS,
+                        help=f"Comma-separated report formats: {', '.join(SUPPORTED_FORMATS)} "
+                             f"(default: {','.join(REPORT_FORMATS)})")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only analyze sections that are new or changed since the previous run of the petition")
+    parser.add_argument("--previous", metavar="PATH",
+                        help="Analyses JSON of an earlier run to reuse (implies --incremental; default: the one "
+                             "next to the report)")
+    parser.add_argument("--trace", metavar="PATH", default=telemetry.TRACE_FILE,
+                        help="Write timing spans (extraction, segmentation, LLM calls, retrieval, report) to this file")
+    parser.add_argument("--trace-format", choices=telemetry.TRACE_FORMATS, default=telemetry.TRACE_FORMAT,
+                        help="'json' lines, or 'otlp' for the OpenTelemetry OTLP/JSON file format")
+    parser.add_argument("--server", metavar="URL", nargs="?", const=DEFAULT_SERVER_URL,
+                        help=f"Submit the job to a running 'python src/server.py' instead of "
+                             f"loading the models here (default URL: {DEFAULT_SERVER_URL})")
+    args = parser.parse_args()
+    telemetry.configure_logging()
+
+    if args.server:
+        # Rate limits, the LLM cache and tracing belong to the server process and are shared by all its jobs.
+        server_wide = [option for option, used in (
+            ("--no-cache", args.no_cache),
+            ("--rpm", args.rpm != parser.get_default("rpm")),
+            ("--tpm", args.tpm != parser.get_default("tpm")),
+            ("--trace", args.trace != parser.get_default("trace")),
+            ("--trace-format", args.trace_format != parser.get_default("trace_format")),
+        ) if used]
+        if server_wide:
+            parser.error(f"{', '.join(server_wide)} cannot be set per job with --server; "
+                         f"pass them to 'python src/server.py' instead")
+        result = submit_job(args.server, args.input_path, args.workers, report_formats=args.formats,
+                            incremental=args.incremental, previous=args.previous)
+        if result.get("report"):
+            logger.info(f"✅ Report saved as {result['report']}")
+        else:
+            logger.error(f"Error: {result.get('error', 'No report was created.')}")
+        logger.info(f"Timing: job {result.get('seconds', 0):.2f}s on the server, "
+                    f"round trip {time.perf_counter() - PROCESS_START:.2f}s including startup.")
     else:
-        input_path = sys.argv[1]
-        main(input_path)
\ No newline at end of file
+        configure_rate_limits(args.rpm, args.tpm)
+        telemetry.configure(args.trace, args.trace_format)
+        if args.no_cache:
+            llm_cache.bypass = True
+        if os.path.isdir(args.input_path) or args.input_path.lower().endswith('.json'):
+            from batch import run_batch
+            run_batch(args.input_path, segment_workers=args.workers, report_formats=args.formats,
+                      incremental=args.incremental)
+        else:
+            main(args.input_path, max_workers=args.workers, report_formats=args.formats,
+                 incremental=args.incremental or bool(args.previous), previous=args.previous)
\ No newline at end of file
@@ -0,0 +1,179 @@
+import argparse
+import collections
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- SETTINGS ---
+DEFAULT_HOST = "127.0.0.1"
+# Characters per token used for the reported usage.
+CHARS_PER_TOKEN = 4
+
+CANNED_ANALYSIS = {
+    "criterion_number": 5,
+    "criterion_name": "Original Contributions of Major Significance",
+    "overall_assessment": "The section asserts major significance without independent evidence of impact.",
+    "weaknesses": [
+        {"severity": "High", "description": "The claim of major significance lacks quantifiable evidence of field-wide impact.",
+         "excerpt": "was a major contribution to the field", "suggestion": "Cite adoption figures and citations."},
+        {"severity": "Medium", "description": "Support letters come from direct supervisors and may be seen as biased.",
+         "excerpt": "As his manager, I can attest", "suggestion": "Add letters from independent experts."},
+        {"severity": "Low", "description": "The language is generic and template-like.",
+         "excerpt": "did an excellent job", "suggestion": "Use specific, measurable statements."},
+    ],
+    "persona_notes": "Standard work for a senior professional. I would issue an RFE on this criterion.",
+}
+
+_PACKED_TITLE = re.compile(r'^\s*#### Section: (.+?)\s*$', re.MULTILINE)
+_WEAKNESS_NUMBER = re.compile(r'^\s*(\d+)\. ', re.MULTILINE)
+_HEADER_LINE = re.compile(r'^\s*((?:Section\s+\d+|\d+(?:\.\d+)+)\b.*?)\s*$', re.MULTILINE | re.IGNORECASE)
+
+
+def _classify(body):
+    """Names the pipeline call a request comes from, from its prompt and response format."""
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return response_format["json_schema"]["name"]
+    if response_format.get("type") == "json_object":
+        return "rag_batch"
+    prompt = body["messages"][-1]["content"]
+    if "pipe character" in prompt:
+        return "headers"
+    return "rag_single"
+
+
+def _respond(kind, prompt):
+    if kind == "segment_analysis":
+        return json.dumps(CANNED_ANALYSIS)
+    if kind == "packed_segment_analysis":
+        titles = list(dict.fromkeys(_PACKED_TITLE.findall(prompt)))
+        return json.dumps({"sections": [{"section": t, "analysis": CANNED_ANALYSIS} for t in titles]})
+    if kind == "rag_batch":
+        questions = prompt.split("IDENTIFIED WEAKNESSES", 1)[-1]
+        ids = [int(n) for n in _WEAKNESS_NUMBER.findall(questions)]
+        return json.dumps({"suggestions": [{"id": i, "suggestion": f"Evidence-based suggestion {i}."} for i in ids]})
+    if kind == "headers":
+        sample = prompt.split("DOCUMENT TEXT:", 1)[-1]
+        return "|".join(dict.fromkeys(h for h in _HEADER_LINE.findall(sample) if len(h) < 160))
+    return "Provide independent, quantifiable evidence that meets the regulatory standard."
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the OpenAI chat completions endpoint. Answers every
+    pipeline call with valid canned content after a configurable latency
+    and fails a configurable share of requests (HTTP 429 by default).
+    """
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, error_status=429, seed=0):
+        super().__init__(address, MockRequestHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.calls = collections.Counter()
+        self.errors = collections.Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+
+    def _draw(self):
+        with self._lock:
+            delay = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            fail = self._random.random() < self.error_rate
+        return delay, fail
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        kind = _classify(body)
+        delay, fail = self.server._draw()
+        time.sleep(delay)
+
+        with self.server._lock:
+            self.server.calls[kind] += 1
+            if fail:
+                self.server.errors[kind] += 1
+        if fail:
+            status = self.server.error_status
+            error_type = "rate_limit_exceeded" if status == 429 else "server_error"
+            self._send_json(status, {"error": {"message": "Injected error", "type": error_type, "code": error_type}},
+                            headers={"Retry-After": "0"} if status == 429 else None)
+            return
+
+        prompt = "".join(m.get("content") or "" for m in body["messages"])
+        content = _respond(kind, prompt)
+        prompt_tokens = len(prompt) // CHARS_PER_TOKEN + 1
+        completion_tokens = len(content) // CHARS_PER_TOKEN + 1
+        self._send_json(200, {
+            "id": f"chatcmpl-mock-{sum(self.server.calls.values())}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(port=0, **options):
+    """Starts a MockOpenAIServer on a background thread and returns it; stop it with shutdown()."""
+    server = MockOpenAIServer((DEFAULT_HOST, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local mock of the OpenAI chat completions API.")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that fail (0-1)")
+    parser.add_argument("--error-status", type=int, default=429)
+    args = parser.parse_args()
+    server = MockOpenAIServer((DEFAULT_HOST, args.port), args.latency_ms, args.jitter_ms,
+                              args.error_rate, args.error_status)
+    print(f"Mock OpenAI API on {server.url} (set OPENAI_BASE_URL={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from header_detector import LayoutLine
+
+logger = logging.getLogger(__name__)
+
+# --- SETTINGS ---
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+CACHE_PATH = os.getenv("RFE_PAGE_CACHE_PATH", os.path.join(project_root, '.cache', 'page_cache.sqlite'))
+# Documents not opened for this many days are evicted with their pages. 0 keeps them forever.
+MAX_AGE_DAYS = float(os.getenv("RFE_PAGE_CACHE_MAX_AGE_DAYS", "90"))
+# Set RFE_PAGE_CACHE_BYPASS=1 to extract every page again.
+BYPASS = os.getenv("RFE_PAGE_CACHE_BYPASS", "") == "1"
+# Bumped when the tables change; older cache files are emptied.
+SCHEMA_VERSION = 2
+
+
+def file_sha256(path):
+    """SHA-256 of a file's content, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PageCache:
+    """
+    On-disk cache of extracted PDF pages backed by SQLite, keyed by the
+    SHA-256 of the PDF's content and the page number, so the same exhibit
+    is only extracted once, whatever its file name. Each page stores its
+    LayoutLines and its kind (see document_parser.classify_page). Every
+    document records the extractor version its pages were made with (see
+    document_parser.extractor_version); its pages are dropped when that
+    version changes. Safe to share between threads.
+    """
+    def __init__(self, path=CACHE_PATH, max_age_days=MAX_AGE_DAYS, bypass=BYPASS):
+        self.path = path
+        self.max_age_seconds = max_age_days * 86400
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._evicted = False
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Opened lazily so a bypassed cache never touches the disk.
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self._conn.execute("DROP TABLE IF EXISTS documents")
+                self._conn.execute("DROP TABLE IF EXISTS pages")
+                self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " sha256 TEXT PRIMARY KEY, version TEXT NOT NULL, page_count INTEGER NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " sha256 TEXT NOT NULL, page INTEGER NOT NULL, kind TEXT NOT NULL, lines TEXT NOT NULL,"
+                " PRIMARY KEY (sha256, page))"
+            )
+        return self._conn
+
+    def page_count(self, sha256, version):
+        """The number of pages of a PDF seen before with this extractor version, or None."""
+        if self.bypass:
+            return None
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT page_count FROM documents WHERE sha256 = ? AND version = ?", (sha256, version)).fetchone()
+            return row[0] if row else None
+
+    def cached_pages(self, sha256, version, page_count):
+        """
+        Returns the set of cached page numbers of a PDF, and marks it as used.
+        Pages cached with another extractor version are dropped first.
+        """
+        if self.bypass:
+            return set()
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            if not self._evicted:
+                self._evict(conn, now)
+                self._evicted = True
+            conn.execute("DELETE FROM pages WHERE sha256 IN ("
+                         " SELECT sha256 FROM documents WHERE sha256 = ? AND version != ?)", (sha256, version))
+            numbers = {row[0] for row in conn.execute("SELECT page FROM pages WHERE sha256 = ?", (sha256,))}
+            conn.execute("INSERT OR REPLACE INTO documents (sha256, version, page_count, last_used) VALUES (?, ?, ?, ?)",
+                         (sha256, version, page_count, now))
+            conn.commit()
+            self.hits += len(numbers)
+            self.misses += page_count - len(numbers)
+            return numbers
+
+    def get_page(self, sha256, page):
+        """Returns (kind, LayoutLines) of a cached page, or None."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT kind, lines FROM pages WHERE sha256 = ? AND page = ?", (sha256, page)).fetchone()
+        if row is None:
+            return None
+        return row[0], [LayoutLine(*line) for line in json.loads(row[1])]
+
+    def put_pages(self, sha256, pages):
+        """Stores (page number, kind, LayoutLines) tuples."""
+        if self.bypass or not pages:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO pages (sha256, page, kind, lines) VALUES (?, ?, ?, ?)",
+                [(sha256, page, kind, json.dumps([tuple(line) for line in lines], ensure_ascii=False))
+                 for page, kind, lines in pages],
+            )
+            conn.commit()
+
+    def _evict(self, conn, now):
+        if self.max_age_seconds:
+            conn.execute("DELETE FROM pages WHERE sha256 IN (SELECT sha256 FROM documents WHERE last_used < ?)",
+                         (now - self.max_age_seconds,))
+            conn.execute("DELETE FROM documents WHERE last_used < ?", (now - self.max_age_seconds,))
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": hit_rate}
+
+    def print_stats(self):
+        if self.bypass:
+            logger.info("Page cache: bypassed.")
+            return
+        stats = self.stats()
+        if stats["hits"] + stats["misses"]:
+            logger.info(f"Page cache: {stats['hits']} pages from cache, {stats['misses']} extracted "
+                        f"({stats['hit_rate']:.0%} hit rate).")
+
+
+page_cache = PageCache()
@@ -1,28 +1,153 @@
+import json
+import logging
 import os
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain.schema.runnable import RunnablePassthrough
-from langchain.schema.output_parser import StrOutputParser
+import threading
+import time
+import numpy as np
+from embedder import EMBEDDER_BACKEND, create_embeddings
+from llm_client import API_ERRORS, chat_completion, get_client
+from lexical_index import RRF_K, BM25Index, reciprocal_rank_fusion
+from retrieval_cache import retrieval_cache
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# --- SETTINGS ---
+# "hybrid" fuses FAISS and BM25 rankings when the knowledge base has a BM25
+# index (built by build_knowledge_base.py); "vector" uses FAISS only.
+RETRIEVAL_MODE = os.getenv("RFE_RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_MODES = ("hybrid", "vector")
+# Passages retrieved per weakness and sent to the LLM.
+TOP_K = int(os.getenv("RFE_RETRIEVAL_TOP_K", "4"))
+# Candidates each retriever contributes to the fusion.
+FUSION_CANDIDATES = 20
+# Optional CPU cross-encoder that re-orders the best fused candidates, e.g.
+# "cross-encoder/ms-marco-MiniLM-L-6-v2". Off when empty.
+RERANKER_MODEL = os.getenv("RFE_RERANKER_MODEL", "")
+RERANK_CANDIDATES = 12
+RAG_MODEL = "gpt-4o"
+# The API's default, which the suggestions have always been generated with.
+RAG_TEMPERATURE = 1.0
+
 
 class RAGSystem:
-    def __init__(self, index_path):
-        print("Initializing RAG S ystem by loading from disk...")
+    def __init__(self, index_path, embedder_backend=EMBEDDER_BACKEND, retrieval_mode=RETRIEVAL_MODE,
+                 reranker_model=RERANKER_MODEL):
+        """
+        Only checks that the index exists. The embedder, the index and the LLM
+        client are loaded on first use (or by warm_up()), so runs that never
+        retrieve anything do not pay for torch and FAISS. LangChain is imported
+        lazily too, which keeps 'main.py --server' client startup short.
+        """
+        logger.info("Initializing RAG System (models load on first use)...")
         if not os.path.exists(index_path):
             raise FileNotFoundError(f"FAISS index not found at {index_path}. Please run 'src/build_knowledge_base.py' first.")
-        
-        # Step 1: Load the pre-built vector store from disk
-        embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-        self.vectorstore = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
-        self.retriever = self.vectorstore.as_retriever()
-        print("  - Vector store loaded successfully.")
-        
-        # Step 2: Set up LLM and prompt template
-        self.llm = ChatOpenAI(model_name="gpt-4o")
-        self.prompt = self._create_rag_prompt()
-        
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{retrieval_mode}'. Choose one of {', '.join(RETRIEVAL_MODES)}.")
+        self.index_path = index_path
+        self.embedder_backend = embedder_backend
+        self.retrieval_mode = retrieval_mode
+        self.reranker_model = reranker_model
+        self._embeddings = None
+        self._vectorstore = None
+        self._lexical_index = None
+        self._reranker = None
+        self._load_lock = threading.Lock()
+        self.top_k = TOP_K
+        self.index_version = None
+        self.retrieval_cache = retrieval_cache
+        # Seconds spent loading models and the index, reported by main.py
+        self.load_seconds = 0.0
+
+        self._prompt = None
+        self._batch_prompt = None
+
+    @property
+    def embeddings(self):
+        with self._load_lock:
+            if self._embeddings is None:
+                logger.info(f"  - Loading embedding model ({self.embedder_backend} backend)...")
+                start = time.perf_counter()
+                self._embeddings = create_embeddings(self.embedder_backend)
+                self.load_seconds += time.perf_counter() - start
+            return self._embeddings
+
+    @property
+    def vectorstore(self):
+        embeddings = self.embeddings
+        with self._load_lock:
+            if self._vectorstore is None:
+                from vector_index import index_version, load_vectorstore
+                start = time.perf_counter()
+                self.index_version = index_version(self.index_path)
+                self._vectorstore = load_vectorstore(self.index_path, embeddings)
+                if self.retrieval_mode == "hybrid":
+                    self._lexical_index = BM25Index.load(self.index_path)
+                self.load_seconds += time.perf_counter() - start
+                logger.info("  - Vector store loaded successfully.")
+                if self._lexical_index is not None:
+                    logger.info("  - BM25 index loaded; retrieval is hybrid.")
+            return self._vectorstore
+
+    @property
+    def lexical_index(self):
+        """The BM25 index in hybrid mode, or None (vector mode, or a knowledge base built without one)."""
+        self.vectorstore
+        return self._lexical_index
+
+    @property
+    def reranker(self):
+        if not self.reranker_model:
+            return None
+        with self._load_lock:
+            if self._reranker is None:
+                from sentence_transformers import CrossEncoder
+                logger.info(f"  - Loading re-ranker ({self.reranker_model})...")
+                start = time.perf_counter()
+                self._reranker = CrossEncoder(self.reranker_model, device="cpu")
+                self.load_seconds += time.perf_counter() - start
+            return self._reranker
+
+    @property
+    def retriever(self):
+        return self.vectorstore.as_retriever(search_kwargs={"k": self.top_k})
+
+    @property
+    def prompt(self):
+        # Importing langchain's prompts takes over a second, which runs that
+        # retrieve nothing (such as an unchanged incremental run) skip.
+        if self._prompt is None:
+            self._prompt = self._create_rag_prompt()
+        return self._prompt
+
+    @property
+    def batch_prompt(self):
+        if self._batch_prompt is None:
+            self._batch_prompt = self._create_batch_rag_prompt()
+        return self._batch_prompt
+
+    def refresh_index(self):
+        """
+        Drops the loaded index if the knowledge base was rebuilt on disk since,
+        so the next retrieval loads the new one. Returns True if it changed.
+        """
+        from vector_index import index_version
+        with self._load_lock:
+            if self._vectorstore is None or index_version(self.index_path) == self.index_version:
+                return False
+            self._vectorstore = None
+            self._lexical_index = None
+        logger.info("  - The knowledge base changed on disk; it will be reloaded.")
+        return True
+
+    def warm_up(self):
+        """Loads the embedder, the indexes, the re-ranker and the LLM client now instead of on the first request."""
+        self.vectorstore
+        self.reranker
+        get_client()
+
     def _create_rag_prompt(self):
+        from langchain.prompts import PromptTemplate
         template = """
         You are an expert legal assistant. Your task is to provide an enhanced, evidence-based suggestion to fix a weakness in an immigration petition.
         Use the following retrieved context from real USCIS decision documents to provide a highly specific and actionable recommendation.
@@ -37,20 +162,205 @@ class RAGSystem:
         ENHANCED, EVIDENCE-BASED SUGGESTION:
         """
         return PromptTemplate(template=template, input_variables=["context", "question"])
-    
+
+    def _create_batch_rag_prompt(self):
+        from langchain.prompts import PromptTemplate
+        template = """
+        You are an expert legal assistant. Your task is to provide enhanced, evidence-based suggestions to fix several weaknesses in an immigration petition.
+        Use the following retrieved context from real USCIS decision documents to provide a highly specific and actionable recommendation for each weakness.
+        Each suggestion should directly reference the standards or failure patterns mentioned in the context passages listed for that weakness.
+
+        CONTEXT FROM REAL CASES:
+        {context}
+
+        IDENTIFIED WEAKNESSES IN CURRENT PETITION:
+        {questions}
+
+        Respond with a JSON object of the form {{"suggestions": [{{"id": <weakness number>, "suggestion": "<enhanced, evidence-based suggestion>"}}]}}
+        with exactly one entry per weakness.
+        """
+        return PromptTemplate(template=template, input_variables=["context", "questions"])
+
+    def _complete(self, prompt, inputs, context_ids, **kwargs):
+        """
+        Sends the filled-in prompt through llm_client, which shares the rate
+        limits, backoff and response cache of the analysis calls and records
+        the tokens used.
+        """
+        return chat_completion([{"role": "user", "content": prompt.format(**inputs)}], model=RAG_MODEL,
+                               temperature=RAG_TEMPERATURE, context_ids=context_ids, span_name="llm.rag", **kwargs)
+
+    def _search_and_cache(self, queries, vectors, positions, ids):
+        if not positions:
+            return
+        vectorstore = self.vectorstore
+        lexical_index = self.lexical_index
+        reranker = self.reranker
+        hybrid = lexical_index is not None or reranker is not None
+        # all-MiniLM-L6-v2 vectors are unit length, so the normalized
+        # query finds the same neighbours as the raw one.
+        _, indices = vectorstore.index.search(np.vstack([vectors[i] for i in positions]),
+                                              FUSION_CANDIDATES if hybrid else self.top_k)
+        rankings = {}
+        for i, row in zip(positions, indices):
+            ranking = [int(p) for p in row if p != -1]
+            if lexical_index is not None:
+                lexical = [p for p, _ in lexical_index.search(queries[i], FUSION_CANDIDATES)]
+                ranking = reciprocal_rank_fusion([ranking, lexical], RRF_K)
+            rankings[i] = ranking
+        telemetry.current_span().set(hybrid=lexical_index is not None)
+        if reranker is not None:
+            self._rerank(queries, rankings)
+        for i in positions:
+            ids[i] = [vectorstore.index_to_docstore_id[p] for p in rankings[i][:self.top_k]]
+            self.retrieval_cache.put(queries[i], vectors[i], ids[i])
+
+    def _rerank(self, queries, rankings):
+        """Re-orders the best fused candidates of every query with one cross-encoder pass over all pairs."""
+        vectorstore = self.vectorstore
+        pairs, owners = [], []
+        for i, ranking in rankings.items():
+            for p in ranking[:RERANK_CANDIDATES]:
+                pairs.append((queries[i], vectorstore.docstore.search(vectorstore.index_to_docstore_id[p]).page_content))
+                owners.append((i, p))
+        telemetry.current_span().set(reranked=len(pairs))
+        if not pairs:
+            return
+        scores = {}
+        for (i, p), score in zip(owners, self.reranker.predict(pairs)):
+            scores.setdefault(i, {})[p] = float(score)
+        for i, by_position in scores.items():
+            rankings[i] = sorted(by_position, key=lambda p: -by_position[p])
+
+    def retrieve_batch(self, queries):
+        """
+        Embeds all queries in one encoder pass and runs a single multi-query
+        FAISS search. Returns one list of (docstore id, Document) pairs per query.
+        Queries answered before, or close enough to one answered before, are
+        served from the retrieval cache without the encoder or FAISS.
+        """
+        with telemetry.span("retrieval", queries=len(queries)) as span:
+            return self._retrieve_batch(queries, span)
+
+    def _retrieve_batch(self, queries, span):
+        vectorstore = self.vectorstore
+        cache = self.retrieval_cache
+        # Results depend on how they were ranked as well as on the index.
+        cache.bind(self.embedder_backend, f"{self.index_version}|{self.lexical_index is not None}|{self.reranker_model}")
+
+        ids = [cache.get_ids(q) for q in queries]
+        vectors = {}
+        to_embed = []
+        for i, q in enumerate(queries):
+            if ids[i] is None:
+                vector = cache.get_embedding(q)
+                if vector is None:
+                    to_embed.append(i)
+                else:
+                    vectors[i] = vector
+        span.set(exact_hits=len(queries) - len(vectors) - len(to_embed), embedded=len(to_embed))
+        if to_embed:
+            embedded = np.asarray(self.embeddings.embed_documents([queries[i] for i in to_embed]), dtype=np.float32)
+            embedded /= np.maximum(np.linalg.norm(embedded, axis=1, keepdims=True), 1e-12)
+            for i, vector in zip(to_embed, embedded):
+                cache.put_embedding(queries[i], vector)
+                vectors[i] = vector
+
+        # Near-duplicates within this batch wait for the first of them to be searched.
+        to_search, duplicates = [], []
+        for i in sorted(vectors):
+            ids[i] = cache.find_similar(vectors[i])
+            if ids[i] is not None:
+                continue
+            if any(float(vectors[j] @ vectors[i]) >= cache.similarity_threshold for j in to_search):
+                duplicates.append(i)
+            else:
+                to_search.append(i)
+        span.set(searched=len(to_search))
+        self._search_and_cache(queries, vectors, to_search, ids)
+        for i in duplicates:
+            ids[i] = cache.find_similar(vectors[i])
+        self._search_and_cache(queries, vectors, [i for i in duplicates if ids[i] is None], ids)
+
+        return [[(doc_id, vectorstore.docstore.search(doc_id)) for doc_id in row] for row in ids]
+
+    @telemetry.traced("rag.suggestions")
+    def get_enhanced_suggestions(self, weaknesses):
+        """
+        Batch version of get_enhanced_suggestion(): one retrieval and one LLM
+        call for all weaknesses of an analysis. Suggestions are returned in the
+        same order as the weaknesses. Rows the model leaves out fall back to
+        individual calls. A suggestion is None when its LLM call failed, so
+        the caller keeps the original one.
+        """
+        if not weaknesses:
+            return []
+        if len(weaknesses) == 1:
+            return [self._try_enhanced_suggestion(weaknesses[0])]
+
+        logger.info(f"  > RAG: Retrieving context for {len(weaknesses)} weaknesses in one batch...")
+        retrieved = self.retrieve_batch(weaknesses)
+
+        # Weaknesses of the same segment tend to hit the same passages, so each
+        # passage is sent once and referenced by number.
+        passage_numbers = {}
+        passages = []
+        context_ids = []
+        questions = []
+        for n, (weakness, docs) in enumerate(zip(weaknesses, retrieved), start=1):
+            refs = []
+            for doc_id, doc in docs:
+                key = doc.page_content
+                if key not in passage_numbers:
+                    passages.append(f"[{len(passages) + 1}] {doc.page_content}")
+                    passage_numbers[key] = len(passages)
+                    context_ids.append(doc_id)
+                refs.append(str(passage_numbers[key]))
+            questions.append(f"{n}. {weakness} (relevant context: {', '.join(refs)})")
+
+        inputs = {"context": "\n\n".join(passages), "questions": "\n".join(questions)}
+
+        suggestions = [None] * len(weaknesses)
+        try:
+            raw = self._complete(self.batch_prompt, inputs, context_ids, response_format={"type": "json_object"})
+            for item in json.loads(raw).get("suggestions", []):
+                index = int(item["id"]) - 1
+                if 0 <= index < len(weaknesses) and item.get("suggestion"):
+                    suggestions[index] = str(item["suggestion"])
+        except API_ERRORS as e:
+            logger.warning(f"  ! RAG: Batched suggestion request failed ({e}); keeping the original suggestions.")
+            telemetry.current_span().set(error=type(e).__name__)
+            return suggestions
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning(f"  ! RAG: Could not parse batched suggestions: {e}")
+
+        missing = [i for i, s in enumerate(suggestions) if s is None]
+        llm_calls = 1 + len(missing)
+        logger.info(f"  < RAG: Batch of {len(weaknesses)} weaknesses used 1 retrieval and {llm_calls} LLM call(s) "
+                    f"(batching factor {len(weaknesses) / llm_calls:.1f}x, "
+                    f"saved {len(weaknesses) - llm_calls} LLM calls).")
+        for i in missing:
+            suggestions[i] = self._try_enhanced_suggestion(weaknesses[i])
+        return suggestions
+
+    def _try_enhanced_suggestion(self, weakness_description):
+        try:
+            return self.get_enhanced_suggestion(weakness_description)
+        except API_ERRORS as e:
+            logger.warning(f"  ! RAG: Suggestion request failed ({e}); keeping the original suggestion.")
+            return None
+
     def get_enhanced_suggestion(self, weakness_description):
         """
         Takes a weakness description, retrieves relevant context, and generates an enhanced suggestion.
         """
-        print(f"  > RAG: Retrieving context for weakness: '{weakness_description}'")
-        
-        rag_chain = (
-            {"context": self.retriever, "question": RunnablePassthrough()}
-            | self.prompt
-            | self.llm
-            | StrOutputParser()
-        )
-        
-        enhanced_suggestion = rag_chain.invoke(weakness_description)
-        print("  < RAG: Enhanced suggestion received.")
+        logger.info(f"  > RAG: Retrieving context for weakness: '{weakness_description}'")
+        docs = self.retrieve_batch([weakness_description])[0]
+        inputs = {
+            "context": "\n\n".join(doc.page_content for _, doc in docs),
+            "question": weakness_description,
+        }
+        context_ids = [doc_id for doc_id, _ in docs]
+        enhanced_suggestion = self._complete(self.prompt, inputs, context_ids)
+        logger.info("  < RAG: Enhanced suggestion received.")
         return enhanced_suggestion
\ No newline at end of file
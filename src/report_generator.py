@@ -1,68 +1,305 @@
-from docx import Document
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+import html
+import importlib.util
+import logging
+import os
+import re
+import time
+import zipfile
+from xml.sax.saxutils import escape
+from analysis_schema import dump_analyses
 
-def create_rfe_risk_report(analyses, output_filename="RFE_Risk_Report.docx"):
+logger = logging.getLogger(__name__)
+
+TABLE_COLUMNS = ("Severity", "Weakness Description", "Problematic Excerpt", "Suggested Improvement")
+SUPPORTED_FORMATS = ("docx", "html", "json")
+
+REPORT_TITLE = "VisaCompanion RFE Risk Analyzer"
+REPORT_SUBTITLE = "EB-1A Petition Analysis Report"
+EXECUTIVE_SUMMARY = (
+    "This report provides a detailed analysis of a draft EB-1A petition, identifying potential "
+    "weaknesses that may trigger a Request for Evidence (RFE) from USCIS. Each section of the "
+    "petition has been evaluated against the corresponding EB-1A criteria, with specific, "
+    "actionable recommendations provided to strengthen the case."
+)
+# Section marks of an incremental report (see main.py --incremental).
+REUSED_NOTE = "Unchanged since the previous analysis; these findings are carried over."
+REEVALUATED_NOTE = "Re-evaluated in this revision (new or changed section)."
+
+# --- SETTINGS ---
+# Page width between the template's margins, in twentieths of a point.
+TEXT_WIDTH_TWIPS = 8640
+# document.xml is written to the archive in chunks of about this many characters.
+WRITE_CHUNK_CHARS = 1 << 16
+
+# Characters that are not allowed in XML 1.0 (PDF extraction produces some).
+_INVALID_XML_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_BODY_START = re.compile(r'<w:body>\s*')
+_SECTION_PROPERTIES = re.compile(r'<w:sectPr[ >].*?</w:sectPr>', re.DOTALL)
+
+
+def _template_path():
+    # Located without importing python-docx, which the streamed renderer does not need.
+    package_dir = os.path.dirname(importlib.util.find_spec('docx').origin)
+    return os.path.join(package_dir, 'templates', 'default.docx')
+
+
+def _runs(text, italic=False):
+    """WordprocessingML runs for text; newlines become line breaks and tabs become tabs, as in python-docx."""
+    text = escape(_INVALID_XML_CHARS.sub('', str(text)))
+    lines = []
+    for line in text.split('\n'):
+        line = line.replace('\t', '</w:t><w:tab/><w:t xml:space="preserve">')
+        lines.append(f'<w:t xml:space="preserve">{line}</w:t>')
+    properties = '<w:rPr><w:i/></w:rPr>' if italic else ''
+    return f'<w:r>{properties}{"<w:br/>".join(lines)}</w:r>' if text else ''
+
+
+def _paragraph(text='', style=None, centered=False, italic=False):
+    properties = ''
+    if style or centered:
+        properties = ('<w:pPr>' + (f'<w:pStyle w:val="{style}"/>' if style else '')
+                      + ('<w:jc w:val="center"/>' if centered else '') + '</w:pPr>')
+    return f'<w:p>{properties}{_runs(text, italic)}</w:p>'
+
+
+def _table(rows):
+    """A 'Table Grid' table with one header row and the given rows, built as a single string."""
+    width = TEXT_WIDTH_TWIPS // len(TABLE_COLUMNS)
+    cell = f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{width}"/></w:tcPr>{{}}</w:tc>'
+    parts = [
+        '<w:tbl><w:tblPr><w:tblStyle w:val="TableGrid"/><w:tblW w:type="auto" w:w="0"/>'
+        '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" '
+        'w:noHBand="0" w:noVBand="1" w:val="04A0"/></w:tblPr><w:tblGrid>',
+        f'<w:gridCol w:w="{width}"/>' * len(TABLE_COLUMNS),
+        '</w:tblGrid>',
+    ]
+    for row in [TABLE_COLUMNS, *rows]:
+        parts.append('<w:tr>' + ''.join(cell.format(_paragraph(value)) for value in row) + '</w:tr>')
+    parts.append('</w:tbl>')
+    return ''.join(parts)
+
+
+def _weakness_rows(analysis):
+    return [(w.severity, w.description, w.excerpt, w.suggestion) for w in analysis.weaknesses]
+
+
+def _revision_summary(analyses):
+    """For a report that reuses earlier analyses, a sentence on what was re-evaluated; otherwise None."""
+    reused = sum(1 for a in analyses.values() if a.reused)
+    if not reused:
+        return None
+    return (f"Incremental re-analysis: {len(analyses) - reused} of {len(analyses)} sections were re-evaluated "
+            f"because they are new or changed since the previous analysis. The other {reused} are unchanged, "
+            f"and their earlier findings are carried over.")
+
+
+def _revision_note(analysis):
+    return REUSED_NOTE if analysis.reused else REEVALUATED_NOTE
+
+
+def _incomplete_note(analysis):
+    """For a split section with failed parts, which parts its findings leave out; otherwise None."""
+    if not analysis.failed_parts:
+        return None
+    numbers = ", ".join(str(number) for number in analysis.failed_parts)
+    return (f"Incomplete: part(s) {numbers} of this section could not be analyzed, so the findings below do not "
+            f"cover them. Run the analysis again to complete it.")
+
+
+def _docx_body(analyses):
+    """Yields the report's body XML one piece (the title page, then one section) at a time."""
+    revision_summary = _revision_summary(analyses)
+    yield ''.join([
+        _paragraph(REPORT_TITLE, style='Title'),
+        _paragraph(REPORT_SUBTITLE, style='Heading1'),
+        _paragraph('Confidential Internal Memo', centered=True),
+        '<w:p><w:r><w:br w:type="page"/></w:r></w:p>',
+        _paragraph('Executive Summary', style='Heading1'),
+        _paragraph(EXECUTIVE_SUMMARY),
+        _paragraph(revision_summary) if revision_summary else '',
+    ])
+    for header, analysis in analyses.items():
+        parts = [_paragraph(f"Analysis of Section: {header}", style='Heading2')]
+        if revision_summary:
+            parts.append(_paragraph(_revision_note(analysis), italic=True))
+        if analysis.error:
+            parts.append(_paragraph(f"Error: {analysis.error}"))
+        else:
+            if analysis.failed_parts:
+                parts.append(_paragraph(_incomplete_note(analysis)))
+            parts.append(_paragraph(f"Criterion Identification: {analysis.criterion_label}", style='IntenseQuote'))
+            parts.append(_paragraph(f"Overall Assessment: {analysis.overall_assessment}", style='IntenseQuote'))
+            if analysis.weaknesses:
+                parts.append(_table(_weakness_rows(analysis)))
+            if analysis.persona_notes:
+                parts.append(_paragraph(f"Adjudicator's Persona Notes: {analysis.persona_notes}",
+                                        style='IntenseQuote'))
+        parts.append('<w:p/>')
+        yield ''.join(parts)
+
+
+def render_docx(analyses, output_filename):
     """
-    Generates a professional DOCX report from the collected AI analyses.
-    'analyses' is a dictionary where keys are segment headers and values are the AI's markdown analysis.
+    Writes the DOCX by streaming WordprocessingML straight into the archive.
+    Every other part (styles, numbering, settings...) is copied from the
+    python-docx default template, so the result looks the same as a
+    python-docx document, but no object tree is built: time is linear in
+    the number of rows and memory stays flat however large the report is.
     """
-    print("Generating final DOCX report...")
+    with zipfile.ZipFile(_template_path()) as template:
+        template_xml = template.read('word/document.xml').decode('utf-8')
+        head = _BODY_START.split(template_xml, 1)[0] + '<w:body>'
+        section_properties = _SECTION_PROPERTIES.search(template_xml).group(0)
+
+        with zipfile.ZipFile(output_filename, 'w', zipfile.ZIP_DEFLATED) as out:
+            for item in template.infolist():
+                if item.filename != 'word/document.xml':
+                    out.writestr(item, template.read(item.filename))
+            part = zipfile.ZipInfo('word/document.xml', time.localtime()[:6])
+            part.compress_type = zipfile.ZIP_DEFLATED
+            with out.open(part, 'w') as document:
+                pending, size = [head], len(head)
+                for piece in _docx_body(analyses):
+                    pending.append(piece)
+                    size += len(piece)
+                    if size >= WRITE_CHUNK_CHARS:
+                        document.write(''.join(pending).encode('utf-8'))
+                        pending, size = [], 0
+                pending.append(section_properties + '</w:body></w:document>')
+                document.write(''.join(pending).encode('utf-8'))
+
+
+def render_docx_with_python_docx(analyses, output_filename):
+    """
+    The original python-docx renderer. It builds the whole document in
+    memory and adds table rows one at a time; kept as the reference the
+    streamed renderer is checked and benchmarked against.
+    """
+    from docx import Document
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
     doc = Document()
 
     # Title Page
-    doc.add_heading('VisaCompanion RFE Risk Analyzer', level=0)
-    doc.add_heading('EB-1A Petition Analysis Report', level=1)
+    doc.add_heading(REPORT_TITLE, level=0)
+    doc.add_heading(REPORT_SUBTITLE, level=1)
     p = doc.add_paragraph('Confidential Internal Memo')
     p.alignment = WD_ALIGN_PARAGRAPH.CENTER
     doc.add_page_break()
 
     # Executive Summary
     doc.add_heading('Executive Summary', level=1)
-    doc.add_paragraph(
-        "This report provides a detailed analysis of a draft EB-1A petition, identifying potential "
-        "weaknesses that may trigger a Request for Evidence (RFE) from USCIS. Each section of the "
-        "petition has been evaluated against the corresponding EB-1A criteria, with specific, "
-        "actionable recommendations provided to strengthen the case."
-    )
+    doc.add_paragraph(EXECUTIVE_SUMMARY)
+    revision_summary = _revision_summary(analyses)
+    if revision_summary:
+        doc.add_paragraph(revision_summary)
 
     # Analysis Sections
-    for header, markdown_analysis in analyses.items():
+    for header, analysis in analyses.items():
         doc.add_heading(f"Analysis of Section: {header}", level=2)
+        if revision_summary:
+            doc.add_paragraph().add_run(_revision_note(analysis)).italic = True
+
+        if analysis.error:
+            doc.add_paragraph(f"Error: {analysis.error}")
+            doc.add_paragraph()
+            continue
 
-        lines = markdown_analysis.strip().replace("```markdown", "").replace("```", "").strip().split('\n')
-
-        in_table = False
-        table = None
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-
-            if line.startswith('|'):
-                if not in_table:
-                    num_cols = len(line.split('|')) - 2
-                    table = doc.add_table(rows=1, cols=num_cols)
-                    table.style = 'Table Grid'
-                    in_table = True
-                    header_cells = table.rows[0].cells
-                    # Set table headers
-                    headers = [h.strip() for h in line.strip('|').split('|')]
-                    for i, h in enumerate(headers):
-                        header_cells[i].text = h
-                else:
-                    # Add row to table (skipping header separator)
-                    if '---' not in line:
-                        row_cells = table.add_row().cells
-                        cells = [c.strip() for c in line.strip('|').split('|')]
-                        for i, c in enumerate(cells):
-                            row_cells[i].text = c.replace('**', '')
-            else:
-                in_table = False
-                if line.startswith('**'):
-                    doc.add_paragraph(line.replace('**', ''), style='Intense Quote')
-                else:
-                    doc.add_paragraph(line)
+        if analysis.failed_parts:
+            doc.add_paragraph(_incomplete_note(analysis))
+        doc.add_paragraph(f"Criterion Identification: {analysis.criterion_label}", style='Intense Quote')
+        doc.add_paragraph(f"Overall Assessment: {analysis.overall_assessment}", style='Intense Quote')
+
+        if analysis.weaknesses:
+            table = doc.add_table(rows=1, cols=len(TABLE_COLUMNS))
+            table.style = 'Table Grid'
+            for cell, title in zip(table.rows[0].cells, TABLE_COLUMNS):
+                cell.text = title
+            for weakness in analysis.weaknesses:
+                row_cells = table.add_row().cells
+                row_cells[0].text = weakness.severity
+                row_cells[1].text = weakness.description
+                row_cells[2].text = weakness.excerpt
+                row_cells[3].text = weakness.suggestion
+
+        if analysis.persona_notes:
+            doc.add_paragraph(f"Adjudicator's Persona Notes: {analysis.persona_notes}", style='Intense Quote')
         doc.add_paragraph()
-    
+
     doc.save(output_filename)
-    print(f"✅ Report successfully saved as {output_filename}")
\ No newline at end of file
+
+
+_HTML_STYLE = """
+body { font-family: Calibri, Arial, sans-serif; max-width: 60em; margin: 2em auto; color: #222; }
+h1.title { font-size: 2.2em; border-bottom: 1px solid #4f81bd; }
+.memo { text-align: center; font-style: italic; }
+blockquote { border-left: 4px solid #4f81bd; margin: 0.6em 0; padding: 0.2em 0.8em; color: #365f91; }
+table { border-collapse: collapse; width: 100%; margin: 0.8em 0; }
+th, td { border: 1px solid #888; padding: 0.3em 0.5em; vertical-align: top; text-align: left; }
+.error { color: #c00000; }
+.revision { font-style: italic; color: #555; }
+"""
+
+
+def _html_text(text):
+    return html.escape(str(text)).replace('\n', '<br>')
+
+
+def _html_sections(analyses, incremental):
+    for header, analysis in analyses.items():
+        parts = [f'<section>\n<h3>Analysis of Section: {_html_text(header)}</h3>\n']
+        if incremental:
+            parts.append(f'<p class="revision">{_revision_note(analysis)}</p>\n')
+        if analysis.error:
+            parts.append(f'<p class="error">Error: {_html_text(analysis.error)}</p>\n')
+        else:
+            if analysis.failed_parts:
+                parts.append(f'<p class="error">{_incomplete_note(analysis)}</p>\n')
+            parts.append(f'<blockquote>Criterion Identification: {_html_text(analysis.criterion_label)}</blockquote>\n')
+            parts.append(f'<blockquote>Overall Assessment: {_html_text(analysis.overall_assessment)}</blockquote>\n')
+            if analysis.weaknesses:
+                parts.append('<table>\n<tr>' + ''.join(f'<th>{t}</th>' for t in TABLE_COLUMNS) + '</tr>\n')
+                for row in _weakness_rows(analysis):
+                    parts.append('<tr>' + ''.join(f'<td>{_html_text(v)}</td>' for v in row) + '</tr>\n')
+                parts.append('</table>\n')
+            if analysis.persona_notes:
+                parts.append(f"<blockquote>Adjudicator's Persona Notes: {_html_text(analysis.persona_notes)}</blockquote>\n")
+        parts.append('</section>\n')
+        yield ''.join(parts)
+
+
+def render_html(analyses, output_filename):
+    """Writes the report as a single self-contained HTML page, one section at a time."""
+    with open(output_filename, 'w', encoding='utf-8') as f:
+        f.write(f'<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n'
+                f'<title>{REPORT_TITLE} - {REPORT_SUBTITLE}</title>\n<style>{_HTML_STYLE}</style>\n</head>\n<body>\n'
+                f'<h1 class="title">{REPORT_TITLE}</h1>\n<h2>{REPORT_SUBTITLE}</h2>\n'
+                f'<p class="memo">Confidential Internal Memo</p>\n'
+                f'<h2>Executive Summary</h2>\n<p>{EXECUTIVE_SUMMARY}</p>\n')
+        revision_summary = _revision_summary(analyses)
+        if revision_summary:
+            f.write(f'<p>{revision_summary}</p>\n')
+        for section in _html_sections(analyses, revision_summary is not None):
+            f.write(section)
+        f.write('</body>\n</html>\n')
+
+
+_RENDERERS = {
+    "docx": render_docx,
+    "html": render_html,
+    "json": dump_analyses,
+}
+
+
+def create_rfe_risk_report(analyses, output_filename="RFE_Risk_Report.docx"):
+    """
+    Generates the report from the collected AI analyses, in the format given
+    by the file extension: .docx (default), .html or .json.
+    'analyses' is a dictionary where keys are segment headers and values are SegmentAnalysis objects.
+    """
+    report_format = os.path.splitext(output_filename)[1].lower().lstrip('.') or "docx"
+    if report_format not in _RENDERERS:
+        raise ValueError(f"Unknown report format '{report_format}'. Choose one of {', '.join(SUPPORTED_FORMATS)}.")
+    logger.info(f"Generating final {report_format.upper()} report...")
+    _RENDERERS[report_format](analyses, output_filename)
+    logger.info(f"✅ Report successfully saved as {output_filename}")
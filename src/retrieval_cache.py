@@ -0,0 +1,152 @@
+import collections
+import logging
+import os
+import re
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- SETTINGS ---
+# Queries whose retrieval results are kept. 0 disables the cache.
+MAX_ENTRIES = int(os.getenv("RFE_RETRIEVAL_CACHE_SIZE", "4096"))
+# A new query whose embedding is at least this similar (cosine) to a cached
+# query reuses that query's top-k. 1.0 or more disables semantic reuse.
+SIMILARITY_THRESHOLD = float(os.getenv("RFE_RETRIEVAL_SIMILARITY", "0.92"))
+
+
+def _normalize(query):
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
+
+class RetrievalCache:
+    """
+    In-process LRU cache from weakness queries to their embedding and
+    top-k docstore ids. Exact repeats skip the encoder and FAISS; new
+    queries that embed within SIMILARITY_THRESHOLD of a cached one reuse its
+    neighbours and skip FAISS. Results belong to one index version and are
+    dropped when it changes; embeddings belong to one embedder and are kept.
+    Safe to share between threads.
+    """
+    def __init__(self, max_entries=MAX_ENTRIES, similarity_threshold=SIMILARITY_THRESHOLD):
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._embedder = None
+        self._embeddings = collections.OrderedDict()  # query -> unit vector
+        self._index_version = None
+        self._results = collections.OrderedDict()  # query -> (row in _matrix, docstore ids)
+        self._matrix = None  # unit vectors of the queries in _results, one row each
+        self._row_queries = []  # row -> query
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.lookups = 0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.embedding_hits = 0
+
+    def bind(self, embedder, index_version):
+        """Clears what no longer applies when the embedder or the index changed."""
+        with self._lock:
+            if embedder != self._embedder:
+                self._embedder = embedder
+                self._embeddings.clear()
+                self._index_version = None
+            if index_version != self._index_version:
+                self._index_version = index_version
+                self._results.clear()
+                self._matrix = None
+                self._row_queries = []
+
+    def get_ids(self, query):
+        """Top-k ids of an identical earlier query, or None. Counts as a lookup."""
+        with self._lock:
+            self.lookups += 1
+            if self.max_entries <= 0:
+                return None
+            entry = self._results.get(_normalize(query))
+            if entry is None:
+                return None
+            self._results.move_to_end(_normalize(query))
+            self.exact_hits += 1
+            return entry[1]
+
+    def get_embedding(self, query):
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            vector = self._embeddings.get(_normalize(query))
+            if vector is not None:
+                self._embeddings.move_to_end(_normalize(query))
+                self.embedding_hits += 1
+            return vector
+
+    def put_embedding(self, query, vector):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._embeddings[_normalize(query)] = vector
+            self._embeddings.move_to_end(_normalize(query))
+            while len(self._embeddings) > self.max_entries:
+                self._embeddings.popitem(last=False)
+
+    def find_similar(self, vector):
+        """Top-k ids of the most similar cached query within the threshold, or None."""
+        with self._lock:
+            if not self._results or self.similarity_threshold >= 1.0:
+                return None
+            # Rows 0..n-1 are always in use: evicted rows are reused in place.
+            scores = self._matrix[:len(self._results)] @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            query = self._row_queries[best]
+            self._results.move_to_end(query)
+            self.semantic_hits += 1
+            return self._results[query][1]
+
+    def put(self, query, vector, ids):
+        if self.max_entries <= 0:
+            return
+        key = _normalize(query)
+        with self._lock:
+            if key in self._results:
+                row = self._results.pop(key)[0]
+            elif len(self._results) >= self.max_entries:
+                row = self._results.popitem(last=False)[1][0]
+            else:
+                row = len(self._results)
+                if self._matrix is None:
+                    self._matrix = np.zeros((min(self.max_entries, 256), len(vector)), dtype=np.float32)
+                    self._row_queries = []
+                if row >= len(self._matrix):
+                    grown = np.zeros((min(self.max_entries, 2 * len(self._matrix)), self._matrix.shape[1]),
+                                     dtype=np.float32)
+                    grown[:len(self._matrix)] = self._matrix
+                    self._matrix = grown
+                self._row_queries.append(None)
+            self._matrix[row] = vector
+            self._row_queries[row] = key
+            self._results[key] = (row, list(ids))
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            return {
+                "lookups": self.lookups,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "embedding_hits": self.embedding_hits,
+                "hit_rate": hits / self.lookups if self.lookups else 0.0,
+                "entries": len(self._results),
+            }
+
+    def print_stats(self):
+        s = self.stats()
+        logger.info(f"Retrieval cache: {s['exact_hits']} exact + {s['semantic_hits']} semantic hits out of "
+                    f"{s['lookups']} lookups ({s['hit_rate']:.0%} hit rate), "
+                    f"{s['embedding_hits']} cached embeddings reused.")
+
+
+retrieval_cache = RetrievalCache()
@@ -0,0 +1,208 @@
+import argparse
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# --- SETTINGS ---
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = int(os.getenv("RFE_SERVER_PORT", "8765"))
+DEFAULT_SERVER_URL = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+
+
+def submit_job(server_url, input_path, max_workers=None, report_formats=None, incremental=False, previous=None):
+    """
+    Client side: sends a petition to a running analysis server and waits for
+    the result. Returns the server's JSON response as a dict. With
+    incremental, the server reuses the analyses of its last report for the
+    same file (or those in 'previous').
+    """
+    payload = {"input_path": os.path.abspath(input_path)}
+    if max_workers:
+        payload["workers"] = max_workers
+    if report_formats:
+        payload["formats"] = list(report_formats)
+    if incremental or previous:
+        payload["incremental"] = True
+    if previous:
+        payload["previous"] = os.path.abspath(previous)
+    request = urllib.request.Request(
+        server_url.rstrip('/') + '/analyze',
+        data=json.dumps(payload).encode('utf-8'),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read() or b'{}') or {"error": str(e)}
+    except urllib.error.URLError as e:
+        return {"error": f"Could not reach the analysis server at {server_url}: {e.reason}"}
+    except (ConnectionError, http.client.HTTPException) as e:
+        return {"error": f"The analysis server at {server_url} closed the connection: {e}"}
+
+
+class AnalysisServer(ThreadingHTTPServer):
+    """HTTP server that keeps one warm RAG system for all submitted jobs."""
+    daemon_threads = True
+
+    def __init__(self, address, rag_system, output_dir):
+        super().__init__(address, AnalysisRequestHandler)
+        self.rag_system = rag_system
+        self.output_dir = output_dir
+        self.started = time.time()
+        self.jobs_submitted = 0
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        # Input path -> analyses JSON of its last report, for incremental jobs.
+        self.last_analyses = {}
+        self._jobs_lock = threading.Lock()
+
+    def next_report_path(self, input_path):
+        # Concurrent jobs must not overwrite each other's reports.
+        with self._jobs_lock:
+            self.jobs_submitted += 1
+            job_number = self.jobs_submitted
+        stem = os.path.splitext(os.path.basename(input_path))[0]
+        return os.path.join(self.output_dir, f"RFE_Risk_Report_{stem}_{job_number}.docx")
+
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self._send_json(404, {"error": "Not found"})
+            return
+        self._send_json(200, {
+            "status": "ok",
+            "uptime_seconds": time.time() - self.server.started,
+            "jobs_completed": self.server.jobs_completed,
+            "jobs_failed": self.server.jobs_failed,
+            "retrieval_cache": self.server.rag_system.retrieval_cache.stats(),
+        })
+
+    def do_POST(self):
+        from main import DEFAULT_MAX_WORKERS, REPORT_FORMATS, analyze_petition
+        from report_generator import SUPPORTED_FORMATS
+
+        if self.path != '/analyze':
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length))
+            input_path = job["input_path"]
+            workers = job.get("workers", DEFAULT_MAX_WORKERS)
+            if isinstance(workers, bool) or not isinstance(workers, int) or workers < 1:
+                raise ValueError(f"'workers' must be a positive integer, got {workers!r}")
+            formats = job.get("formats") or REPORT_FORMATS
+            if not isinstance(formats, list) or any(f not in SUPPORTED_FORMATS for f in formats):
+                raise ValueError(f"'formats' must be a list of {', '.join(SUPPORTED_FORMATS)}, got {formats!r}")
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"Invalid request: {e}"})
+            return
+        if not os.path.exists(input_path):
+            self._send_json(404, {"error": f"File not found: {input_path}"})
+            return
+        previous = None
+        if job.get("incremental"):
+            previous = job.get("previous") or self.server.last_analyses.get(input_path)
+
+        start = time.perf_counter()
+        report_path = self.server.next_report_path(input_path)
+        try:
+            self.server.rag_system.refresh_index()
+            load_before = self.server.rag_system.load_seconds
+            report = analyze_petition(input_path, self.server.rag_system, report_path, max_workers=workers,
+                                      report_formats=formats, previous=previous,
+                                      check_source=not job.get("previous"))
+        except Exception as e:
+            with self.server._jobs_lock:
+                self.server.jobs_failed += 1
+            logger.error(f"Error: job for '{input_path}' failed: {e}")
+            self._send_json(500, {"error": f"Analysis failed: {e}", "seconds": time.perf_counter() - start})
+            return
+        seconds = time.perf_counter() - start
+        load_seconds = self.server.rag_system.load_seconds - load_before
+        if report is None:
+            # Nothing to analyze (unsupported or unreadable file, no text, no segments); the reason was printed.
+            with self.server._jobs_lock:
+                self.server.jobs_failed += 1
+            logger.error(f"Error: job for '{input_path}' created no report.")
+            self._send_json(422, {"error": "No report was created: the document could not be read or has no "
+                                           "sections to analyze (see the server log).", "seconds": seconds})
+            return
+        analyses_path = os.path.splitext(report_path)[0] + '.json'
+        with self.server._jobs_lock:
+            self.server.jobs_completed += 1
+            if os.path.exists(analyses_path):
+                self.server.last_analyses[input_path] = analyses_path
+        logger.info(f"Job for '{input_path}' finished in {seconds:.2f}s (model/index loading {load_seconds:.2f}s).")
+        self._send_json(200, {"report": report, "seconds": seconds, "load_seconds": load_seconds})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Loads the models once and serves analysis jobs until interrupted."""
+    from main import FAISS_INDEX_PATH, OUTPUT_DIR, load_rag_system
+
+    start = time.perf_counter()
+    rag_system = load_rag_system(FAISS_INDEX_PATH)
+    if rag_system is None:
+        return
+    rag_system.warm_up()
+    logger.info(f"RAG system warmed up in {time.perf_counter() - start:.2f}s.")
+
+    server = AnalysisServer((host, port), rag_system, OUTPUT_DIR)
+    logger.info(f"✅ Analysis server listening on http://{host}:{port} "
+                f"(submit jobs with: python src/main.py <file> --server)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down analysis server.")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    import telemetry
+    parser = argparse.ArgumentParser(description="Run a warm analysis server that main.py --server submits jobs to.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--rpm", type=int, default=None,
+                        help="Maximum OpenAI requests per minute for all jobs, 0 for no limit")
+    parser.add_argument("--tpm", type=int, default=None,
+                        help="Maximum OpenAI tokens per minute for all jobs, 0 for no limit")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the on-disk LLM response cache for every job")
+    parser.add_argument("--trace", metavar="PATH", default=telemetry.TRACE_FILE,
+                        help="Write timing spans of every job to this file")
+    parser.add_argument("--trace-format", choices=telemetry.TRACE_FORMATS, default=telemetry.TRACE_FORMAT,
+                        help="'json' lines, or 'otlp' for the OpenTelemetry OTLP/JSON file format")
+    args = parser.parse_args()
+    telemetry.configure_logging()
+
+    from llm_client import REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, configure_rate_limits
+    configure_rate_limits(REQUESTS_PER_MINUTE if args.rpm is None else args.rpm,
+                          TOKENS_PER_MINUTE if args.tpm is None else args.tpm)
+    if args.no_cache:
+        from llm_cache import llm_cache
+        llm_cache.bypass = True
+    telemetry.configure(args.trace, args.trace_format)
+    serve(args.host, args.port)
@@ -0,0 +1,273 @@
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+
+# --- SETTINGS ---
+# Where spans are written; tracing is off (and costs next to nothing) when unset.
+TRACE_FILE = os.getenv("RFE_TRACE_FILE")
+# "json": one flat JSON object per span. "otlp": OpenTelemetry's OTLP/JSON
+# encoding, one ExportTraceServiceRequest per line, as written by the
+# collector's file exporter.
+TRACE_FORMAT = os.getenv("RFE_TRACE_FORMAT", "json")
+TRACE_FORMATS = ("json", "otlp")
+SERVICE_NAME = "visa-rfe-analyzer"
+# Spans are buffered and written in batches of this size (and at exit).
+FLUSH_EVERY = 50
+# Progress and error messages below this level are not shown (DEBUG, INFO, WARNING, ERROR).
+LOG_LEVEL = os.getenv("RFE_LOG_LEVEL", "INFO").upper()
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class _NoopSpan:
+    """Returned when tracing is disabled; every method does nothing."""
+    trace_id = None
+    span_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, key, amount=1):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """A timed operation with attributes, nested under the span that was current when it started."""
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = dict(attributes)
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.error = None
+        self._token = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.tracer.export(self)
+        return False
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add(self, key, amount=1):
+        """Increments a counter attribute, e.g. retries or cache hits."""
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Tracer:
+    """Buffers finished spans and appends them to a file in the configured format."""
+    def __init__(self, path, trace_format="json"):
+        if trace_format not in TRACE_FORMATS:
+            raise ValueError(f"Unknown trace format '{trace_format}'. Choose one of {', '.join(TRACE_FORMATS)}.")
+        self.path = path
+        self.trace_format = trace_format
+        self._buffer = []
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, span):
+        with self._lock:
+            self._buffer.append(span)
+            full = len(self._buffer) >= FLUSH_EVERY
+        if full or span.parent_id is None:
+            self.flush()
+
+    def _json_record(self, span):
+        return {
+            "name": span.name,
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "start": span.start_ns / 1e9,
+            "duration_ms": round(span.duration * 1000, 3),
+            "status": "error" if span.error else "ok",
+            "error": span.error,
+            "attributes": span.attributes,
+        }
+
+    def _otlp_record(self, spans):
+        otlp_spans = []
+        for span in spans:
+            record = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.start_ns + int(span.duration * 1e9)),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            }
+            if span.parent_id:
+                record["parentSpanId"] = span.parent_id
+            otlp_spans.append(record)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": otlp_spans}],
+        }]}
+
+    def flush(self):
+        with self._lock:
+            spans, self._buffer = self._buffer, []
+            if not spans:
+                return
+            if self.trace_format == "otlp":
+                lines = [json.dumps(self._otlp_record(spans))]
+            else:
+                lines = [json.dumps(self._json_record(s), default=str) for s in spans]
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+
+
+_tracer = None
+
+
+def configure(path=TRACE_FILE, trace_format=TRACE_FORMAT):
+    """Turns tracing on (writing to path) or off (path None). Called at import with the environment settings."""
+    global _tracer
+    if _tracer is not None:
+        _tracer.flush()
+    _tracer = Tracer(path, trace_format) if path else None
+
+
+def enabled():
+    return _tracer is not None
+
+
+def span(name, **attributes):
+    """
+    Context manager timing the enclosed block as a span. Returns a shared
+    no-op object when tracing is disabled, so instrumented code pays only
+    for this call.
+    """
+    if _tracer is None:
+        return NOOP_SPAN
+    return Span(_tracer, name, attributes)
+
+
+def traced(name):
+    """Decorator that runs the function inside a span named 'name'."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with Span(_tracer, name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_span(name, seconds, **attributes):
+    """Exports an already-measured operation (such as time spent inside a generator) as a span."""
+    if _tracer is None:
+        return
+    s = Span(_tracer, name, attributes)
+    s.start_ns = time.time_ns() - int(seconds * 1e9)
+    s.duration = seconds
+    _tracer.export(s)
+
+
+def current_span():
+    """The innermost active span, or the no-op span."""
+    return _current_span.get() or NOOP_SPAN
+
+
+def propagate(fn):
+    """
+    Wraps fn so spans it opens on another thread (e.g. in a thread pool)
+    are children of the span that is current here.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return fn
+
+    def wrapper(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return wrapper
+
+
+def flush():
+    if _tracer is not None:
+        _tracer.flush()
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is at the time, so contextlib.redirect_stdout also captures log messages."""
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+# The modules of this project (and a script run directly); other libraries only show their warnings.
+_OWN_LOGGERS = frozenset(["__main__"] + [os.path.splitext(name)[0] for name in os.listdir(os.path.dirname(
+    os.path.abspath(__file__))) if name.endswith(".py")])
+
+
+def _own_or_warning(record):
+    return record.name in _OWN_LOGGERS or record.levelno >= logging.WARNING
+
+
+def configure_logging(level=LOG_LEVEL):
+    """
+    Shows the progress and error messages of every module on stdout as
+    plain lines. Called by the command-line entry points; as a library the
+    modules only log, and the application decides where messages go.
+    """
+    handler = _StdoutHandler()
+    handler.addFilter(_own_or_warning)
+    logging.basicConfig(level=level, format="%(message)s", handlers=[handler], force=True)
+
+
+configure()
+atexit.register(flush)
@@ -0,0 +1,216 @@
+import collections
+import os
+import re
+from criteria import classify_criterion
+
+# --- SETTINGS ---
+# Tokenizer used for gpt-4o. tiktoken needs its BPE file on disk (it is
+# downloaded once into TIKTOKEN_CACHE_DIR); without it a heuristic is used.
+TOKEN_ENCODING = "o200k_base"
+# Segments above this size are split at paragraph boundaries.
+MAX_SEGMENT_TOKENS = int(os.getenv("RFE_MAX_SEGMENT_TOKENS", "6000"))
+# Trailing context repeated at the start of the next part of a split segment.
+CHUNK_OVERLAP_TOKENS = 200
+# Segments below this size are packed with adjacent segments of the same criterion.
+PACK_BELOW_TOKENS = int(os.getenv("RFE_PACK_BELOW_TOKENS", "800"))
+MAX_PACK_TOKENS = 3000
+MAX_PACK_SECTIONS = 4
+# Segments this short are not analyzed at all.
+MIN_SEGMENT_CHARS = 100
+# Marks the start of each section in a packed request; the model repeats it in its answer.
+SECTION_MARKER = "#### Section: "
+
+AnalysisRequest = collections.namedtuple("AnalysisRequest", "headers text tokens part part_count criterion")
+AnalysisRequest.__doc__ = """One analysis call. 'headers' lists the segments it covers (several when
+packed); 'part' and 'part_count' number the pieces of a split segment; 'criterion' is the
+criterion the request is routed to (None when the segments could not be classified)."""
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception:
+            # Not installed, or the BPE file is not cached and there is no network.
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text):
+    """
+    Counts tokens with tiktoken when it is available offline, otherwise
+    estimates them from words and punctuation (within ~10% for English prose).
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    words = len(re.findall(r"\w+", text))
+    symbols = len(re.findall(r"[^\w\s]", text))
+    return int(words * 1.3 + symbols)
+
+
+def _split_units(text, max_tokens):
+    """Breaks text into paragraphs, then lines, then sentences, until each unit fits max_tokens."""
+    for separator in (r'\n\s*\n', r'\n', r'(?<=[.!?;])\s+'):
+        units = [u for u in re.split(separator, text) if u.strip()]
+        if len(units) > 1:
+            result = []
+            for unit in units:
+                if count_tokens(unit) > max_tokens:
+                    result.extend(_split_units(unit, max_tokens))
+                else:
+                    result.append(unit)
+            return result
+    # A single run-on block: cut it by characters.
+    step = max(1, len(text) * max_tokens // max(count_tokens(text), 1))
+    return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+def _trailing_overlap(units, overlap_tokens):
+    """The last paragraphs of units (or the last sentences, if a paragraph is too long) within overlap_tokens."""
+    overlap, size = [], 0
+    for unit in reversed(units):
+        unit_tokens = count_tokens(unit)
+        if size + unit_tokens > overlap_tokens:
+            if not overlap:
+                sentences = []
+                for sentence in reversed(re.split(r'(?<=[.!?;])\s+', unit)):
+                    size += count_tokens(sentence)
+                    if size > overlap_tokens:
+                        break
+                    sentences.insert(0, sentence)
+                if sentences:
+                    overlap.append(" ".join(sentences))
+            break
+        overlap.insert(0, unit)
+        size += unit_tokens
+    return overlap
+
+
+def split_text(text, max_tokens=MAX_SEGMENT_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Splits text into chunks of at most max_tokens at paragraph boundaries
+    (falling back to lines and sentences). Each chunk after the first starts
+    with up to overlap_tokens of the previous chunk's trailing paragraphs.
+    """
+    if count_tokens(text) <= max_tokens:
+        return [text]
+
+    chunks = []
+    current, current_tokens = [], 0
+    for unit in _split_units(text, max_tokens - overlap_tokens):
+        unit_tokens = count_tokens(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current = _trailing_overlap(current, overlap_tokens)
+            current_tokens = sum(count_tokens(u) for u in current)
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def pack_sections(sections):
+    """Joins (header, text) pairs into one prompt body, each section introduced by SECTION_MARKER."""
+    return "\n\n".join(f"{SECTION_MARKER}{header}\n{text.strip()}" for header, text in sections)
+
+
+def _normalize_header(header):
+    return re.sub(r'[\s*#`\u200b]+', ' ', header).strip().lower()
+
+
+def match_sections(sections, headers):
+    """
+    Maps (section title, value) pairs from the answer to a packed request
+    back to the original headers. Titles the model changed beyond case,
+    whitespace and markup are dropped, so those headers are missing from
+    the returned dict.
+    """
+    wanted = {_normalize_header(h): h for h in headers}
+    found = {}
+    for title, value in sections:
+        title = _normalize_header(title)
+        if title.startswith(_normalize_header(SECTION_MARKER)):
+            title = title[len(_normalize_header(SECTION_MARKER)):].strip()
+        header = wanted.get(title)
+        if header is not None and header not in found:
+            found[header] = value
+    return found
+
+
+def plan_requests(segments, max_tokens=MAX_SEGMENT_TOKENS, pack_below=PACK_BELOW_TOKENS):
+    """
+    Turns the header -> text segments into analysis requests: segments over
+    max_tokens are split, segments under pack_below are packed with adjacent
+    small segments of the same criterion, and the rest go out as they are.
+    Every request is routed to the criterion its segments were classified as.
+    Returns (requests, skipped_headers).
+    """
+    requests, skipped = [], []
+    pack, pack_criterion, pack_tokens = [], None, 0
+
+    def flush_pack():
+        nonlocal pack, pack_criterion, pack_tokens
+        if len(pack) == 1:
+            header, text, tokens = pack[0]
+            requests.append(AnalysisRequest([header], text, tokens, 1, 1, pack_criterion))
+        elif pack:
+            text = pack_sections([(header, text) for header, text, _ in pack])
+            requests.append(AnalysisRequest([header for header, _, _ in pack], text, count_tokens(text), 1, 1,
+                                            pack_criterion))
+        pack, pack_criterion, pack_tokens = [], None, 0
+
+    for header, text in segments.items():
+        if len(text) <= MIN_SEGMENT_CHARS:
+            skipped.append(header)
+            continue
+        tokens = count_tokens(text)
+        criterion = classify_criterion(header, text)
+
+        if tokens > max_tokens:
+            flush_pack()
+            parts = split_text(text, max_tokens)
+            for number, part in enumerate(parts, 1):
+                requests.append(AnalysisRequest([header], part, count_tokens(part), number, len(parts), criterion))
+            continue
+        if tokens >= pack_below:
+            flush_pack()
+            requests.append(AnalysisRequest([header], text, tokens, 1, 1, criterion))
+            continue
+
+        fits = (pack and criterion is not None and criterion == pack_criterion
+                and pack_tokens + tokens <= MAX_PACK_TOKENS and len(pack) < MAX_PACK_SECTIONS)
+        if not fits:
+            flush_pack()
+            pack_criterion = criterion
+        pack.append((header, text, tokens))
+        pack_tokens += tokens
+    flush_pack()
+    return requests, skipped
+
+
+def summarize_plan(requests, segments, skipped, instruction_tokens):
+    """
+    Estimated prompt tokens and request count of the plan, next to the cost
+    of sending every analyzed segment whole as its own request with the
+    unrouted prompt. instruction_tokens(criterion) is the size of the
+    instructions sent with a request routed to that criterion.
+    """
+    analyzed = [text for header, text in segments.items() if header not in skipped]
+    packed = [r for r in requests if len(r.headers) > 1]
+    return {
+        "segments": len(analyzed),
+        "requests": len(requests),
+        "split_parts": sum(1 for r in requests if r.part_count > 1),
+        "packed_segments": sum(len(r.headers) for r in packed),
+        "routed_requests": sum(1 for r in requests if r.criterion is not None),
+        "prompt_tokens": sum(r.tokens + instruction_tokens(r.criterion) for r in requests),
+        "unplanned_prompt_tokens": sum(count_tokens(text) + instruction_tokens(None) for text in analyzed),
+    }
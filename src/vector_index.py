@@ -0,0 +1,339 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain.schema import Document
+from lexical_index import LEXICAL_DIR, META_FILE as LEXICAL_META_FILE, remove_lexical_index
+
+logger = logging.getLogger(__name__)
+
+# --- SETTINGS ---
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# float16 stores every vector (in the flat, IVF-flat and HNSW indexes) in
+# half the space, with search results practically identical to float32.
+VECTOR_DTYPES = ("float32", "float16")
+# Master flat index; always kept so the builder can update it incrementally
+# and so ANN indexes can be evaluated against exact search.
+MASTER_INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+CONFIG_FILE = "index_config.json"
+DEFAULT_INDEX_PARAMS = {
+    "nlist": None,      # IVF cells, default 4 * sqrt(n)
+    "nprobe": 8,        # IVF cells visited per query
+    "pq_m": 48,         # PQ sub-quantizers (must divide the embedding dimension)
+    "pq_nbits": 8,
+    "hnsw_m": 32,
+    "ef_construction": 80,
+    "ef_search": 64,
+    "vector_dtype": os.getenv("RFE_VECTOR_DTYPE", "float16"),
+}
+# FAISS needs roughly this many training points per centroid.
+MIN_POINTS_PER_CENTROID = 39
+# Vectors copied at a time when converting an index to another precision.
+CONVERT_BATCH = 100000
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Random-access docstore backed by SQLite, used instead of the pickled
+    InMemoryDocstore so a process only reads the chunks it retrieves.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, text TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS positions (pos INTEGER PRIMARY KEY, id TEXT NOT NULL)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def search(self, search):
+        with self._lock:
+            row = self._conn.execute("SELECT text, metadata FROM docs WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO docs (id, text, metadata) VALUES (?, ?, ?)",
+                [(doc_id, doc.page_content, json.dumps(doc.metadata)) for doc_id, doc in texts.items()],
+            )
+            self._conn.commit()
+
+    def delete(self, ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM docs WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def write_positions(self, index_to_docstore_id):
+        """Stores the FAISS position -> docstore id map and drops docs that are no longer indexed."""
+        with self._lock:
+            self._conn.execute("DELETE FROM positions")
+            self._conn.executemany("INSERT INTO positions (pos, id) VALUES (?, ?)",
+                                   list(index_to_docstore_id.items()))
+            self._conn.execute("DELETE FROM docs WHERE id NOT IN (SELECT id FROM positions)")
+            self._conn.commit()
+
+    def read_positions(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT pos, id FROM positions"))
+
+
+class SQLiteIdMap(Mapping):
+    """Read-only, lazily queried FAISS position -> docstore id map for serving processes."""
+    def __init__(self, docstore):
+        self._docstore = docstore
+
+    def __getitem__(self, pos):
+        with self._docstore._lock:
+            row = self._docstore._conn.execute("SELECT id FROM positions WHERE pos = ?", (int(pos),)).fetchone()
+        if row is None:
+            raise KeyError(pos)
+        return row[0]
+
+    def __iter__(self):
+        with self._docstore._lock:
+            positions = [row[0] for row in self._docstore._conn.execute("SELECT pos FROM positions ORDER BY pos")]
+        return iter(positions)
+
+    def __len__(self):
+        with self._docstore._lock:
+            return self._docstore._conn.execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+
+
+def ann_index_file(index_type):
+    return MASTER_INDEX_FILE if index_type == "flat" else f"index.{index_type}.faiss"
+
+
+def load_config(index_path):
+    config_path = os.path.join(index_path, CONFIG_FILE)
+    if not os.path.exists(config_path):
+        return {"index_type": "flat", **DEFAULT_INDEX_PARAMS}
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return {**DEFAULT_INDEX_PARAMS, **json.load(f)}
+
+
+def index_version(index_path):
+    """
+    Identifies the saved index by the size and modification time of its
+    files, so caches of retrieval results can tell when it was rebuilt.
+    """
+    parts = []
+    for name in (MASTER_INDEX_FILE, CONFIG_FILE, DOCSTORE_FILE, "index.pkl",
+                 os.path.join(LEXICAL_DIR, LEXICAL_META_FILE)):
+        path = os.path.join(index_path, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "|".join(parts)
+
+
+def flat_index(d, vector_dtype):
+    """An empty exact (flat) L2 index storing vectors as float32 or float16."""
+    if vector_dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Unknown vector dtype '{vector_dtype}'. Choose one of {', '.join(VECTOR_DTYPES)}.")
+    if vector_dtype == "float16":
+        return faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    return faiss.IndexFlatL2(d)
+
+
+def index_vector_dtype(index):
+    if isinstance(index, faiss.IndexScalarQuantizer) and index.sq.qtype == faiss.ScalarQuantizer.QT_fp16:
+        return "float16"
+    return "float32"
+
+
+def convert_flat_index(index, vector_dtype):
+    """Copies a flat index into the given precision (positions unchanged), or returns it if it already is."""
+    if index_vector_dtype(index) == vector_dtype:
+        return index
+    converted = flat_index(index.d, vector_dtype)
+    for start in range(0, index.ntotal, CONVERT_BATCH):
+        converted.add(index.reconstruct_n(start, min(CONVERT_BATCH, index.ntotal - start)))
+    logger.info(f"Converted the index to {vector_dtype} vectors ({index.ntotal} vectors).")
+    return converted
+
+
+def build_ann_index(vectors, index_type, params=None):
+    """
+    Builds and trains a FAISS index of the given type over vectors (float32,
+    shape n x d). Positions match the row order of vectors. Falls back to a
+    flat index when there are too few vectors to train the quantizers.
+    """
+    params = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+    n, d = vectors.shape
+    float16 = params["vector_dtype"] == "float16"
+
+    if index_type == "flat":
+        index = flat_index(d, params["vector_dtype"])
+    elif index_type == "hnsw":
+        if float16:
+            index = faiss.IndexHNSWSQ(d, faiss.ScalarQuantizer.QT_fp16, params["hnsw_m"])
+        else:
+            index = faiss.IndexHNSWFlat(d, params["hnsw_m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = params["nlist"] or max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, max(1, n // MIN_POINTS_PER_CENTROID))
+        needed = MIN_POINTS_PER_CENTROID * (2 ** params["pq_nbits"]) if index_type == "ivf_pq" else nlist
+        if n < needed or nlist < 2:
+            logger.warning(f"  - Only {n} vectors, too few to train {index_type}. Using a flat index instead.")
+            return build_ann_index(vectors, "flat", params)
+        quantizer = faiss.IndexFlatL2(d)
+        if index_type == "ivf_flat" and float16:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, d, nlist, faiss.ScalarQuantizer.QT_fp16)
+        elif index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, params["pq_m"], params["pq_nbits"])
+        index.train(vectors)
+    else:
+        raise ValueError(f"Unknown index type '{index_type}'. Choose one of {', '.join(INDEX_TYPES)}.")
+
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    apply_search_params(index, params)
+    return index
+
+
+def apply_search_params(index, params):
+    """Sets the query-time knobs (nprobe for IVF, efSearch for HNSW)."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = params["nprobe"]
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = params["ef_search"]
+
+
+def _all_vectors(index):
+    return index.reconstruct_n(0, index.ntotal) if index.ntotal else np.zeros((0, index.d), dtype=np.float32)
+
+
+def save_vectorstore(vectorstore, index_path, index_type="flat", params=None):
+    """
+    Saves a LangChain FAISS store: the flat master index, the SQLite docstore
+    and, for non-flat types, a derived ANN index used for serving.
+    """
+    os.makedirs(index_path, exist_ok=True)
+    docstore = vectorstore.docstore
+    if not isinstance(docstore, SQLiteDocstore):
+        # Convert a pickled/in-memory store the first time it is saved.
+        sqlite_store = SQLiteDocstore(os.path.join(index_path, DOCSTORE_FILE))
+        sqlite_store.add({i: docstore.search(i) for i in vectorstore.index_to_docstore_id.values()})
+        vectorstore.docstore = docstore = sqlite_store
+
+    # The BM25 index refers to FAISS positions; the builder rebuilds it once at the end.
+    remove_lexical_index(index_path)
+    faiss.write_index(vectorstore.index, os.path.join(index_path, MASTER_INDEX_FILE))
+    docstore.write_positions(vectorstore.index_to_docstore_id)
+
+    params = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+    if index_type == "flat":
+        params["vector_dtype"] = index_vector_dtype(vectorstore.index)
+    else:
+        logger.info(f"Building {index_type} index over {vectorstore.index.ntotal} vectors...")
+        ann_index = build_ann_index(_all_vectors(vectorstore.index), index_type, params)
+        faiss.write_index(ann_index, os.path.join(index_path, ann_index_file(index_type)))
+    with open(os.path.join(index_path, CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump({"index_type": index_type, **params}, f, indent=1)
+
+    # The pickle is superseded by the SQLite docstore.
+    legacy_pickle = os.path.join(index_path, "index.pkl")
+    if os.path.exists(legacy_pickle):
+        os.remove(legacy_pickle)
+
+
+def load_vectorstore(index_path, embeddings, for_update=False):
+    """
+    Loads a FAISS store saved by save_vectorstore(). For serving, the ANN index
+    is memory-mapped read-only so several analyzer processes share its pages,
+    and docstore lookups go to SQLite on demand. for_update=True loads the
+    master flat index into RAM with a mutable id map, as the builder needs.
+    Indexes still stored as index.pkl are loaded with FAISS.load_local().
+    """
+    docstore_path = os.path.join(index_path, DOCSTORE_FILE)
+    if not os.path.exists(docstore_path):
+        return FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+
+    docstore = SQLiteDocstore(docstore_path)
+    if for_update:
+        index = faiss.read_index(os.path.join(index_path, MASTER_INDEX_FILE))
+        return FAISS(embeddings, index, docstore, docstore.read_positions())
+
+    config = load_config(index_path)
+    index_file = os.path.join(index_path, ann_index_file(config["index_type"]))
+    try:
+        index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        index = faiss.read_index(index_file)
+    apply_search_params(index, config)
+    return FAISS(embeddings, index, docstore, SQLiteIdMap(docstore))
+
+
+def evaluate_index_types(index_path, k=4, num_queries=200, params=None, seed=0):
+    """
+    Compares each index type with exact (flat) search on vectors sampled from
+    the master index: recall@k and mean query latency. No embedder is needed.
+    """
+    master = faiss.read_index(os.path.join(index_path, MASTER_INDEX_FILE))
+    vectors = _all_vectors(master)
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    # Perturb the stored vectors slightly so queries are not exact duplicates.
+    queries = vectors[sample] + rng.normal(0, 0.01, size=(len(sample), vectors.shape[1])).astype(np.float32)
+    _, truth = master.search(queries, k)
+
+    results = []
+    for index_type in INDEX_TYPES:
+        start = time.perf_counter()
+        index = build_ann_index(vectors, index_type, params)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query[None, :], k)
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        _, found = index.search(queries, k)
+        hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+        results.append({
+            "index_type": index_type,
+            "recall_at_k": hits / truth.size,
+            "latency_ms": latency_ms,
+            "build_seconds": build_seconds,
+        })
+    return results
+
+
+def print_evaluation(results, k):
+    print(f"{'index type':<10} {'recall@' + str(k):>10} {'latency (ms)':>13} {'build (s)':>10}")
+    for r in results:
+        print(f"{r['index_type']:<10} {r['recall_at_k']:>10.3f} {r['latency_ms']:>13.3f} {r['build_seconds']:>10.2f}")
+
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Report recall@k vs latency for each FAISS index type.")
+    parser.add_argument("--index-path", default=os.path.join(os.path.dirname(script_dir), 'faiss_index'))
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_INDEX_PARAMS["nprobe"])
+    parser.add_argument("--ef-search", type=int, default=DEFAULT_INDEX_PARAMS["ef_search"])
+    parser.add_argument("--vector-dtype", choices=VECTOR_DTYPES, default=DEFAULT_INDEX_PARAMS["vector_dtype"])
+    args = parser.parse_args()
+    import telemetry
+    telemetry.configure_logging()
+    search_params = {"nprobe": args.nprobe, "ef_search": args.ef_search, "vector_dtype": args.vector_dtype}
+    print_evaluation(evaluate_index_types(args.index_path, args.k, args.queries, search_params), args.k)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules in src/ import each other by name, as when run as scripts.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+# Tests extract pages again instead of reading or filling the shared page cache.
+os.environ.setdefault("RFE_PAGE_CACHE_BYPASS", "1")
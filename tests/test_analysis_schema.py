@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from analysis_schema import (
+    SegmentAnalysis, Weakness, dump_analyses, load_analysis_file, parse_analysis, parse_packed_analysis,
+)
+
+VALID = {
+    "criterion_number": 4,
+    "criterion_name": "Judging the Work of Others",
+    "overall_assessment": "Reviews are listed but not documented.",
+    "weaknesses": [{"severity": "**high**", "description": "No confirmation from the journal.",
+                    "excerpt": "reviewed forty manuscripts", "suggestion": "Add the editor's letter."}],
+    "persona_notes": "An adjudicator will ask who invited the reviews.",
+}
+
+
+def _part(number, criterion_number=4):
+    return SegmentAnalysis(
+        criterion_number=criterion_number, criterion_name="Judging", overall_assessment=f"Assessment {number}.",
+        weaknesses=[Weakness("Medium", f"Weakness {number}.", "excerpt", "suggestion")],
+        persona_notes=f"Notes {number}.",
+    )
+
+
+def test_parse_analysis_validates_the_response():
+    analysis = parse_analysis(json.dumps(VALID))
+    assert analysis.criterion_label == "Criterion 4: Judging the Work of Others"
+    assert analysis.weaknesses == [Weakness("High", "No confirmation from the journal.",
+                                            "reviewed forty manuscripts", "Add the editor's letter.")]
+    assert analysis.error is None and analysis.failed_parts == []
+
+
+@pytest.mark.parametrize("raw", [
+    "not json",
+    "[]",
+    json.dumps({**VALID, "weaknesses": [{"severity": "Critical", "description": "", "excerpt": "",
+                                         "suggestion": ""}]}),
+    json.dumps({**VALID, "weaknesses": [{"severity": "Low"}]}),
+    json.dumps({**VALID, "criterion_number": "four"}),
+])
+def test_parse_analysis_rejects_invalid_responses(raw):
+    with pytest.raises(ValueError):
+        parse_analysis(raw)
+
+
+def test_parse_packed_analysis():
+    raw = json.dumps({"sections": [{"section": "Criterion 4", "analysis": VALID}]})
+    [(title, analysis)] = parse_packed_analysis(raw)
+    assert title == "Criterion 4" and analysis.criterion_number == 4
+    with pytest.raises(ValueError):
+        parse_packed_analysis(json.dumps({"sections": [{"analysis": VALID}]}))
+
+
+def test_merge_keeps_part_numbers_and_records_failed_parts():
+    parts = [_part(1, criterion_number=None), SegmentAnalysis.failed("timeout"), _part(3), SegmentAnalysis.failed("")]
+    merged = SegmentAnalysis.merge(parts)
+    assert merged.error is None
+    assert merged.failed_parts == [2, 4]
+    assert merged.criterion_number == 4
+    assert merged.overall_assessment == "(Part 1) Assessment 1. (Part 3) Assessment 3."
+    assert merged.persona_notes == "(Part 1) Notes 1. (Part 3) Notes 3."
+    assert [w.description for w in merged.weaknesses] == ["Weakness 1.", "Weakness 3."]
+
+
+def test_merge_of_complete_and_failed_sections():
+    assert SegmentAnalysis.merge([_part(1), _part(2)]).failed_parts == []
+    single = _part(1)
+    assert SegmentAnalysis.merge([single]) is single
+    merged = SegmentAnalysis.merge([SegmentAnalysis.failed("first"), SegmentAnalysis.failed("second")])
+    assert merged.error == "first"
+
+
+def test_failed_parts_survive_a_round_trip(tmp_path):
+    merged = SegmentAnalysis.merge([_part(1), SegmentAnalysis.failed("timeout")])
+    path = str(tmp_path / "analyses.json")
+    dump_analyses({"Criterion 4": merged}, path)
+    analyses, _ = load_analysis_file(path)
+    assert analyses["Criterion 4"] == merged
+    assert analyses["Criterion 4"].failed_parts == [2]
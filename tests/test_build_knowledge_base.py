@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+import build_knowledge_base
+
+
+@pytest.fixture
+def knowledge_base(tmp_path, monkeypatch):
+    index_path = str(tmp_path / "faiss_index")
+    monkeypatch.setattr(build_knowledge_base, "POLICY_MANUAL_PATH", str(tmp_path / "manual.txt"))
+    monkeypatch.setattr(build_knowledge_base, "FAISS_INDEX_PATH", index_path)
+    monkeypatch.setattr(build_knowledge_base, "MANIFEST_PATH", os.path.join(index_path, "manifest.json"))
+    return tmp_path
+
+
+def _build(knowledge_base, manual):
+    (knowledge_base / "manual.txt").write_text(manual, encoding="utf-8")
+    build_knowledge_base.main(embedder_backend="fake", embed_workers=1)
+
+
+def test_a_manual_without_text_builds_no_index(knowledge_base):
+    _build(knowledge_base, " \n\t\n")
+    assert not (knowledge_base / "faiss_index" / "index.faiss").exists()
+
+
+def test_an_emptied_manual_leaves_an_empty_index(knowledge_base):
+    _build(knowledge_base, "The petitioner must show sustained national or international acclaim.")
+    assert build_knowledge_base.load_manifest()["files"]["manual.txt"]["chunk_ids"]
+    _build(knowledge_base, "")
+    assert build_knowledge_base.load_manifest()["files"]["manual.txt"]["chunk_ids"] == []
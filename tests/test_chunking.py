@@ -0,0 +1,92 @@
+import pytest
+
+from chunking import split_sentences, split_text
+
+CITATIONS = [
+    "8 C.F.R. § 204.5(h)(3)(viii)",
+    "8 U.S.C. § 1153(b)(1)(A)",
+    "25 I&N Dec. 369, 376 (AAO 2010)",
+    "596 F.3d 1115, 1122 (9th Cir. 2010)",
+    "6 USCIS-PM F.2(B)(1)",
+]
+
+
+def _decision(paragraphs=6):
+    sentences = [
+        f"The petitioner relies on {citation}. The Director found the evidence insufficient under that provision."
+        for citation in CITATIONS
+    ]
+    return "\n\n".join(" ".join(sentences[i % len(sentences):] + sentences[:i % len(sentences)])
+                       for i in range(paragraphs))
+
+
+def _spans(text):
+    spans = []
+    for citation in CITATIONS:
+        start = text.find(citation)
+        while start != -1:
+            spans.append((start, start + len(citation)))
+            start = text.find(citation, start + 1)
+    return spans
+
+
+def test_split_sentences_skips_abbreviations_initials_and_citations():
+    text = ("See Matter of Chawathe, 25 I&N Dec. 369, 376 (AAO 2010). Dr. J. Smith testified, e.g. about "
+            "Kazarian v. USCIS, 596 F.3d 1115 (9th Cir. 2010). Under 8 C.F.R. § 204.5(h)(3) the bar is high! "
+            "Is it met? Yes.")
+    assert split_sentences(text) == [
+        "See Matter of Chawathe, 25 I&N Dec. 369, 376 (AAO 2010).",
+        "Dr. J. Smith testified, e.g. about Kazarian v. USCIS, 596 F.3d 1115 (9th Cir. 2010).",
+        "Under 8 C.F.R. § 204.5(h)(3) the bar is high!",
+        "Is it met?",
+        "Yes.",
+    ]
+
+
+def test_split_sentences_handles_quotes_and_footnotes():
+    text = 'The AAO called it "a major contribution."[12] The record, however, lacks letters.'
+    assert split_sentences(text) == [
+        'The AAO called it "a major contribution."[12]',
+        "The record, however, lacks letters.",
+    ]
+
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(200, 0), (300, 80), (500, 150)])
+def test_split_text_never_cuts_a_citation(chunk_size, chunk_overlap):
+    text = _decision()
+    spans = _spans(text)
+    chunks = split_text(text, chunk_size, chunk_overlap)
+    position = 0
+    for chunk in chunks:
+        assert len(chunk) <= chunk_size
+        start = text.find(chunk, max(0, position - chunk_overlap - 1))
+        assert start != -1
+        end = start + len(chunk)
+        for span_start, span_end in spans:
+            assert not span_start < start < span_end
+            assert not span_start < end < span_end
+        position = end
+    assert position == len(text)
+
+
+def test_split_text_overlaps_by_whole_sentences():
+    text = " ".join(f"Sentence {n:02d} is here." for n in range(40))
+    chunks = split_text(text, 100, 45)
+    assert len(chunks) > 2
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # Two sentences of 20 characters (and their separators) fit within the overlap, three do not.
+        assert chunk.startswith(" ".join(split_sentences(previous)[-2:]) + " ")
+    assert {s for chunk in chunks for s in split_sentences(chunk)} == set(split_sentences(text))
+
+
+def test_split_text_keeps_short_paragraphs_whole():
+    text = "First paragraph. It is short.\n\nSecond paragraph.\n \nThird."
+    assert split_text(text, 1000, 100) == ["First paragraph. It is short.\n\nSecond paragraph.\n\nThird."]
+    assert split_text(text, 40, 0) == ["First paragraph. It is short.", "Second paragraph.\n\nThird."]
+
+
+def test_split_text_cuts_an_overlong_sentence_at_whitespace():
+    sentence = "word " * 100 + "under 8 C.F.R. § 204.5(h)(3)(viii) again"
+    chunks = split_text(sentence, 60, 0)
+    assert all(len(chunk) <= 60 for chunk in chunks)
+    assert any("8 C.F.R. § 204.5(h)(3)(viii)" in chunk for chunk in chunks)
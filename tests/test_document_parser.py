@@ -0,0 +1,108 @@
+import fitz
+import pytest
+
+import document_parser
+from document_parser import PAGE_BLANK, PAGE_DUPLICATE, PAGE_IMAGE_ONLY, PAGE_TEXT, iter_pdf_page_layouts
+from page_cache import PageCache
+
+EXHIBIT = [
+    "Exhibit 12: Letter from the editor of Nature Methods confirming that the petitioner",
+    "reviewed forty manuscripts between 2019 and 2023 at the journal's invitation, and",
+    "that reviewers are chosen for their standing in the field of computational biology.",
+]
+
+
+def _write_text(page, lines, y=72):
+    for line in lines:
+        page.insert_text((72, y), line, fontsize=9)
+        y += 14
+
+
+def _sample_pdf(path):
+    """Pages: text, blank, image-only with a stamp, a duplicate of page 1 with another page number, short text."""
+    doc = fitz.open()
+    page = doc.new_page()
+    _write_text(page, EXHIBIT + ["Page 1"])
+    doc.new_page()
+    page = doc.new_page()
+    page.insert_image(page.rect, pixmap=fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 8, 8), 0))
+    _write_text(page, ["Exhibit 13"], y=30)
+    page = doc.new_page()
+    _write_text(page, EXHIBIT + ["Page 4 of 5"])
+    page = doc.new_page()
+    _write_text(page, ["Index of exhibits"])
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    return _sample_pdf(tmp_path / "petition.pdf")
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = PageCache(str(tmp_path / "pages.sqlite"), bypass=False)
+    monkeypatch.setattr(document_parser, "page_cache", cache)
+    return cache
+
+
+def _kinds(pdf):
+    return [kind for _, kind, _ in iter_pdf_page_layouts(pdf, workers=1)]
+
+
+def test_pages_are_classified(pdf):
+    assert _kinds(pdf) == [PAGE_TEXT, PAGE_BLANK, PAGE_IMAGE_ONLY, PAGE_DUPLICATE, PAGE_TEXT]
+
+
+def test_classify_page_thresholds(pdf):
+    with fitz.open(pdf) as doc:
+        assert document_parser.classify_page(doc[1], " \n ") == PAGE_BLANK
+        assert document_parser.classify_page(doc[1], "Index of exhibits") == PAGE_TEXT
+        assert document_parser.classify_page(doc[2], "Exhibit 13") == PAGE_IMAGE_ONLY
+        # Plenty of text means a text page, whatever images it has.
+        assert document_parser.classify_page(doc[2], "x" * document_parser.IMAGE_PAGE_MAX_CHARS) == PAGE_TEXT
+
+
+def test_skipped_pages_are_left_out_of_the_text(pdf):
+    pages = list(document_parser.iter_pdf_pages(pdf, workers=1))
+    assert [number for number, _, _ in pages] == [0, 4]
+    assert pages[1][1] == len(pages[0][2])
+
+
+def test_pages_come_from_the_cache_on_a_second_run(pdf, cache, tmp_path):
+    first = list(iter_pdf_page_layouts(pdf, workers=1))
+    assert cache.stats()["misses"] == 5 and cache.stats()["hits"] == 0
+    # The same content under another name is a cache hit.
+    copy = tmp_path / "renamed.pdf"
+    copy.write_bytes(open(pdf, "rb").read())
+    assert list(iter_pdf_page_layouts(str(copy), workers=1)) == first
+    assert cache.stats()["hits"] == 5
+
+
+def test_a_page_missing_from_the_cache_is_extracted_again(pdf, cache, monkeypatch):
+    first = list(iter_pdf_page_layouts(pdf, workers=1))
+    get_page = cache.get_page
+    monkeypatch.setattr(cache, "get_page", lambda sha256, page: None if page == 3 else get_page(sha256, page))
+    assert list(iter_pdf_page_layouts(pdf, workers=1)) == first
+
+
+def test_changed_thresholds_invalidate_cached_pages(pdf, cache, monkeypatch):
+    assert _kinds(pdf)[2] == PAGE_IMAGE_ONLY
+    # Cached kinds were made with the old thresholds, so the pages are classified again.
+    monkeypatch.setattr(document_parser, "IMAGE_COVERAGE_THRESHOLD", 1.1)
+    assert _kinds(pdf)[2] == PAGE_BLANK
+    assert cache.stats()["misses"] == 10
+    assert _kinds(pdf)[2] == PAGE_BLANK
+    assert cache.stats()["hits"] == 5
+
+
+def test_extractor_version_tracks_pymupdf_and_thresholds(monkeypatch):
+    version = document_parser.extractor_version()
+    assert document_parser.extractor_version() == version
+    monkeypatch.setattr(fitz, "VersionBind", "0.0.0")
+    assert document_parser.extractor_version() != version
+    monkeypatch.undo()
+    monkeypatch.setattr(document_parser, "BLANK_PAGE_MAX_CHARS", 0)
+    assert document_parser.extractor_version() != version
@@ -0,0 +1,42 @@
+import json
+import os
+
+import pytest
+
+from document_parser import stream_document
+from header_detector import detect_headers, score_headers
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'samples')
+
+# Minimum (precision, recall) of the local detector on each labeled sample.
+# Raise them when the detector improves; a drop below them is a regression.
+THRESHOLDS = {
+    "sample_petition_1.docx": (1.0, 0.8),
+    "sample_petition_2.pdf": (1.0, 0.6),
+    "sample_petition_3.txt": (1.0, 1.0),
+    "EB1A.pdf": (0.95, 0.9),
+}
+
+
+def _labels():
+    with open(os.path.join(SAMPLES_DIR, 'header_labels.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_every_labeled_sample_has_thresholds():
+    assert set(_labels()) == set(THRESHOLDS)
+
+
+@pytest.mark.parametrize("file_name", sorted(THRESHOLDS))
+def test_detector_meets_thresholds(file_name):
+    found, _ = detect_headers(stream_document(os.path.join(SAMPLES_DIR, file_name)))
+    precision, recall = score_headers(found, _labels()[file_name])
+    min_precision, min_recall = THRESHOLDS[file_name]
+    assert precision >= min_precision, f"{file_name}: precision {precision:.2f} < {min_precision}"
+    assert recall >= min_recall, f"{file_name}: recall {recall:.2f} < {min_recall}"
+
+
+def test_score_headers_ignores_case_and_spacing():
+    assert score_headers(["Criterion  1: Awa\u200brds "], ["criterion 1: awards"]) == (1.0, 1.0)
+    assert score_headers(["Personal Statement", "Table of Contents"], ["Personal Statement"]) == (0.5, 1.0)
+    assert score_headers([], ["Personal Statement"]) == (1.0, 0.0)
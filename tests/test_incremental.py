@@ -0,0 +1,92 @@
+import ai_analyzer
+from analysis_schema import SegmentAnalysis, Weakness, dump_analyses
+from incremental import normalize_segment, reuse_unchanged, segment_fingerprint
+
+SIGNATURE = "signature-1"
+AWARDS = "The petitioner received the Young Investigator Award in 2021."
+JUDGING = "The petitioner reviewed forty manuscripts for Nature Methods."
+
+
+def _analysis(text, **kwargs):
+    return SegmentAnalysis(
+        criterion_number=1, criterion_name="Awards", overall_assessment="Weak.",
+        weaknesses=[Weakness("High", "No evidence of the award's standing.", "Young Investigator", "Add criteria.")],
+        fingerprint=segment_fingerprint(text), **kwargs,
+    )
+
+
+def _previous_run(tmp_path, analyses, signature=SIGNATURE, source=None):
+    path = tmp_path / "previous.json"
+    dump_analyses(analyses, str(path), analysis_signature=signature, source=source)
+    return str(path)
+
+
+def test_fingerprint_ignores_reflowed_whitespace_and_invisible_characters():
+    reflowed = "The petitioner received\nthe Young\u200b Investigator  Award\u00ad in 2021.\n"
+    assert normalize_segment(reflowed) == AWARDS
+    assert segment_fingerprint(reflowed) == segment_fingerprint(AWARDS)
+    # Compatibility forms (here a no-break space and a ligature) are unified.
+    assert segment_fingerprint("\ufb01nal\u00a0award") == segment_fingerprint("final award")
+    assert segment_fingerprint(AWARDS) != segment_fingerprint(AWARDS.replace("2021", "2022"))
+
+
+def test_unchanged_segments_are_reused_under_any_header(tmp_path):
+    previous = _previous_run(tmp_path, {"Criterion 1": _analysis(AWARDS)})
+    segments = {"Criterion 1: Awards (revised title)": AWARDS + "\n", "Criterion 4: Judging": JUDGING}
+    reused, changed = reuse_unchanged(segments, previous, SIGNATURE)
+    assert list(reused) == ["Criterion 1: Awards (revised title)"]
+    assert reused["Criterion 1: Awards (revised title)"].reused
+    assert reused["Criterion 1: Awards (revised title)"].weaknesses[0].severity == "High"
+    assert changed == {"Criterion 4: Judging": JUDGING}
+
+
+def test_failed_analyses_are_not_reused(tmp_path):
+    failed = SegmentAnalysis(error="API error", fingerprint=segment_fingerprint(AWARDS))
+    previous = _previous_run(tmp_path, {"Criterion 1": failed})
+    reused, changed = reuse_unchanged({"Criterion 1": AWARDS}, previous, SIGNATURE)
+    assert reused == {}
+    assert changed == {"Criterion 1": AWARDS}
+
+
+def test_partly_failed_analyses_are_not_reused(tmp_path):
+    partial = _analysis(AWARDS, failed_parts=[2])
+    previous = _previous_run(tmp_path, {"Criterion 1": partial, "Criterion 4": _analysis(JUDGING)})
+    reused, changed = reuse_unchanged({"Criterion 1": AWARDS, "Criterion 4": JUDGING}, previous, SIGNATURE)
+    assert list(reused) == ["Criterion 4"]
+    assert changed == {"Criterion 1": AWARDS}
+
+
+def test_nothing_is_reused_after_the_signature_changes(tmp_path):
+    previous = _previous_run(tmp_path, {"Criterion 1": _analysis(AWARDS)})
+    reused, changed = reuse_unchanged({"Criterion 1": AWARDS}, previous, "signature-2")
+    assert reused == {}
+    assert changed == {"Criterion 1": AWARDS}
+
+
+def test_previous_run_of_another_petition_is_ignored(tmp_path):
+    petition_a, petition_b = str(tmp_path / "a.docx"), str(tmp_path / "b.docx")
+    previous = _previous_run(tmp_path, {"Criterion 1": _analysis(AWARDS)}, source=petition_a)
+    segments = {"Criterion 1": AWARDS}
+    assert reuse_unchanged(segments, previous, SIGNATURE, source=petition_b) == ({}, segments)
+    assert list(reuse_unchanged(segments, previous, SIGNATURE, source=petition_a)[0]) == ["Criterion 1"]
+    # An explicitly chosen previous run (no source to check) is used whatever file it analyzed.
+    assert list(reuse_unchanged(segments, previous, SIGNATURE)[0]) == ["Criterion 1"]
+
+
+def test_missing_or_unreadable_previous_run(tmp_path):
+    segments = {"Criterion 1": AWARDS}
+    assert reuse_unchanged(segments, None, SIGNATURE) == ({}, segments)
+    assert reuse_unchanged(segments, str(tmp_path / "missing.json"), SIGNATURE) == ({}, segments)
+    corrupt = tmp_path / "corrupt.json"
+    corrupt.write_text("{not json", encoding="utf-8")
+    assert reuse_unchanged(segments, str(corrupt), SIGNATURE) == ({}, segments)
+
+
+def test_analysis_signature_tracks_the_model_and_prompts(monkeypatch):
+    signature = ai_analyzer.analysis_signature()
+    assert ai_analyzer.analysis_signature() == signature
+    monkeypatch.setattr(ai_analyzer, "ANALYSIS_MODEL", "gpt-4o-mini")
+    assert ai_analyzer.analysis_signature() != signature
+    monkeypatch.undo()
+    monkeypatch.setattr(ai_analyzer, "get_analysis_system_prompt", lambda: "A different system prompt.")
+    assert ai_analyzer.analysis_signature() != signature
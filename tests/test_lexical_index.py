@@ -0,0 +1,95 @@
+import collections
+import math
+
+import pytest
+
+import lexical_index
+from lexical_index import BM25Index, build_lexical_index, reciprocal_rank_fusion, remove_lexical_index, tokenize
+
+CHUNKS = {
+    0: "The petitioner received a nationally recognized award for excellence in the field.",
+    1: "Membership in associations requiring outstanding achievements, see 8 C.F.R. 204.5(h)(3)(ii).",
+    2: "Judging the work of others: the petitioner reviewed manuscripts for a peer-reviewed journal.",
+    3: "Original contributions of major significance; the award-winning method was adopted by others.",
+    5: "Scholarly articles authored by the petitioner in professional journals.",
+}
+
+
+def _reference_scores(query, chunks, k1=lexical_index.BM25_K1, b=lexical_index.BM25_B):
+    documents = {position: collections.Counter(tokenize(text)) for position, text in chunks.items()}
+    average_length = sum(sum(c.values()) for c in documents.values()) / len(documents)
+    scores = {}
+    for term, query_tf in collections.Counter(tokenize(query)).items():
+        containing = [p for p, counts in documents.items() if term in counts]
+        idf = math.log(1 + (len(documents) - len(containing) + 0.5) / (len(containing) + 0.5))
+        for position in containing:
+            tf = documents[position][term]
+            length = sum(documents[position].values())
+            norm = k1 * (1 - b + b * length / average_length)
+            scores[position] = scores.get(position, 0.0) + query_tf * idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    # Several small build batches exercise the merge of batched postings.
+    monkeypatch.setattr(lexical_index, "BUILD_BATCH", 2)
+    build_lexical_index(CHUNKS.items(), str(tmp_path))
+    return BM25Index.load(str(tmp_path))
+
+
+def test_tokenize_keeps_legal_terms_whole():
+    tokens = tokenize("See 8 C.F.R. 204.5(h)(3)(viii) on the peer-reviewed journal\u2019s standards.")
+    assert "204.5(h)(3)(viii)" in tokens
+    assert {"c.f.r", "cfr"} <= set(tokens)
+    assert {"peer-reviewed", "peer", "reviewed"} <= set(tokens)
+    assert "journal's" in tokens
+    assert "the" not in tokens and "on" not in tokens
+
+
+@pytest.mark.parametrize("query", [
+    "nationally recognized award",
+    "award award petitioner",
+    "peer review journal manuscripts",
+    "204.5(h)(3)(ii) membership",
+])
+def test_search_matches_reference_bm25(index, query):
+    expected = _reference_scores(query, CHUNKS)
+    results = index.search(query, k=10)
+    assert [position for position, _ in results] == sorted(expected, key=lambda p: -expected[p])
+    for position, score in results:
+        assert score == pytest.approx(expected[position], rel=1e-5)
+
+
+def test_search_returns_the_top_k(index):
+    results = index.search("petitioner award journal", k=2)
+    expected = _reference_scores("petitioner award journal", CHUNKS)
+    assert [position for position, _ in results] == sorted(expected, key=lambda p: -expected[p])[:2]
+
+
+def test_search_without_matching_terms(index):
+    assert index.search("unrelated query", k=5) == []
+    assert index.search("the and of", k=5) == []
+
+
+def test_load_without_an_index(tmp_path):
+    assert BM25Index.load(str(tmp_path)) is None
+
+
+def test_removed_index_is_not_loaded(tmp_path):
+    build_lexical_index(CHUNKS.items(), str(tmp_path))
+    remove_lexical_index(str(tmp_path))
+    assert BM25Index.load(str(tmp_path)) is None
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    dense = ["a", "b", "c"]
+    lexical = ["d", "b", "c"]
+    assert reciprocal_rank_fusion([dense, lexical]) == ["b", "c", "a", "d"]
+
+
+def test_reciprocal_rank_fusion_scores():
+    fused = reciprocal_rank_fusion([["x", "y"], ["y"]], k=1)
+    # x: 1/2; y: 1/3 + 1/2.
+    assert fused == ["y", "x"]
+    assert reciprocal_rank_fusion([]) == []
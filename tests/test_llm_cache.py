@@ -0,0 +1,75 @@
+import time
+
+import llm_cache
+from llm_cache import LLMCache, make_key
+
+
+def test_make_key_covers_everything_that_changes_the_response():
+    messages = [{"role": "user", "content": "Analyze this section."}]
+    key = make_key("gpt-4o", 0.2, 1000, messages, context_ids=[3, 1])
+    assert key == make_key("gpt-4o", 0.2, 1000, [dict(m) for m in messages], context_ids=(3, 1))
+    assert key != make_key("gpt-4o-mini", 0.2, 1000, messages, context_ids=[3, 1])
+    assert key != make_key("gpt-4o", 0.3, 1000, messages, context_ids=[3, 1])
+    assert key != make_key("gpt-4o", 0.2, 1200, messages, context_ids=[3, 1])
+    assert key != make_key("gpt-4o", 0.2, 1000, "Analyze this section.", context_ids=[3, 1])
+    assert key != make_key("gpt-4o", 0.2, 1000, messages, context_ids=[1, 3])
+    assert key != make_key("gpt-4o", 0.2, 1000, messages, context_ids=[3, 1], response_format={"type": "json_object"})
+
+
+def test_cached_calls_compute_once(tmp_path):
+    cache = LLMCache(path=str(tmp_path / "llm.sqlite"), bypass=False)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "response"
+
+    assert cache.cached("k", compute) == "response"
+    assert cache.cached("k", compute) == "response"
+    assert len(calls) == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_none_results_are_not_stored(tmp_path):
+    cache = LLMCache(path=str(tmp_path / "llm.sqlite"), bypass=False)
+    assert cache.cached("k", lambda: None) is None
+    assert cache.cached("k", lambda: "later") == "later"
+
+
+def test_entries_survive_a_new_instance(tmp_path):
+    path = str(tmp_path / "llm.sqlite")
+    LLMCache(path=path, bypass=False).put("k", "response")
+    assert LLMCache(path=path, bypass=False).get("k") == "response"
+
+
+def test_bypass_never_touches_the_disk(tmp_path):
+    path = tmp_path / "llm.sqlite"
+    cache = LLMCache(path=str(path), bypass=True)
+    cache.put("k", "response")
+    assert cache.get("k") is None
+    assert not path.exists()
+
+
+def test_eviction_by_count_keeps_most_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "EVICT_EVERY", 1)
+    cache = LLMCache(path=str(tmp_path / "llm.sqlite"), max_entries=2, max_age_days=0, bypass=False)
+    cache.put("a", "1")
+    time.sleep(0.01)
+    cache.put("b", "2")
+    time.sleep(0.01)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.put("c", "3")
+    assert cache.get("a") == "1"
+    assert cache.get("b") is None
+    assert cache.get("c") == "3"
+
+
+def test_eviction_by_age(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "EVICT_EVERY", 1)
+    cache = LLMCache(path=str(tmp_path / "llm.sqlite"), max_entries=0, max_age_days=1, bypass=False)
+    cache.put("old", "1")
+    cache._connect().execute("UPDATE responses SET last_used = ? WHERE key = 'old'", (time.time() - 2 * 86400,))
+    cache.put("new", "2")
+    assert cache.get("old") is None
+    assert cache.get("new") == "2"
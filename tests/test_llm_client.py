@@ -0,0 +1,135 @@
+import httpx
+import openai
+import pytest
+
+import llm_client
+from llm_client import RateLimiter, call_with_backoff
+
+
+class FakeClock:
+    """Stands in for the time module: sleep() advances the clock instead of waiting."""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    perf_counter = monotonic
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_client, "time", clock)
+    return clock
+
+
+def _rate_limit_error(retry_after=None):
+    headers = {"retry-after": retry_after} if retry_after is not None else {}
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def _flaky(errors, result="ok"):
+    """Returns a function that raises the given errors in turn, then returns result."""
+    errors = list(errors)
+    calls = []
+
+    def fn(*args, **kwargs):
+        calls.append((args, kwargs))
+        if errors:
+            raise errors.pop(0)
+        return result
+    fn.calls = calls
+    return fn
+
+
+def test_requests_per_minute_budget(clock):
+    limiter = RateLimiter(requests_per_minute=2)
+    limiter.acquire()
+    clock.now += 10
+    limiter.acquire()
+    assert clock.sleeps == []
+    # The third request waits until the first one leaves the 60-second window.
+    limiter.acquire()
+    assert clock.sleeps == [50]
+    limiter.acquire()
+    assert clock.sleeps == [50, 10]
+
+
+def test_tokens_per_minute_budget(clock):
+    limiter = RateLimiter(tokens_per_minute=1000)
+    limiter.acquire(600)
+    clock.now += 20
+    limiter.acquire(400)
+    assert clock.sleeps == []
+    limiter.acquire(100)
+    assert clock.sleeps == [40]
+    # A request larger than the whole budget is capped instead of waiting forever.
+    limiter.acquire(5000)
+    assert sum(clock.sleeps) == pytest.approx(40 + 60)
+
+
+def test_no_budget_never_waits(clock):
+    limiter = RateLimiter()
+    for _ in range(100):
+        limiter.acquire(10_000)
+    assert clock.sleeps == []
+
+
+def test_rate_limited_calls_back_off_exponentially(clock, monkeypatch):
+    monkeypatch.setattr(llm_client, "rate_limiter", RateLimiter())
+    monkeypatch.setattr(llm_client.random, "uniform", lambda low, high: high)
+    fn = _flaky([_rate_limit_error(), _rate_limit_error(), _rate_limit_error()])
+    assert call_with_backoff(fn, "prompt", model="gpt-4o") == "ok"
+    assert clock.sleeps == [1.0, 2.0, 4.0]
+    assert fn.calls == [(("prompt",), {"model": "gpt-4o"})] * 4
+
+
+def test_backoff_is_capped(monkeypatch):
+    monkeypatch.setattr(llm_client.random, "uniform", lambda low, high: high)
+    assert llm_client._backoff_delay(20, _rate_limit_error()) == llm_client.BACKOFF_MAX_SECONDS
+
+
+def test_retry_after_is_honoured(clock, monkeypatch):
+    monkeypatch.setattr(llm_client, "rate_limiter", RateLimiter())
+    monkeypatch.setattr(llm_client.random, "uniform", lambda low, high: low)
+    fn = _flaky([_rate_limit_error("7"), _rate_limit_error("not a number")])
+    assert call_with_backoff(fn) == "ok"
+    # The server's Retry-After sets the delay; an unreadable header falls back to the jittered backoff.
+    assert clock.sleeps == [7.0, 0]
+
+
+def test_gives_up_after_max_retries(clock, monkeypatch):
+    monkeypatch.setattr(llm_client, "rate_limiter", RateLimiter())
+    monkeypatch.setattr(llm_client, "MAX_RETRIES", 2)
+    monkeypatch.setattr(llm_client.random, "uniform", lambda low, high: high)
+    fn = _flaky([_rate_limit_error()] * 5)
+    with pytest.raises(openai.RateLimitError):
+        call_with_backoff(fn)
+    assert len(fn.calls) == 3
+    assert clock.sleeps == [1.0, 2.0]
+
+
+def test_other_errors_are_not_retried(clock, monkeypatch):
+    monkeypatch.setattr(llm_client, "rate_limiter", RateLimiter())
+    fn = _flaky([ValueError("bad request")])
+    with pytest.raises(ValueError):
+        call_with_backoff(fn)
+    assert len(fn.calls) == 1
+    assert clock.sleeps == []
+
+
+def test_retries_respect_the_shared_budget(clock, monkeypatch):
+    monkeypatch.setattr(llm_client, "rate_limiter", RateLimiter(requests_per_minute=1))
+    monkeypatch.setattr(llm_client.random, "uniform", lambda low, high: high)
+    fn = _flaky([_rate_limit_error()])
+    assert call_with_backoff(fn) == "ok"
+    # The retry sleeps 1s of backoff, then waits for the rest of the minute the first attempt used.
+    assert clock.sleeps == [1.0, 59.0]
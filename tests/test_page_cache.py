@@ -0,0 +1,89 @@
+import sqlite3
+
+import page_cache as page_cache_module
+from header_detector import LayoutLine
+from page_cache import PageCache, file_sha256
+
+LINES = [
+    LayoutLine("Criterion 1: Awards\n", True, 14.0, False),
+    LayoutLine("The petitioner\u2019s award.\n", False, 11.0, False),
+]
+
+
+def _cache(tmp_path, **kwargs):
+    return PageCache(str(tmp_path / "pages.sqlite"), bypass=False, **kwargs)
+
+
+def test_pages_round_trip(tmp_path):
+    cache = _cache(tmp_path)
+    assert cache.page_count("abc", "v1") is None
+    assert cache.cached_pages("abc", "v1", 3) == set()
+    cache.put_pages("abc", [(0, "text", LINES), (2, "blank", [])])
+    assert cache.page_count("abc", "v1") == 3
+    assert cache.get_page("abc", 0) == ("text", LINES)
+    assert cache.get_page("abc", 2) == ("blank", [])
+    assert cache.get_page("abc", 1) is None
+
+
+def test_hits_and_misses_are_counted(tmp_path):
+    cache = _cache(tmp_path)
+    cache.cached_pages("abc", "v1", 3)
+    cache.put_pages("abc", [(0, "text", LINES), (1, "text", LINES)])
+    assert cache.cached_pages("abc", "v1", 3) == {0, 1}
+    assert cache.stats() == {"hits": 2, "misses": 4, "hit_rate": 2 / 6}
+
+
+def test_pages_of_another_extractor_version_are_dropped(tmp_path):
+    cache = _cache(tmp_path)
+    cache.cached_pages("abc", "v1", 1)
+    cache.put_pages("abc", [(0, "text", LINES)])
+    assert cache.page_count("abc", "v2") is None
+    assert cache.cached_pages("abc", "v2", 1) == set()
+    assert cache.get_page("abc", 0) is None
+    assert cache.page_count("abc", "v2") == 1
+    assert cache.page_count("abc", "v1") is None
+
+
+def test_older_cache_files_are_emptied(tmp_path):
+    path = tmp_path / "pages.sqlite"
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE documents (sha256 TEXT PRIMARY KEY, page_count INTEGER, last_used REAL)")
+    conn.execute("CREATE TABLE pages (sha256 TEXT, page INTEGER, kind TEXT, lines TEXT)")
+    conn.execute("INSERT INTO pages VALUES ('abc', 0, 'text', '[]')")
+    conn.commit()
+    conn.close()
+    cache = _cache(tmp_path)
+    assert cache.get_page("abc", 0) is None
+    cache.cached_pages("abc", "v1", 1)
+    cache.put_pages("abc", [(0, "text", LINES)])
+    assert cache.get_page("abc", 0) == ("text", LINES)
+    assert cache._connect().execute("PRAGMA user_version").fetchone()[0] == page_cache_module.SCHEMA_VERSION
+
+
+def test_documents_not_used_for_long_are_evicted(tmp_path, monkeypatch):
+    cache = _cache(tmp_path, max_age_days=1)
+    monkeypatch.setattr(page_cache_module.time, "time", lambda: 0.0)
+    cache.cached_pages("old", "v1", 1)
+    cache.put_pages("old", [(0, "text", LINES)])
+    # Eviction runs once per process, on the first document opened.
+    later = _cache(tmp_path, max_age_days=1)
+    monkeypatch.setattr(page_cache_module.time, "time", lambda: 2 * 86400.0)
+    assert later.cached_pages("new", "v1", 1) == set()
+    assert later.page_count("old", "v1") is None
+    assert later.get_page("old", 0) is None
+
+
+def test_bypassed_cache_never_touches_the_disk(tmp_path):
+    cache = PageCache(str(tmp_path / "cache" / "pages.sqlite"), bypass=True)
+    assert cache.page_count("abc", "v1") is None
+    assert cache.cached_pages("abc", "v1", 3) == set()
+    cache.put_pages("abc", [(0, "text", LINES)])
+    assert not (tmp_path / "cache").exists()
+
+
+def test_file_sha256_depends_only_on_content(tmp_path):
+    a, b, c = tmp_path / "a.pdf", tmp_path / "b.pdf", tmp_path / "c.pdf"
+    a.write_bytes(b"%PDF-1.7 exhibit")
+    b.write_bytes(b"%PDF-1.7 exhibit")
+    c.write_bytes(b"%PDF-1.7 another exhibit")
+    assert file_sha256(str(a)) == file_sha256(str(b)) != file_sha256(str(c))
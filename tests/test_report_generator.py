@@ -0,0 +1,152 @@
+import html.parser
+
+import docx
+import pytest
+
+import report_generator
+from analysis_schema import SegmentAnalysis, Weakness, load_analysis_file
+from report_generator import TABLE_COLUMNS, create_rfe_risk_report, render_docx, render_docx_with_python_docx
+
+
+def _analyses(**awards):
+    return {
+        "Criterion 1: Awards": SegmentAnalysis(
+            criterion_number=1, criterion_name="Awards", overall_assessment="The award's standing is not shown.",
+            weaknesses=[
+                Weakness("High", "No evidence the award is national.", "Young Investigator Award",
+                         "Add the award's selection criteria."),
+                Weakness("Low", "Date missing.", "in 2021", "State the date.\nCite Exhibit 3."),
+            ],
+            persona_notes="An adjudicator will ask who else received it.", **awards,
+        ),
+        "Criterion 4: Judging <the work of others>": SegmentAnalysis(
+            criterion_number=4, criterion_name="Judging", overall_assessment="Reviews are documented.",
+            failed_parts=[2],
+        ),
+        "Exhibit List": SegmentAnalysis.failed("API error"),
+    }
+
+
+def _docx_content(path):
+    """The document body as (style, text) for paragraphs and lists of row texts for tables, in order."""
+    content = []
+    for item in docx.Document(path).iter_inner_content():
+        if isinstance(item, docx.text.paragraph.Paragraph):
+            content.append((item.style.name, item.text))
+        else:
+            content.append([[cell.text for cell in row.cells] for row in item.rows])
+    return content
+
+
+class _HTMLContent(html.parser.HTMLParser):
+    """Collects the text of headings, paragraphs and blockquotes, and the rows of tables."""
+    def __init__(self):
+        super().__init__()
+        self.blocks, self.rows = [], []
+        self._text = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self.rows.append([])
+        elif tag in ("h1", "h2", "h3", "p", "blockquote", "th", "td"):
+            self._text = []
+        elif tag == "br" and self._text is not None:
+            self._text.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("th", "td"):
+            self.rows[-1].append("".join(self._text))
+        elif tag in ("h1", "h2", "h3", "p", "blockquote"):
+            self.blocks.append("".join(self._text))
+        else:
+            return
+        self._text = None
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+
+def test_streamed_docx_reads_back_with_headings_and_tables(tmp_path):
+    path = str(tmp_path / "report.docx")
+    render_docx(_analyses(), path)
+    content = _docx_content(path)
+    headings = [text for style, text in (c for c in content if isinstance(c, tuple)) if style.startswith("Heading")]
+    assert headings == [
+        report_generator.REPORT_SUBTITLE, "Executive Summary", "Analysis of Section: Criterion 1: Awards",
+        "Analysis of Section: Criterion 4: Judging <the work of others>", "Analysis of Section: Exhibit List",
+    ]
+    [table] = [c for c in content if isinstance(c, list)]
+    assert table == [
+        list(TABLE_COLUMNS),
+        ["High", "No evidence the award is national.", "Young Investigator Award",
+         "Add the award's selection criteria."],
+        ["Low", "Date missing.", "in 2021", "State the date.\nCite Exhibit 3."],
+    ]
+    texts = [c[1] for c in content if isinstance(c, tuple)]
+    assert "Criterion Identification: Criterion 1: Awards" in texts
+    assert "Error: API error" in texts
+    assert report_generator._incomplete_note(_analyses()["Criterion 4: Judging <the work of others>"]) in texts
+
+
+def test_streamed_docx_matches_the_python_docx_renderer(tmp_path):
+    analyses = _analyses(reused=True)
+    streamed, reference = str(tmp_path / "streamed.docx"), str(tmp_path / "reference.docx")
+    render_docx(analyses, streamed)
+    render_docx_with_python_docx(analyses, reference)
+    assert _docx_content(streamed) == _docx_content(reference)
+
+
+def test_streamed_docx_strips_control_characters(tmp_path):
+    analyses = {"Criterion 1\x0c": SegmentAnalysis(
+        criterion_number=1, criterion_name="Awards", overall_assessment="Page\x00 break\x0b here.\ufffe",
+        weaknesses=[Weakness("High", "Scanned\x1b text.", "Exhibit\x0c 3\tpage 2", "OCR it.")],
+    )}
+    path = str(tmp_path / "report.docx")
+    render_docx(analyses, path)
+    content = _docx_content(path)
+    assert ("Heading 2", "Analysis of Section: Criterion 1") in content
+    assert ("Intense Quote", "Overall Assessment: Page break here.") in content
+    assert ["High", "Scanned text.", "Exhibit 3\tpage 2", "OCR it."] in next(c for c in content if isinstance(c, list))
+
+
+def test_html_report(tmp_path):
+    path = str(tmp_path / "report.html")
+    create_rfe_risk_report(_analyses(), path)
+    parser = _HTMLContent()
+    parser.feed(open(path, encoding="utf-8").read())
+    assert "Analysis of Section: Criterion 4: Judging <the work of others>" in parser.blocks
+    assert "Error: API error" in parser.blocks
+    assert "Overall Assessment: The award's standing is not shown." in parser.blocks
+    assert parser.rows == [
+        list(TABLE_COLUMNS),
+        ["High", "No evidence the award is national.", "Young Investigator Award",
+         "Add the award's selection criteria."],
+        ["Low", "Date missing.", "in 2021", "State the date.\nCite Exhibit 3."],
+    ]
+    # Section marks only appear in incremental reports.
+    assert report_generator.REUSED_NOTE not in parser.blocks
+
+
+def test_incremental_html_report_marks_sections(tmp_path):
+    analyses = _analyses(reused=True)
+    path = str(tmp_path / "report.html")
+    create_rfe_risk_report(analyses, path)
+    parser = _HTMLContent()
+    parser.feed(open(path, encoding="utf-8").read())
+    assert parser.blocks.count(report_generator.REUSED_NOTE) == 1
+    assert parser.blocks.count(report_generator.REEVALUATED_NOTE) == 2
+    assert report_generator._revision_summary(analyses) in parser.blocks
+
+
+def test_json_report_round_trips(tmp_path):
+    analyses = _analyses()
+    path = str(tmp_path / "report.json")
+    create_rfe_risk_report(analyses, path)
+    loaded, _ = load_analysis_file(path)
+    assert loaded == analyses
+
+
+def test_unknown_report_format(tmp_path):
+    with pytest.raises(ValueError):
+        create_rfe_risk_report(_analyses(), str(tmp_path / "report.pdf"))
@@ -0,0 +1,82 @@
+import numpy as np
+
+from retrieval_cache import RetrievalCache
+
+
+def _unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def _cache(**kwargs):
+    cache = RetrievalCache(**kwargs)
+    cache.bind("embedder", "index-1")
+    return cache
+
+
+def test_exact_hits_ignore_case_and_spacing():
+    cache = _cache()
+    cache.put("Lacks  evidence of awards", _unit(1, 0, 0), [3, 1])
+    assert cache.get_ids(" lacks evidence OF awards ") == [3, 1]
+    assert cache.get_ids("lacks evidence of judging") is None
+    assert cache.stats()["exact_hits"] == 1
+    assert cache.stats()["lookups"] == 2
+
+
+def test_similar_queries_reuse_the_nearest_result():
+    cache = _cache(similarity_threshold=0.9)
+    cache.put("awards", _unit(1, 0, 0), [1])
+    cache.put("judging", _unit(0, 1, 0), [2])
+    assert cache.find_similar(_unit(1, 0.1, 0)) == [1]
+    assert cache.find_similar(_unit(1, 1, 0)) is None
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_threshold_of_one_disables_semantic_reuse():
+    cache = _cache(similarity_threshold=1.0)
+    cache.put("awards", _unit(1, 0, 0), [1])
+    assert cache.find_similar(_unit(1, 0, 0)) is None
+
+
+def test_least_recently_used_results_are_evicted():
+    cache = _cache(max_entries=2, similarity_threshold=0.99)
+    cache.put("a", _unit(1, 0, 0), [1])
+    cache.put("b", _unit(0, 1, 0), [2])
+    cache.get_ids("a")
+    cache.put("c", _unit(0, 0, 1), [3])
+    assert cache.get_ids("b") is None
+    assert cache.get_ids("a") == [1]
+    assert cache.get_ids("c") == [3]
+    # The evicted row was reused for "c", so "b"'s vector no longer matches.
+    assert cache.find_similar(_unit(0, 1, 0)) is None
+    assert cache.find_similar(_unit(0, 0, 1)) == [3]
+
+
+def test_matrix_grows_past_its_first_allocation():
+    cache = _cache(max_entries=1000, similarity_threshold=0.999)
+    vectors = np.eye(300, dtype=np.float32)
+    for i, vector in enumerate(vectors):
+        cache.put(f"q{i}", vector, [i])
+    assert cache.stats()["entries"] == 300
+    assert cache.find_similar(vectors[299]) == [299]
+
+
+def test_rebinding_keeps_only_what_still_applies():
+    cache = _cache()
+    cache.put_embedding("awards", _unit(1, 0, 0))
+    cache.put("awards", _unit(1, 0, 0), [1])
+    cache.bind("embedder", "index-2")
+    assert cache.get_ids("awards") is None
+    assert cache.get_embedding("awards") is not None
+    cache.bind("other-embedder", "index-2")
+    assert cache.get_embedding("awards") is None
+
+
+def test_zero_entries_disables_the_cache():
+    cache = _cache(max_entries=0)
+    cache.put_embedding("awards", _unit(1, 0, 0))
+    cache.put("awards", _unit(1, 0, 0), [1])
+    assert cache.get_ids("awards") is None
+    assert cache.get_embedding("awards") is None
+    assert cache.find_similar(_unit(1, 0, 0)) is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,74 @@
+import json
+import os
+
+import pytest
+
+import ai_analyzer
+from criteria import CRITERIA, CRITERION_STANDARDS, classify_criterion
+
+LABELS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "samples",
+                           "header_labels.json")
+
+# The criterion each labelled sample header addresses; the others (personal
+# statements, exhibits, the national-interest sections) are not routed.
+EXPECTED = {
+    "Criterion 4: Judging the Work of Others": 4,
+    # An explicit number wins over the criterion name that follows it.
+    "Criterion 6: Original Scientific Contributions of Major Significance": 6,
+    "Criterion 8: Leading or Critical Role for a Distinguished Organization": 8,
+    "Criterion 1: Receipt of Lesser Nationally or Internationally Recognized Prizes or Awards": 1,
+    "Criterion 3: Published Material About the Alien in Professional or Major Trade": 3,
+    "Criterion 8: Performance in a Leading or Critical Role for Organizations or": 8,
+    "== CRITERION 2: MEMBERSHIPS ==": 2,
+    "== CRITERION 7: ARTISTIC EXHIBITIONS OR SHOWCASES ==": 7,
+    "== CRITERION 10: COMMERCIAL SUCCESSES IN THE PERFORMING ARTS ==": 10,
+    "1.7 Dr. Doe has made original discoveries in Organometallic Chemistry.": 5,
+    "1.10 Dr. Doe has performed in a critical role in the project in the organization of distinguished": 8,
+    "1.11 Dr. Doe has received international awards.": 1,
+    "1.12. Dr. Doe has been a judge of the work of others in the field of Organometallic Chemistry.": 4,
+}
+
+
+def _labelled_headers():
+    with open(LABELS_PATH, encoding="utf-8") as f:
+        return sorted({header for headers in json.load(f).values() for header in headers})
+
+
+@pytest.mark.parametrize("header", _labelled_headers())
+def test_labelled_headers_route_to_their_criterion(header):
+    assert classify_criterion(header) == EXPECTED.get(header)
+
+
+def test_body_text_routes_a_section_without_a_criterion_header():
+    text = ("Dr. Doe authored 40 papers in leading journals. His publication record includes conference "
+            "proceedings and a scholarly review.")
+    assert classify_criterion("1.6 Dr. Doe has widely published in his field.", text) == 6
+    # Too few keywords, or a tie, is no match.
+    assert classify_criterion("1.5 Dr. Doe has always performed at the top of his peers.", "He won an award.") is None
+    assert classify_criterion("Background", "award prize medal member society association") is None
+
+
+def test_unroutable_sections_get_all_ten_standards():
+    guide = ai_analyzer.get_criterion_guide(None)
+    assert all(standard in guide for standard in CRITERION_STANDARDS.values())
+    assert ai_analyzer.get_criterion_guide(0) == guide
+    assert ai_analyzer.get_criterion_guide(11) == guide
+
+
+def test_routed_sections_get_only_their_standard():
+    for number in CRITERIA:
+        guide = ai_analyzer.get_criterion_guide(number)
+        assert [n for n, standard in CRITERION_STANDARDS.items() if standard in guide] == [number]
+        assert ai_analyzer.CRITERION_GUIDANCE[number] in guide
+
+
+def test_system_prompt_is_identical_across_criteria(monkeypatch):
+    requests = []
+    monkeypatch.setattr(ai_analyzer, "chat_completion", lambda messages, **kwargs: requests.append(messages))
+    for criterion in [None, *CRITERIA]:
+        ai_analyzer._request_analysis("The petitioner reviewed forty manuscripts.", criterion=criterion)
+    ai_analyzer._request_analysis("Packed sections.", section_headers=["A", "B"], criterion=4)
+    assert len({messages[0]["content"] for messages in requests}) == 1
+    assert requests[0][0] == {"role": "system", "content": ai_analyzer.get_analysis_system_prompt()}
+    # Only the user message depends on the criterion.
+    assert len({messages[1]["content"] for messages in requests}) == len(requests)
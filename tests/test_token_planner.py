@@ -0,0 +1,111 @@
+import token_planner
+from token_planner import (
+    MAX_PACK_SECTIONS, SECTION_MARKER, count_tokens, match_sections, pack_sections, plan_requests, split_text,
+)
+
+
+def _paragraph(number, sentences=8):
+    return " ".join(f"Paragraph {number} sentence {i} describes the petitioner's work." for i in range(sentences))
+
+
+def _section(criterion_words, sentences=3):
+    # Long enough to be analyzed (over MIN_SEGMENT_CHARS), short enough to be packed.
+    return " ".join(f"The petitioner {criterion_words} as described in sentence {i}." for i in range(sentences))
+
+
+def test_split_text_keeps_short_text_whole():
+    text = _paragraph(1)
+    assert split_text(text, max_tokens=1000) == [text]
+
+
+def test_split_text_respects_the_limit_at_paragraph_boundaries():
+    paragraphs = [_paragraph(n) for n in range(20)]
+    chunks = split_text("\n\n".join(paragraphs), max_tokens=300, overlap_tokens=50)
+    assert len(chunks) > 1
+    for number, chunk in enumerate(chunks):
+        assert count_tokens(chunk) <= 300
+        parts = chunk.split("\n\n")
+        # The overlap may be just the last sentences of the previous paragraph.
+        if number:
+            assert any(p.endswith(parts[0]) for p in paragraphs)
+            parts = parts[1:]
+        assert all(part in paragraphs for part in parts)
+    assert set(paragraphs) <= {p for chunk in chunks for p in chunk.split("\n\n")}
+
+
+def test_split_text_repeats_trailing_context():
+    paragraphs = [_paragraph(n, sentences=2) for n in range(30)]
+    chunks = split_text("\n\n".join(paragraphs), max_tokens=200, overlap_tokens=60)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk.split("\n\n")[0] in previous.split("\n\n")
+
+
+def test_split_text_cuts_a_run_on_block():
+    text = "word," * 2000
+    chunks = split_text(text, max_tokens=100, overlap_tokens=0)
+    assert len(chunks) > 1
+    assert "".join(chunks) == text
+
+
+def test_plan_requests_splits_large_segments_into_numbered_parts():
+    segments = {"Criterion 5: Original Contributions": "\n\n".join(_paragraph(n) for n in range(40))}
+    requests, skipped = plan_requests(segments, max_tokens=400, pack_below=100)
+    assert skipped == []
+    assert len(requests) > 1
+    assert [r.part for r in requests] == list(range(1, len(requests) + 1))
+    assert all(r.part_count == len(requests) and r.tokens <= 400 and r.criterion == 5 for r in requests)
+
+
+def test_plan_requests_packs_small_segments_of_the_same_criterion():
+    segments = {
+        "Criterion 4: Judging": _section("reviewed manuscripts for journals"),
+        "Criterion 4: Judging (continued)": _section("served on a grant review panel"),
+        "Criterion 6: Scholarly Articles": _section("authored scholarly articles"),
+        "Note": "Too short.",
+    }
+    requests, skipped = plan_requests(segments, max_tokens=4000, pack_below=800)
+    assert skipped == ["Note"]
+    assert [r.headers for r in requests] == [
+        ["Criterion 4: Judging", "Criterion 4: Judging (continued)"],
+        ["Criterion 6: Scholarly Articles"],
+    ]
+    assert [r.criterion for r in requests] == [4, 6]
+    assert requests[0].text.count(SECTION_MARKER) == 2
+    assert requests[1].text == segments["Criterion 6: Scholarly Articles"]
+
+
+def test_plan_requests_limits_sections_per_pack():
+    segments = {f"Criterion 4: Judging part {n}": _section("reviewed manuscripts")
+                for n in range(MAX_PACK_SECTIONS + 1)}
+    requests, _ = plan_requests(segments, max_tokens=4000, pack_below=800)
+    assert [len(r.headers) for r in requests] == [MAX_PACK_SECTIONS, 1]
+
+
+def test_plan_requests_limits_tokens_per_pack(monkeypatch):
+    section = _section("reviewed manuscripts")
+    monkeypatch.setattr(token_planner, "MAX_PACK_TOKENS", count_tokens(section) * 2)
+    segments = {f"Criterion 4: Judging part {n}": section for n in range(3)}
+    requests, _ = plan_requests(segments, max_tokens=4000, pack_below=800)
+    assert [len(r.headers) for r in requests] == [2, 1]
+
+
+def test_plan_requests_does_not_pack_unrouted_segments():
+    segments = {f"Background {n}": _section("grew up by the sea") for n in range(2)}
+    requests, _ = plan_requests(segments, max_tokens=4000, pack_below=800)
+    assert [r.headers for r in requests] == [["Background 0"], ["Background 1"]]
+    assert all(r.criterion is None for r in requests)
+
+
+def test_match_sections_tolerates_markup_and_case():
+    headers = ["Criterion 4: Judging", "Criterion 6: Articles"]
+    found = match_sections([
+        (f"{SECTION_MARKER}criterion 4:  JUDGING", "a"),
+        ("**Criterion 6: Articles**", "b"),
+        ("Criterion 6: Articles", "duplicate"),
+        ("Criterion 8: Leading Role", "unknown"),
+    ], headers)
+    assert found == {"Criterion 4: Judging": "a", "Criterion 6: Articles": "b"}
+
+
+def test_pack_sections_introduces_each_section():
+    assert pack_sections([("A", " one "), ("B", "two")]) == f"{SECTION_MARKER}A\none\n\n{SECTION_MARKER}B\ntwo"